@@ -0,0 +1,75 @@
+import argparse
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.kino_geocode import KinoGeocode, GeonamesArrays
+
+def synthetic_geo_data(count):
+    """Rows shaped like the geonames pickle (see geo_data_field_names)"""
+    random.seed(0)
+    location_types = ['city', 'place', 'country', 'admin1', 'admin2', 'admin3']
+    rows = []
+    for i in range(count):
+        official_name = f'Place {i // 5}'
+        rows.append([
+            f'place name {i}', official_name, random.choice(['CH', 'DE', 'US', 'FR', float('nan')]),
+            random.uniform(-180, 180), random.uniform(-90, 90), str(1000000 + i // 5),
+            random.choice(location_types), random.randint(0, 10_000_000),
+        ])
+    return rows
+
+def measure(geo_format, path, lookups):
+    """Load the geonames data in a fresh process; returns (load seconds, RSS increase in MB)"""
+    code = (
+        'import pickle, os, sys, time, random\n'
+        f'sys.path.insert(0, {project_root!r})\n'
+        'from src.util.kino_geocode import GeonamesArrays\n'
+        'rss = lambda: int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")\n'
+        'before = rss()\n'
+        'start = time.perf_counter()\n'
+        f'if {geo_format!r} == "pickle":\n'
+        f'    geo_data = pickle.load(open({path!r}, "rb"))\n'
+        'else:\n'
+        f'    geo_data = GeonamesArrays({path!r})\n'
+        'elapsed = time.perf_counter() - start\n'
+        f'for idx in random.sample(range(len(geo_data)), {lookups}):\n'
+        '    geo_data[idx]\n'
+        'print(elapsed, (rss() - before) / 1024 / 1024)\n'
+    )
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    elapsed, rss = output.split()
+    return float(elapsed), float(rss)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare load time and RSS of the pickled geonames list and the memory-mapped arrays")
+    parser.add_argument("--synthetic", type=int, help="Benchmark N synthetic rows instead of the real geonames cache")
+    parser.add_argument("--lookups", type=int, default=10_000, help="Random rows read after loading")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            geo_data = synthetic_geo_data(args.synthetic)
+            pickle_path = os.path.join(tmp_dir, 'geonames.pkl')
+            arrays_path = os.path.join(tmp_dir, 'geonames.arrays')
+            with open(pickle_path, 'wb') as f:
+                pickle.dump(geo_data, f)
+            GeonamesArrays.write(arrays_path, KinoGeocode().geo_data_field_names, geo_data)
+            del geo_data
+        else:
+            gc = KinoGeocode(large_city_population_cutoff=5000, geonames_format='mmap')
+            gc.load()
+            pickle_path = gc.geonames_pickle_path
+            arrays_path = gc.geonames_arrays_path
+
+        for geo_format, path in [('pickle', pickle_path), ('mmap', arrays_path)]:
+            elapsed, rss = measure(geo_format, path, args.lookups)
+            print(f"{geo_format:>6}: load {elapsed * 1000:,.1f} ms, RSS +{rss:,.1f} MB")
@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+from contextlib import redirect_stdout
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+def load_script(name):
+    """Import scripts/<name>.py, which is not importable by name because of the dash"""
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(project_root, 'scripts', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+preprocess_fb = load_script('preprocess-fb')
+generate_facebook_dump = load_script('generate-facebook-dump')
+
+BENCHMARKS = ['preprocess', 'geocode_load', 'decode', 'loader']
+
+# Geocoder settings of src/loader/facebook.py
+GEOCODE_CUTOFF = 5000
+
+
+def rate(count, seconds):
+    return {'count': count, 'seconds': round(seconds, 3), 'per_second': round(count / seconds, 1)}
+
+
+def benchmark_preprocess(dump_path, lines, country_code):
+    """convert_line and convert_lines on lines in memory, then preprocess_facebook_data end to end"""
+    results = {}
+    start = time.perf_counter()
+    for line in lines:
+        preprocess_fb.convert_line(line, country_code)
+    results['convert_line'] = rate(len(lines), time.perf_counter() - start)
+
+    batch_size = preprocess_fb.DEFAULT_BATCH_SIZE
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        preprocess_fb.convert_lines(lines[i:i + batch_size], country_code)
+    results['convert_lines'] = rate(len(lines), time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        # Malformed lines are reported on stdout
+        with redirect_stdout(io.StringIO()):
+            preprocess_fb.preprocess_facebook_data(dump_path, os.path.join(tmp_dir, 'out.csv'), country_code)
+        results['preprocess_facebook_data'] = rate(len(lines), time.perf_counter() - start)
+    return results
+
+
+def measure_geocode_load(geonames_format, locations):
+    """Load the geocoder in a fresh process and decode locations once; returns load and first decode seconds
+    and the RSS increase in MB.
+
+    The mmap format reads the keyword trie lazily, the first decode includes the parts it reads.
+    """
+    code = (
+        'import json, os, sys, time\n'
+        f'sys.path.insert(0, {project_root!r})\n'
+        'from src.util.kino_geocode import KinoGeocode\n'
+        'rss = lambda: int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")\n'
+        'locations = json.load(sys.stdin)\n'
+        f'gc = KinoGeocode(large_city_population_cutoff={GEOCODE_CUTOFF}, geonames_format={geonames_format!r})\n'
+        'before = rss()\n'
+        'start = time.perf_counter()\n'
+        'gc.load()\n'
+        'loaded = time.perf_counter()\n'
+        'for text in locations:\n'
+        '    gc.decode(text)\n'
+        'print(loaded - start, time.perf_counter() - loaded, (rss() - before) / 1024 / 1024)\n'
+    )
+    process = subprocess.run([sys.executable, '-c', code], input=json.dumps(locations), capture_output=True, text=True)
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()[-1]
+        # Keep the type of a missing geonames cache, which skips the benchmark
+        if error.startswith('urllib.error.URLError'):
+            raise urllib.error.URLError(error)
+        if error.startswith('FileNotFoundError'):
+            raise FileNotFoundError(error)
+        raise RuntimeError(error)
+    elapsed, decode_elapsed, rss = process.stdout.split()[-3:]
+    return {'seconds': round(float(elapsed), 3), 'first_decode_seconds': round(float(decode_elapsed), 3), 'rss_mb': round(float(rss), 1)}
+
+
+def benchmark_geocode_load(locations):
+    # mmap first: it writes the arrays and the keyword trie from the pickles if they're missing, which shouldn't be timed twice
+    measure_geocode_load('mmap', [])
+    return {geonames_format: measure_geocode_load(geonames_format, locations) for geonames_format in ['pickle', 'mmap']}
+
+
+def benchmark_decode(locations, count):
+    from src.util.kino_geocode import KinoGeocode
+    gc = KinoGeocode(large_city_population_cutoff=GEOCODE_CUTOFF, geonames_format='mmap')
+    gc.load()
+    texts = (locations * (count // len(locations) + 1))[:count]
+    results = {}
+    start = time.perf_counter()
+    for text in texts:
+        gc.decode(text)
+    results['decode'] = rate(len(texts), time.perf_counter() - start)
+    start = time.perf_counter()
+    gc.decode_batch(texts)
+    results['decode_batch'] = rate(len(texts), time.perf_counter() - start)
+    gc.close()
+    return results
+
+
+def benchmark_loader(csv_path, rows):
+    """load_facebook_data into a new SQLite database, through the ORM and with bulk=True"""
+    # Importing the loader loads the geocoder
+    from src.loader.facebook import load_facebook_data
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, bulk in [('orm', False), ('bulk', True)]:
+            db_url = f'sqlite:///{os.path.join(tmp_dir, f"{name}.db")}'
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                load_facebook_data(csv_path, db_url, bulk=bulk)
+            results[name] = rate(rows, time.perf_counter() - start)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=project_root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """{'preprocess': {'convert_line': {'per_second': 1}}} -> {'preprocess.convert_line.per_second': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Print every measurement of current next to baseline, with the ratio"""
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    print(f"Compared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['timestamp']}):")
+    for key in sorted(new):
+        if key.endswith('.count') or key not in old or not old[key]:
+            continue
+        print(f"  {key:<50} {old[key]:>14,.1f} -> {new[key]:>14,.1f} ({new[key] / old[key]:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, geocoding and loading on a synthetic dump, writing the results as JSON")
+    parser.add_argument("--output", default='benchmark-ingest.json', help="Path of the JSON results")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--only", nargs='+', choices=BENCHMARKS, help="Benchmarks to run (default: all)")
+    parser.add_argument("--lines", type=int, default=500_000, help="Lines of the synthetic dump")
+    parser.add_argument("--loader-rows", type=int, default=20_000, help="Rows loaded into SQLite")
+    parser.add_argument("--decode-count", type=int, default=50_000, help="Location strings geocoded")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--country-code", default="CH")
+    args = parser.parse_args()
+
+    selected = args.only or BENCHMARKS
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generator = generate_facebook_dump.DumpGenerator(args.seed)
+        dump_path = os.path.join(tmp_dir, 'dump.txt')
+        csv_path = os.path.join(tmp_dir, 'loader.csv')
+        generate_facebook_dump.write_dump(dump_path, args.lines, args.seed)
+        generate_facebook_dump.write_loader_csv(csv_path, args.loader_rows, args.seed)
+        with open(dump_path, encoding='utf-8') as f:
+            lines = f.readlines()
+
+        benchmarks = {
+            'preprocess': lambda: benchmark_preprocess(dump_path, lines, args.country_code),
+            'geocode_load': lambda: benchmark_geocode_load(generator.locations),
+            'decode': lambda: benchmark_decode(generator.locations, args.decode_count),
+            'loader': lambda: benchmark_loader(csv_path, args.loader_rows),
+        }
+        for name in selected:
+            print(f"Running {name}...", file=sys.stderr)
+            try:
+                results[name] = benchmarks[name]()
+            except (FileNotFoundError, urllib.error.URLError) as e:
+                # The geocoder needs the geonames cache (downloaded on first use), any other error is a real failure
+                results[name] = {'skipped': f'{type(e).__name__}: {e}'}
+            print(json.dumps({name: results[name]}, indent=2, ensure_ascii=False))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parameters': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.db.model import Base, Entity, Person, EntityIdentifier
+from src.db.bulk import bulk_insert
+from src.db.lookup import lookup_identifiers
+from src.util.identifiers import normalize_identifier
+
+def populate(session, persons):
+    """Insert persons synthetic persons, each with a phone, an email and a user id"""
+    connection = session.connection()
+    for start in range(1, persons + 1, 50_000):
+        ids = range(start, min(start + 50_000, persons + 1))
+        bulk_insert(connection, Entity.__table__, ['id', 'type', 'name'], [(i, 'person', f'First{i} Last{i}') for i in ids])
+        bulk_insert(connection, Person.__table__, ['entity_id', 'first_name', 'last_name'], [(i, f'First{i}', f'Last{i}') for i in ids])
+        bulk_insert(connection, EntityIdentifier.__table__, ['entity_id', 'identifier_type', 'identifier_value'],
+                    [(i, id_type, normalize_identifier(id_type, value)) for i in ids
+                     for id_type, value in [('phone', 41580000000 + i), ('email', f'user{i}@example.org'), ('user_id', 100000 + i)]])
+    session.commit()
+
+def sample_identifiers(persons, count):
+    """count lookups, about half of them for unknown values, written the way users type them"""
+    random.seed(0)
+    identifiers = []
+    for _ in range(count):
+        i = random.randint(1, persons * 2)
+        id_type = random.choice(['phone', 'email', 'user_id'])
+        value = {'phone': f'+41 {41580000000 + i - 41000000000}', 'email': f'User{i}@Example.org', 'user_id': str(100000 + i)}[id_type]
+        identifiers.append((id_type, value))
+    return identifiers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched identifier lookups against one query per identifier")
+    parser.add_argument("--db-url", help="SQLAlchemy URL of an empty database (default: a temporary SQLite file)")
+    parser.add_argument("--persons", type=int, default=200_000, help="Synthetic persons inserted before the benchmark")
+    parser.add_argument("--lookups", type=int, default=100_000, help="Identifiers looked up")
+    parser.add_argument("--single", type=int, default=2_000, help="Identifiers looked up one query at a time (extrapolated)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(args.db_url or f'sqlite:///{os.path.join(tmp_dir, "lookup.db")}')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        start = time.perf_counter()
+        populate(session, args.persons)
+        print(f"Inserted {args.persons:,} persons in {time.perf_counter() - start:,.1f} s")
+
+        identifiers = sample_identifiers(args.persons, args.lookups)
+
+        start = time.perf_counter()
+        found = lookup_identifiers(session, identifiers)
+        elapsed = time.perf_counter() - start
+        print(f"batched: {len(identifiers):,} lookups ({len(found):,} found) in {elapsed:,.2f} s, {len(identifiers) / elapsed:,.0f} lookups/s")
+        session.expunge_all()
+
+        start = time.perf_counter()
+        for identifier in identifiers[:args.single]:
+            lookup_identifiers(session, [identifier])
+        elapsed = time.perf_counter() - start
+        print(f" single: {args.single:,} lookups in {elapsed:,.2f} s, {args.single / elapsed:,.0f} lookups/s "
+              f"(~{len(identifiers) / args.single * elapsed:,.0f} s for {len(identifiers):,})")
+        session.close()
@@ -0,0 +1,38 @@
+import argparse
+import importlib.util
+import os
+import time
+
+# preprocess-fb.py is not importable by name because of the dash
+spec = importlib.util.spec_from_file_location('preprocess_fb', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocess-fb.py'))
+preprocess_fb = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(preprocess_fb)
+
+def benchmark_convert_line(lines, country_code):
+    start = time.perf_counter()
+    for line in lines:
+        preprocess_fb.convert_line(line, country_code)
+    return len(lines) / (time.perf_counter() - start)
+
+def benchmark_convert_lines(lines, country_code, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        preprocess_fb.convert_lines(lines[i:i + batch_size], country_code)
+    return len(lines) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-line and batched conversion throughput")
+    parser.add_argument("input_file", help="Path to a raw Facebook dump (lines are repeated to reach --lines)")
+    parser.add_argument("--lines", type=int, default=500_000, help="Number of lines to convert")
+    parser.add_argument("--batch-size", type=int, default=preprocess_fb.DEFAULT_BATCH_SIZE, help="Lines per batch for convert_lines")
+    parser.add_argument("--country-code", default="CH")
+    args = parser.parse_args()
+
+    with open(args.input_file, 'r') as f:
+        sample = f.readlines()
+    lines = (sample * (args.lines // len(sample) + 1))[:args.lines]
+
+    per_line = benchmark_convert_line(lines, args.country_code)
+    batched = benchmark_convert_lines(lines, args.country_code, args.batch_size)
+    print(f"convert_line:  {per_line:,.0f} lines/sec")
+    print(f"convert_lines: {batched:,.0f} lines/sec ({batched / per_line:.1f}x)")
@@ -0,0 +1,187 @@
+import argparse
+import bz2
+import csv
+import gzip
+import lzma
+import os
+import random
+import sys
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+SAMPLE_PATH = os.path.join(project_root, 'data', 'sample-facebook.txt')
+
+FIRST_NAMES = ['André', 'Valeria', 'Tahir', 'Sandro', 'Zsombor', 'Lajos', 'Ionut', 'Guillaume', 'Rolf', 'Erblin', 'Jakob J.',
+               'Ceni', 'Nuhi', 'Jorge', 'Şükrü', 'Łukasz', 'Françoise', 'Søren', 'Ægir', 'Jörg', 'Zoë', 'Ñusta', 'Dženan',
+               'Иван', 'Ольга', 'Αλέξανδρος', 'محمد', 'יעל', '李娜', 'Nguyễn', 'Thảo', 'Mjd', 'Itzzy']
+LAST_NAMES = ['Grünwald', 'Oliveri', 'Can', 'Trovato', 'Péter', 'Kossz', 'Cozmoi', 'Bonjour', 'Wenger', 'Haziraj', 'Bäbler',
+              'Krasniqi', 'Guraziu', 'Schönenberger', 'Müller', 'Öztürk', 'Wiśniewski', 'Dvořák', 'Ó Briain', 'Čapek',
+              'Петров', 'Παπαδόπουλος', 'العلي', 'כהן', '王', 'Trần', 'Lehmann', 'Jensen']
+RELATIONSHIP_STATUSES = ['', '', '', 'Single', 'Married', 'In a relationship', 'Engaged', "It's complicated", 'Divorced', 'Widowed']
+WORKPLACES = ['', '', '', 'Logitech', 'UBS', 'Bechtle AG', 'Palazzo Versace', 'smart dynamic ag', 'PT.MMI', 'Svájc', 'Migros', 'Nestlé']
+EMAIL_DOMAINS = ['gmail.com', 'bluewin.ch', 'hotmail.com', 'gmx.ch', 'yahoo.fr']
+
+# Loader column values for the relationship statuses of the dump (see Person.relationship_status)
+LOADER_RELATIONSHIP_STATUSES = {
+    'Single': 'single', 'Married': 'married', 'In a relationship': 'in_relationship', 'Engaged': 'engaged',
+    "It's complicated": 'its_complicated', 'Divorced': 'divorced', 'Widowed': 'widowed',
+}
+LOADER_HEADER = ['phone', 'facebook_id', 'first_name', 'last_name', 'gender', 'current_location', 'origin_location',
+                 'relationship_status', 'workplace', 'email', 'raw']
+
+
+def sample_locations():
+    """Location strings of the sample dump"""
+    locations = set()
+    with open(SAMPLE_PATH, encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split(':')
+            locations.update(part for part in parts[5:7] if part)
+    return sorted(locations)
+
+
+def geonames_locations(count, seed=0):
+    """count location strings ('Zürich, Switzerland', 'Baia Mare') drawn from the local geonames data.
+
+    Returns None if the geonames data can't be loaded (it is downloaded on first use).
+    """
+    try:
+        from src.util.kino_geocode import KinoGeocode
+        gc = KinoGeocode(large_city_population_cutoff=5000, geonames_format='mmap')
+        gc.load()
+    except Exception as e:
+        print(f"Geonames data not available ({e}), using the sample locations", file=sys.stderr)
+        return None
+    fields = gc.geo_data_field_names
+    official_name, country_code, location_type = (fields.index(name) for name in ('official_name', 'country_code', 'location_type'))
+    rng = random.Random(seed)
+    rows = [gc.geo_data[idx] for idx in rng.sample(range(len(gc.geo_data)), min(len(gc.geo_data), count * 3))]
+    countries = {row[country_code]: row[official_name] for row in rows if row[location_type] == 'country'}
+    locations = []
+    for row in rows:
+        if row[location_type] not in ('city', 'place'):
+            continue
+        country = countries.get(row[country_code])
+        locations.append(f'{row[official_name]}, {country}' if country and rng.random() < 0.6 else row[official_name])
+    return locations[:count] or None
+
+
+class DumpGenerator:
+    """Random persons in the colon separated format of data/sample-facebook.txt.
+
+    Values follow the distribution of the sample (many empty fields, non-ASCII names, placeholder
+    timestamps). About malformed_rate of the lines are broken the ways real dumps are: a field
+    containing ':' or a truncated line.
+    """
+    def __init__(self, seed=0, malformed_rate=0.005, locations=None):
+        self.rng = random.Random(seed)
+        self.malformed_rate = malformed_rate
+        self.locations = locations or sample_locations()
+
+    def person(self, index):
+        rng = self.rng
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        gender = rng.choice(['male', 'female', 'male', 'female', ''])
+        current_location = rng.choice(self.locations) if rng.random() < 0.5 else ''
+        origin_location = rng.choice(self.locations) if rng.random() < 0.3 else ''
+        email = ''
+        if rng.random() < 0.1:
+            email = f'{first_name}.{last_name}@{rng.choice(EMAIL_DOMAINS)}'.lower().replace(' ', '')
+        return {
+            'phone': str(41580000000 + index),
+            'facebook_id': str(100000000000000 + index if rng.random() < 0.8 else 500000000 + index),
+            'first_name': first_name,
+            'last_name': last_name,
+            'gender': gender,
+            'current_location': current_location,
+            'origin_location': origin_location,
+            'relationship_status': rng.choice(RELATIONSHIP_STATUSES),
+            'workplace': rng.choice(WORKPLACES),
+            'email': email,
+        }
+
+    def timestamp(self):
+        rng = self.rng
+        if rng.random() < 0.2:
+            return '1/1/0001 12:00:00 AM'
+        if rng.random() < 0.05:
+            return ''
+        hour = rng.randint(1, 12)
+        return f'{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(2010, 2019)} {hour}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} {rng.choice(["AM", "PM"])}'
+
+    def birthday(self):
+        rng = self.rng
+        roll = rng.random()
+        if roll < 0.85:
+            return ''
+        if roll < 0.95:
+            return f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}'
+        return f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1940, 2005)}'
+
+    def line(self, person):
+        fields = [person['phone'], person['facebook_id'], person['first_name'], person['last_name'], person['gender'],
+                  person['current_location'], person['origin_location'], person['relationship_status'], person['workplace'],
+                  self.timestamp(), person['email'], self.birthday()]
+        line = ':'.join(fields)
+        if self.rng.random() < self.malformed_rate:
+            if self.rng.random() < 0.5:
+                fields[8] = 'Team: ' + (fields[8] or 'Marketing')
+                line = ':'.join(fields)
+            else:
+                line = line[:self.rng.randint(5, max(6, len(line) // 2))]
+        return line
+
+    def lines(self, count):
+        for index in range(count):
+            yield self.line(self.person(index))
+
+    def loader_rows(self, count):
+        """Rows in the CSV layout read by src/loader/facebook.py"""
+        for index in range(count):
+            person = self.person(index)
+            raw = self.line(person)
+            yield dict(person, relationship_status=LOADER_RELATIONSHIP_STATUSES.get(person['relationship_status'], ''), raw=raw)
+
+
+def open_output(path):
+    """Open path for writing text, compressed according to its extension (.gz, .xz, .bz2)"""
+    opener = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}.get(os.path.splitext(path)[1], open)
+    return opener(path, 'wt', encoding='utf-8', newline='')
+
+
+def write_dump(path, count, seed=0, malformed_rate=0.005, locations=None):
+    generator = DumpGenerator(seed, malformed_rate, locations)
+    with open_output(path) as f:
+        for line in generator.lines(count):
+            f.write(line)
+            f.write('\n')
+
+
+def write_loader_csv(path, count, seed=0, malformed_rate=0.005, locations=None):
+    generator = DumpGenerator(seed, malformed_rate, locations)
+    with open_output(path) as f:
+        writer = csv.DictWriter(f, fieldnames=LOADER_HEADER)
+        writer.writeheader()
+        writer.writerows(generator.loader_rows(count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Facebook dump for benchmarks")
+    parser.add_argument("output_file", help="Output path (.gz, .xz or .bz2 to compress)")
+    parser.add_argument("--lines", type=float, default=1.0, help="Number of lines, in millions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0.005, help="Fraction of malformed lines")
+    parser.add_argument("--geonames", action="store_true", help="Draw locations from the geonames data instead of the sample dump")
+    parser.add_argument("--loader-csv", action="store_true", help="Write the CSV layout read by src/loader/facebook.py instead of the raw dump")
+    args = parser.parse_args()
+
+    count = int(args.lines * 1_000_000)
+    locations = geonames_locations(10_000, args.seed) if args.geonames else None
+    if args.loader_csv:
+        write_loader_csv(args.output_file, count, args.seed, args.malformed_rate, locations)
+    else:
+        write_dump(args.output_file, count, args.seed, args.malformed_rate, locations)
+    print(f"Wrote {count:,} lines to {args.output_file}")
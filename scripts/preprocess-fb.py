@@ -1,13 +1,38 @@
-import csv
+import io
+import os
 import re
+import sys
 import argparse
+import logging
+import multiprocessing
+import threading
+import time
 from uuid_extensions import uuid7str
 from datetime import datetime
 from tqdm import tqdm
+import numpy as np
+import pandas as pd
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.clickhouse_format import RecordsWriter, RECORDS_COLUMNS, FORMATS, COMPRESSIONS, DEFAULT_COMPRESSION
+from src.util.input_stream import open_input, expand_inputs, input_size, is_plain_file, bytes_consumed
+from src.util.metrics import Metrics, metrics, add_arguments as add_metrics_arguments, instrumented
 
 SENTINEL_DATE = ''
 SENTINEL_DATETIME = ''
 
+TIMESTAMP_PATTERN = r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}:\d{2}\s+[AP]M)'
+
+HEADER = [name for name, _ in RECORDS_COLUMNS]
+
+# Default size of the byte ranges handed to worker processes
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+# Default number of lines converted at once by convert_lines
+DEFAULT_BATCH_SIZE = 100_000
+
 def format_date(date_string):
     try:
         # Only parse dates with year
@@ -16,13 +41,35 @@ def format_date(date_string):
     except ValueError:
         return SENTINEL_DATE
 
+def format_timestamp(timestamp):
+    try:
+        parsed_timestamp = datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
+    except ValueError:
+        return SENTINEL_DATETIME
+    if 1900 <= parsed_timestamp.year <= 2299:
+        return parsed_timestamp.isoformat(sep=' ', timespec='milliseconds')
+    return SENTINEL_DATETIME
+
 def generate_uuid():
     return uuid7str()
 
+def generate_uuids(count):
+    """Generate count UUIDv7 strings sharing one millisecond timestamp, with random bits from a single urandom call"""
+    data = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+    timestamp_ms = time.time_ns() // 1_000_000
+    data[:, :6] = np.frombuffer(timestamp_ms.to_bytes(6, 'big'), dtype=np.uint8)
+    data[:, 6] = (data[:, 6] & 0x0F) | 0x70  # version 7
+    data[:, 8] = (data[:, 8] & 0x3F) | 0x80  # RFC 4122 variant
+    digits = data.tobytes().hex()
+    return [
+        f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ]
+
 def convert_line(line, country_code):
     original_line = line.strip()
     # Use regex to find the timestamp pattern at the end of the line
-    match = re.search(r'(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}:\d{2}\s+[AP]M)', line)
+    match = re.search(TIMESTAMP_PATTERN, line)
     if match:
         timestamp = match.group(1)
         # Remove the timestamp from the line, but keep the rest
@@ -36,18 +83,7 @@ def convert_line(line, country_code):
     if len(parts) != 12:
         return None
     
-    try:
-        if timestamp:
-            parsed_timestamp = datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
-            year = parsed_timestamp.year
-            if 1900 <= year <= 2299:
-                formatted_timestamp = parsed_timestamp.isoformat(sep=' ', timespec='milliseconds')
-            else:
-                formatted_timestamp = SENTINEL_DATETIME
-        else:
-            formatted_timestamp = SENTINEL_DATETIME
-    except ValueError:
-        formatted_timestamp = SENTINEL_DATETIME
+    formatted_timestamp = format_timestamp(timestamp) if timestamp else SENTINEL_DATETIME
     
     # Handle email, birthday, and workplace
     email = parts[10]
@@ -80,41 +116,276 @@ def convert_line(line, country_code):
         country_code,  # country_code
     ]
 
-def preprocess_facebook_data(input_file, output_file, country_code):
-    # Count the number of lines in the input file
-    with open(input_file, 'r') as f:
-        total_lines = sum(1 for _ in f)
-
-    with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
-        csv_writer = csv.writer(outfile, quoting=csv.QUOTE_MINIMAL)
-        
-        # Write header
-        csv_writer.writerow([
-            'uuid', 'origin', 'dataset', 'ingestion_time', 'origin_time', 'type', 'raw',
-            'name', 'first_name', 'last_name', 'phone', 'email', 'origin_id',
-            'current_location', 'birth_location', 'date_of_birth', 'relationship_status',
-            'workplace', 'country_code'
-        ])
-        
-        # Create progress bar
-        pbar = tqdm(total=total_lines, desc="Processing", unit="line")
-        
-        for line in infile:
-            pbar.update(1)  # Update progress bar
-            row = convert_line(line, country_code)
-            if row:
-                csv_writer.writerow(row)
-            else:
-                print(f"Skipping malformed line: {line.strip()}")
-        
+def convert_lines(lines, country_code):
+    """Convert a batch of lines at once, column by column.
+
+    Produces the same columns as convert_line, but timestamps and birthdays are parsed once per
+    distinct value, the ingestion time is taken once per batch and the UUIDs are generated in bulk.
+    Returns a tuple (columns, malformed) where columns is a list of 19 lists in HEADER order and
+    malformed the stripped lines that did not have 12 fields.
+    """
+    lines = pd.Series(lines, dtype=object)
+    original_lines = lines.str.strip()
+    # Split off the first timestamp and glue the rest of the line back together
+    pieces = lines.str.extract(r'(?s)^(.*?)' + TIMESTAMP_PATTERN + r'(.*)$')
+    has_timestamp = pieces[1].notna()
+    timestamps = pieces[1].where(has_timestamp, '')
+    lines = lines.where(~has_timestamp, pieces[0].str.strip() + pieces[2].str.strip())
+
+    # Only lines with exactly 12 colon separated fields are valid
+    valid = lines.str.count(':') == 11
+    malformed = original_lines[~valid].tolist()
+    lines, original_lines, timestamps = lines[valid], original_lines[valid], timestamps[valid]
+    count = len(lines)
+    if count == 0:
+        return [[] for _ in HEADER], malformed
+    parts = lines.str.split(':', expand=True)
+
+    # Parse each distinct timestamp and birthday once
+    timestamp_values = pd.unique(timestamps)
+    timestamp_map = dict(zip(timestamp_values, (format_timestamp(t) if t else SENTINEL_DATETIME for t in timestamp_values)))
+    birthday_values = pd.unique(parts[11])
+    birthday_map = dict(zip(birthday_values, (format_date(b) if b and len(b.split('/')) == 3 else SENTINEL_DATE for b in birthday_values)))
+
+    ingestion_time = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+    columns = [
+        generate_uuids(count),  # uuid
+        ['facebook'] * count,  # origin
+        ['DI-2019-08-FACEBOOK'] * count,  # dataset
+        [ingestion_time] * count,  # ingestion_time
+        timestamps.map(timestamp_map).tolist(),  # origin_time
+        ['person'] * count,  # type
+        original_lines.tolist(),  # raw
+        (parts[2] + ' ' + parts[3]).tolist(),  # name
+        parts[2].tolist(),  # first_name
+        parts[3].tolist(),  # last_name
+        parts[0].tolist(),  # phone
+        parts[10].tolist(),  # email
+        parts[1].tolist(),  # origin_id (facebook_id)
+        parts[5].tolist(),  # current_location
+        parts[6].tolist(),  # birth_location
+        parts[11].map(birthday_map).tolist(),  # date_of_birth
+        parts[7].tolist(),  # relationship_status
+        parts[8].tolist(),  # workplace
+        [country_code] * count,  # country_code
+    ]
+    return columns, malformed
+
+def convert_each(lines, country_code):
+    """Convert a batch of lines one at a time with convert_line, returns (columns, malformed) like convert_lines"""
+    rows = []
+    malformed = []
+    for line in lines:
+        row = convert_line(line, country_code)
+        if row:
+            rows.append(row)
+        else:
+            malformed.append(line.strip())
+    return ([list(column) for column in zip(*rows)] if rows else [[] for _ in HEADER]), malformed
+
+def read_batches(infile, batch_size):
+    batch = []
+    for line in infile:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def convert_and_write(writer, lines, country_code, registry, line_by_line=False):
+    """Convert a batch of lines and write it, recording timings and line counts in registry; returns the malformed lines"""
+    with registry.timer('convert'):
+        columns, malformed = (convert_each if line_by_line else convert_lines)(lines, country_code)
+    with registry.timer('write'):
+        writer.write(columns)
+    registry.count('lines_read', len(lines))
+    registry.count('lines_malformed', len(malformed))
+    return malformed
+
+def write_batch(writer, lines, country_code, line_by_line=False):
+    for line in convert_and_write(writer, lines, country_code, metrics, line_by_line):
+        print(f"Skipping malformed line: {line}")
+
+def preprocess_facebook_data(input_file, output_file, country_code, batch_size=DEFAULT_BATCH_SIZE,
+                             output_format='csv', compression='none'):
+    """Convert the input file, batch_size lines at a time.
+
+    With batch_size=None every line is converted by convert_line on its own, the rows are still
+    written DEFAULT_BATCH_SIZE lines at a time.
+
+    input_file may be compressed (.gz, .zst, .xz, .bz2) or a glob pattern of parts, see
+    src/util/input_stream.py. output_format is one of csv, rowbinary, native or parquet (see
+    src/util/clickhouse_format.py).
+    """
+    with open_input(input_file) as infile, RecordsWriter(output_file, output_format, compression) as writer:
+        # Progress is measured in input bytes, so no pass to count the lines is needed
+        pbar = tqdm(total=input_size(input_file), desc="Processing", unit="B", unit_scale=True)
+
+        for lines in metrics.timed('read', read_batches(infile, batch_size or DEFAULT_BATCH_SIZE)):
+            write_batch(writer, lines, country_code, line_by_line=not batch_size)
+            pbar.update(bytes_consumed(infile) - pbar.n)
+
         pbar.close()  # Close the progress bar
 
+def find_chunk_boundaries(input_file, chunk_size):
+    """Split the input file into byte ranges that start and end on line boundaries"""
+    file_size = os.path.getsize(input_file)
+    boundaries = [0]
+    with open(input_file, 'rb') as f:
+        while boundaries[-1] < file_size:
+            position = boundaries[-1] + chunk_size
+            if position >= file_size:
+                boundaries.append(file_size)
+                break
+            # Move forward to the end of the line the guess landed in
+            f.seek(position)
+            f.readline()
+            boundaries.append(min(f.tell(), file_size))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def shard_path(output_file, index):
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.part{index:05d}{ext or '.csv'}"
+
+def read_range(infile, start, end):
+    """Yield the decoded lines of the byte range [start, end)"""
+    infile.seek(start)
+    position = start
+    while position < end:
+        raw_line = infile.readline()
+        if not raw_line:
+            break
+        position += len(raw_line)
+        yield raw_line.decode('utf-8')
+
+def read_blocks(infile, chunk_size):
+    """Yield (block, input bytes consumed) for newline-aligned blocks of about chunk_size bytes"""
+    consumed = 0
+    while True:
+        block = infile.read(chunk_size)
+        if not block:
+            return
+        if not block.endswith(b'\n'):
+            block += infile.readline()
+        position = bytes_consumed(infile)
+        yield block, position - consumed
+        consumed = position
+
+def process_chunk(task):
+    """Convert one part of the input into an output shard (runs in a worker process).
+
+    The part is either a byte range (input_file, start, end) of a plain input file or a block of
+    already decompressed lines, converted batch_size lines at a time (line by line with convert_line if
+    batch_size is None, see preprocess_facebook_data). Returns the metrics of the chunk with the results, the parent merges them.
+    """
+    index, source, size, output_path, country_code, batch_size, output_format, compression, write_header = task
+    malformed = []
+    # A forked worker inherits a copy of the parent's registry, count into a fresh one
+    chunk_metrics = Metrics()
+    with RecordsWriter(output_path, output_format, compression, header=write_header) as writer:
+        if isinstance(source, bytes):
+            infile = None
+            lines = (raw_line.decode('utf-8') for raw_line in io.BytesIO(source))
+        else:
+            input_file, start, end = source
+            infile = open(input_file, 'rb')
+            lines = read_range(infile, start, end)
+        try:
+            for batch in chunk_metrics.timed('read', read_batches(lines, batch_size or DEFAULT_BATCH_SIZE)):
+                malformed.extend(convert_and_write(writer, batch, country_code, chunk_metrics, line_by_line=not batch_size))
+        finally:
+            if infile:
+                infile.close()
+    return index, output_path, size, malformed, chunk_metrics.state()
+
+def preprocess_facebook_data_parallel(input_file, output_file, country_code, workers,
+                                      chunk_size=DEFAULT_CHUNK_SIZE, ordered=True, merge=True,
+                                      output_format='csv', compression='none', batch_size=DEFAULT_BATCH_SIZE):
+    """Preprocess the input in newline-aligned chunks using a pool of worker processes.
+
+    A plain input file is split into byte ranges that the workers read themselves. Compressed or
+    multi-part input is decompressed by this process (in a background thread) and handed to the
+    workers in blocks of chunk_size bytes, at most two per worker in flight.
+
+    With merge=True the shards are concatenated into output_file (in input order unless
+    ordered=False), otherwise each shard is kept as output_file.partNNNNN.<ext> with its own header.
+    """
+    plain = is_plain_file(input_file)
+    infile = None
+    # Released for every finished chunk, bounds the decompressed blocks waiting for a worker
+    slots = threading.Semaphore(2 * workers)
+    # The pool's task handler thread runs tasks() and must not stay blocked on a slot after a failure,
+    # terminating the pool waits for that thread
+    stop = threading.Event()
+
+    def tasks():
+        if plain:
+            path = expand_inputs(input_file)[0]
+            sources = (((path, start, end), end - start) for start, end in find_chunk_boundaries(path, chunk_size))
+        else:
+            sources = read_blocks(infile, chunk_size)
+        for i, (source, size) in enumerate(sources):
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            yield (i, source, size, shard_path(output_file, i), country_code, batch_size, output_format, compression, not merge)
+
+    pbar = tqdm(total=input_size(input_file), desc="Processing", unit="B", unit_scale=True)
+    writer = RecordsWriter(output_file, output_format, compression) if merge else None
+
+    try:
+        if not plain:
+            infile = open_input(input_file, 'rb')
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.imap(process_chunk, tasks()) if ordered else pool.imap_unordered(process_chunk, tasks())
+            try:
+                for _, path, size, malformed, chunk_metrics in results:
+                    slots.release()
+                    metrics.merge(chunk_metrics)
+                    for line in malformed:
+                        print(f"Skipping malformed line: {line}")
+                    if merge:
+                        with metrics.timer('merge'):
+                            writer.append_file(path)
+                        os.remove(path)
+                    pbar.update(size)
+            finally:
+                # Set before the pool is terminated on leaving the with block
+                stop.set()
+    finally:
+        if infile:
+            infile.close()
+        if writer:
+            writer.close()
+        pbar.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Preprocess Facebook data")
-    parser.add_argument("input_file", help="Path to the input file")
+    parser.add_argument("input_file", help="Path to the input file (plain, .gz, .zst, .xz or .bz2), or a quoted glob pattern of parts")
     parser.add_argument("output_file", help="Path to the output file")
     parser.add_argument("country_code", help="Country code for the data")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Lines converted per batch (0 converts line by line)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default: 1, no pool)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help="Size of the byte ranges given to workers, in MB")
+    parser.add_argument("--unordered", action="store_true", help="Write chunks in completion order instead of input order")
+    parser.add_argument("--shards", action="store_true", help="Keep one output file per chunk instead of merging them")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format; rowbinary, native and parquet match the ClickHouse records table")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=None, help=f"Compression of the output stream, for parquet the codec of its column chunks "
+                        f"(default: none for csv, zstd for parquet, {DEFAULT_COMPRESSION} otherwise)")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    preprocess_facebook_data(args.input_file, args.output_file, args.country_code)
+    logging.basicConfig(level=logging.INFO)
+    compression = args.compression or {'csv': 'none', 'parquet': 'zstd'}.get(args.format, DEFAULT_COMPRESSION)
+    with instrumented(args):
+        if args.workers > 1 or args.shards:
+            preprocess_facebook_data_parallel(args.input_file, args.output_file, args.country_code, args.workers,
+                                              chunk_size=args.chunk_size * 1024 * 1024,
+                                              ordered=not args.unordered, merge=not args.shards,
+                                              output_format=args.format, compression=compression,
+                                              batch_size=args.batch_size or None)
+        else:
+            preprocess_facebook_data(args.input_file, args.output_file, args.country_code, batch_size=args.batch_size or None,
+                                     output_format=args.format, compression=compression)
     print(f"Preprocessed data saved to {args.output_file}")
@@ -21,14 +21,40 @@ CREATE TABLE IF NOT EXISTS records
     date_of_birth Date32 DEFAULT toDate32('1900-01-01'),
     relationship_status String,
     workplace String,
+    country_code String,
     
     -- Additional columns can be added here in the future
 
-    INDEX raw_lowercase(lower(raw)) TYPE full_text,
-    INDEX name_lowercase(lower(name)) TYPE full_text,
-    INDEX first_name_lowercase(lower(first_name)) TYPE full_text,
-    INDEX last_name_lowercase(lower(last_name)) TYPE full_text,
-    INDEX workplace_lowercase(lower(workplace)) TYPE full_text
+    -- Normalized search keys (see src/db/clickhouse.py), filled in on insert
+    first_name_lower String MATERIALIZED lowerUTF8(first_name),
+    last_name_lower String MATERIALIZED lowerUTF8(last_name),
+    -- National numbers (leading 0, country unknown) keep only their digits, without '+'
+    phone_normalized String MATERIALIZED multiIf(replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^00+', '') = '', '',
+        startsWith(replaceRegexpAll(phone, '\\D', ''), '00'), concat('+', replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^0+', '')),
+        startsWith(replaceRegexpAll(phone, '\\D', ''), '0'), replaceRegexpAll(phone, '\\D', ''),
+        concat('+', replaceRegexpAll(phone, '\\D', ''))),
+    email_normalized String MATERIALIZED lowerUTF8(trimBoth(email)),
+
+    INDEX raw_lowercase(lower(raw)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX name_lowercase(lower(name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX first_name_lowercase(lower(first_name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX last_name_lowercase(lower(last_name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX workplace_lowercase(lower(workplace)) TYPE text(tokenizer = 'splitByNonAlpha'),
+
+    -- Phone and email lookups read these instead of scanning the table (without raw, to keep them small)
+    PROJECTION by_phone
+    (
+        SELECT uuid, origin, dataset, ingestion_time, origin_time, type, name, first_name, last_name, phone, email, origin_id,
+               current_location, birth_location, date_of_birth, relationship_status, workplace, country_code, phone_normalized
+        ORDER BY phone_normalized
+    ),
+    PROJECTION by_email
+    (
+        SELECT uuid, origin, dataset, ingestion_time, origin_time, type, name, first_name, last_name, phone, email, origin_id,
+               current_location, birth_location, date_of_birth, relationship_status, workplace, country_code, email_normalized
+        ORDER BY email_normalized
+    )
 )
 ENGINE = MergeTree()
-ORDER BY (uuid);
+-- Name lookups use the primary key
+ORDER BY (last_name_lower, first_name_lower, uuid);
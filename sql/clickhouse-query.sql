@@ -6,10 +6,10 @@ SELECT
     name,
     origin,
     dataset,
-    ingested_at,
+    ingestion_time,
     type
 FROM records
-WHERE fuzzySearch(first_name_lowercase, lower({first_name:String})) = 1
-   OR fuzzySearch(last_name_lowercase, lower({last_name:String})) = 1
-ORDER BY ingested_at DESC
+WHERE ngramDistanceUTF8(first_name_lower, lowerUTF8({first_name:String})) < 0.3
+   OR ngramDistanceUTF8(last_name_lower, lowerUTF8({last_name:String})) < 0.3
+ORDER BY ingestion_time DESC
 LIMIT 100;
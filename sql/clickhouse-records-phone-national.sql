@@ -0,0 +1,20 @@
+-- Migration for records tables whose phone_normalized put a '+' before national numbers ('079 123 45 67'
+-- became '+0791234567'). Recomputes the column like clickhouse-ddl.sql and rebuilds the by_phone projection,
+-- which can't be kept while its sort key changes.
+ALTER TABLE records DROP PROJECTION IF EXISTS by_phone;
+
+ALTER TABLE records MODIFY COLUMN phone_normalized String MATERIALIZED multiIf(replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^00+', '') = '', '',
+    startsWith(replaceRegexpAll(phone, '\\D', ''), '00'), concat('+', replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^0+', '')),
+    startsWith(replaceRegexpAll(phone, '\\D', ''), '0'), replaceRegexpAll(phone, '\\D', ''),
+    concat('+', replaceRegexpAll(phone, '\\D', '')));
+
+ALTER TABLE records MATERIALIZE COLUMN phone_normalized SETTINGS mutations_sync = 1;
+
+ALTER TABLE records ADD PROJECTION by_phone
+(
+    SELECT uuid, origin, dataset, ingestion_time, origin_time, type, name, first_name, last_name, phone, email, origin_id,
+           current_location, birth_location, date_of_birth, relationship_status, workplace, country_code, phone_normalized
+    ORDER BY phone_normalized
+);
+
+ALTER TABLE records MATERIALIZE PROJECTION by_phone SETTINGS mutations_sync = 1;
@@ -0,0 +1,77 @@
+-- Migration for records tables created with ORDER BY (uuid), before the search keys and projections.
+-- The sort key of a MergeTree table can't be changed in place, so the rows are copied into a new table.
+RENAME TABLE records TO records_old;
+
+-- Tables from before the country_code column get it empty
+ALTER TABLE records_old ADD COLUMN IF NOT EXISTS country_code String;
+
+-- The records table of clickhouse-ddl.sql (keep both in sync)
+SET allow_experimental_full_text_index = true;
+CREATE TABLE records
+(
+    uuid UUID,
+    origin String,
+    dataset String,
+    ingestion_time DateTime64(3) DEFAULT toDateTime64('1900-01-01 00:00:00', 3),
+    origin_time DateTime64(3) DEFAULT toDateTime64('1900-01-01 00:00:00', 3),
+    type String,
+    raw String,
+    
+    -- Arbitrary attributes (can be extended later)
+    name String,
+    first_name String,
+    last_name String,
+    phone String,
+    email String,
+    origin_id String,
+    current_location String,
+    birth_location String,
+    date_of_birth Date32 DEFAULT toDate32('1900-01-01'),
+    relationship_status String,
+    workplace String,
+    country_code String,
+    
+    -- Additional columns can be added here in the future
+
+    -- Normalized search keys (see src/db/clickhouse.py), filled in on insert
+    first_name_lower String MATERIALIZED lowerUTF8(first_name),
+    last_name_lower String MATERIALIZED lowerUTF8(last_name),
+    -- National numbers (leading 0, country unknown) keep only their digits, without '+'
+    phone_normalized String MATERIALIZED multiIf(replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^00+', '') = '', '',
+        startsWith(replaceRegexpAll(phone, '\\D', ''), '00'), concat('+', replaceRegexpOne(replaceRegexpAll(phone, '\\D', ''), '^0+', '')),
+        startsWith(replaceRegexpAll(phone, '\\D', ''), '0'), replaceRegexpAll(phone, '\\D', ''),
+        concat('+', replaceRegexpAll(phone, '\\D', ''))),
+    email_normalized String MATERIALIZED lowerUTF8(trimBoth(email)),
+
+    INDEX raw_lowercase(lower(raw)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX name_lowercase(lower(name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX first_name_lowercase(lower(first_name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX last_name_lowercase(lower(last_name)) TYPE text(tokenizer = 'splitByNonAlpha'),
+    INDEX workplace_lowercase(lower(workplace)) TYPE text(tokenizer = 'splitByNonAlpha'),
+
+    -- Phone and email lookups read these instead of scanning the table (without raw, to keep them small)
+    PROJECTION by_phone
+    (
+        SELECT uuid, origin, dataset, ingestion_time, origin_time, type, name, first_name, last_name, phone, email, origin_id,
+               current_location, birth_location, date_of_birth, relationship_status, workplace, country_code, phone_normalized
+        ORDER BY phone_normalized
+    ),
+    PROJECTION by_email
+    (
+        SELECT uuid, origin, dataset, ingestion_time, origin_time, type, name, first_name, last_name, phone, email, origin_id,
+               current_location, birth_location, date_of_birth, relationship_status, workplace, country_code, email_normalized
+        ORDER BY email_normalized
+    )
+)
+ENGINE = MergeTree()
+-- Name lookups use the primary key
+ORDER BY (last_name_lower, first_name_lower, uuid);
+
+-- The search key columns and projections are filled in on insert
+INSERT INTO records (uuid, origin, dataset, ingestion_time, origin_time, type, raw, name, first_name, last_name, phone, email,
+                     origin_id, current_location, birth_location, date_of_birth, relationship_status, workplace, country_code)
+SELECT uuid, origin, dataset, ingestion_time, origin_time, type, raw, name, first_name, last_name, phone, email,
+       origin_id, current_location, birth_location, date_of_birth, relationship_status, workplace, country_code
+FROM records_old;
+
+DROP TABLE records_old;
@@ -0,0 +1,56 @@
+-- Migration for databases loaded before entity metadata was stored compactly.
+-- The loader used to store json.dumps() of the whole CSV row in entities.meta_data, a JSON column, so
+-- every person carried its row (raw line included) as one JSON string, and every location entity a copy
+-- of its geocode result. This rewrites the data the way src/loader/facebook.py now stores it:
+-- - meta_data becomes a JSON object holding only the fields not in persons / entity_identifiers / locations
+-- - raw lines go to artifacts, once per distinct line (keyed by content_hash), referenced by entities.artifact_id
+-- - location entities lose their meta_data, all of it is in locations
+BEGIN;
+
+ALTER TABLE artifacts ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+ALTER TABLE artifacts ADD CONSTRAINT artifacts_content_hash_key UNIQUE (content_hash);
+ALTER TABLE entities ADD COLUMN IF NOT EXISTS artifact_id INTEGER REFERENCES artifacts (id);
+
+UPDATE entities SET meta_data = NULL WHERE type = 'location';
+
+-- Decode the JSON strings; json.dumps wrote missing values as NaN, which is not valid JSON. Within
+-- string values a quote is escaped, so '": NaN' only matches after a key.
+UPDATE entities
+SET meta_data = regexp_replace(meta_data #>> '{}', '([^\\]": )NaN(?=[,}])', '\1null', 'g')::json
+WHERE json_typeof(meta_data) = 'string';
+
+INSERT INTO artifacts (source_id, type, content, content_hash)
+SELECT DISTINCT ON (content_hash) (SELECT id FROM sources WHERE name = 'Facebook'), 'account_dump', raw, content_hash
+FROM (
+    SELECT meta_data ->> 'raw' AS raw, sha256(convert_to(meta_data ->> 'raw', 'UTF8')) AS content_hash
+    FROM entities
+    WHERE type = 'person' AND meta_data ->> 'raw' IS NOT NULL
+) raw_lines
+ON CONFLICT (content_hash) DO NOTHING;
+
+UPDATE entities e
+SET artifact_id = a.id
+FROM artifacts a
+WHERE e.type = 'person' AND e.meta_data ->> 'raw' IS NOT NULL
+  AND a.content_hash = sha256(convert_to(e.meta_data ->> 'raw', 'UTF8'));
+
+-- Drop the fields stored elsewhere: person columns always, locations and identifiers only if they were
+-- resolved (the loader keeps e.g. a location it could not geocode), and missing values
+UPDATE entities e
+SET meta_data = jsonb_strip_nulls(
+    e.meta_data::jsonb - 'raw' - 'first_name' - 'last_name' - 'gender' - 'relationship_status'
+    - CASE WHEN p.current_location_id IS NOT NULL THEN 'current_location' ELSE '' END
+    - CASE WHEN p.origin_location_id IS NOT NULL THEN 'origin_location' ELSE '' END
+    - CASE WHEN EXISTS (SELECT 1 FROM entity_identifiers i WHERE i.entity_id = e.id AND i.identifier_type = 'phone') THEN 'phone' ELSE '' END
+    - CASE WHEN EXISTS (SELECT 1 FROM entity_identifiers i WHERE i.entity_id = e.id AND i.identifier_type = 'email') THEN 'email' ELSE '' END
+    - CASE WHEN EXISTS (SELECT 1 FROM entity_identifiers i WHERE i.entity_id = e.id AND i.identifier_type = 'user_id') THEN 'facebook_id' ELSE '' END
+)::json
+FROM persons p
+WHERE p.entity_id = e.id AND e.type = 'person' AND json_typeof(e.meta_data) = 'object';
+
+UPDATE entities SET meta_data = NULL WHERE type = 'person' AND meta_data::text = '{}';
+
+COMMIT;
+
+-- The old rows' space is reused by later writes; to return it to the operating system run (locks the table)
+-- VACUUM FULL entities;
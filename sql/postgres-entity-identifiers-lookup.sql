@@ -0,0 +1,34 @@
+-- Migration for databases loaded before identifiers were normalized and indexed.
+-- Rewrites phone numbers to E.164 (national numbers to their digits) and emails to lowercase (like
+-- src/util/identifiers.py), then adds the (identifier_type, identifier_value) and persons.entity_id indexes
+-- used by src/db/lookup.py.
+BEGIN;
+
+-- Phones read as floats were stored as '41580043456.0'. National numbers (leading 0, country unknown)
+-- keep only their digits; earlier versions stored them with a '+', running this again fixes those.
+UPDATE entity_identifiers i
+SET identifier_value = CASE
+        WHEN p.digits LIKE '00%' THEN '+' || ltrim(p.digits, '0')
+        WHEN p.digits LIKE '0%' THEN p.digits
+        ELSE '+' || p.digits
+    END
+FROM (
+    SELECT id, regexp_replace(regexp_replace(identifier_value, '\.0$', ''), '[^0-9]', '', 'g') AS digits
+    FROM entity_identifiers
+    WHERE identifier_type = 'phone' AND identifier_value !~ '^(\+[1-9][0-9]*|0|0[1-9][0-9]*)$'
+) p
+WHERE i.id = p.id;
+
+UPDATE entity_identifiers
+SET identifier_value = lower(trim(identifier_value))
+WHERE identifier_type = 'email' AND identifier_value <> lower(trim(identifier_value));
+
+UPDATE entity_identifiers
+SET identifier_value = regexp_replace(identifier_value, '\.0$', '')
+WHERE identifier_type = 'user_id' AND identifier_value ~ '^[0-9]+\.0$';
+
+COMMIT;
+
+-- Outside the transaction, so the tables stay writable while the indexes are built
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entity_identifiers_type_value ON entity_identifiers (identifier_type, identifier_value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_persons_entity_id ON persons (entity_id);
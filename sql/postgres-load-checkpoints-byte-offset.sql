@@ -0,0 +1,3 @@
+-- Migration for load_checkpoints tables created before plain input files were resumed by byte offset.
+-- Existing checkpoints have no offset, the next run of their load skips the loaded rows by count once.
+ALTER TABLE load_checkpoints ADD COLUMN IF NOT EXISTS byte_offset BIGINT;
@@ -0,0 +1,20 @@
+-- Migration for databases created before locations.geoname_id became unique.
+-- Points persons at the oldest location row of each geoname_id, removes the duplicates and adds the
+-- unique constraint the loader's INSERT ... ON CONFLICT (geoname_id) relies on.
+BEGIN;
+
+CREATE TEMPORARY TABLE duplicate_locations AS
+SELECT id, entity_id, MIN(id) OVER (PARTITION BY geoname_id) AS keep_id
+FROM locations
+WHERE geoname_id IS NOT NULL;
+
+DELETE FROM duplicate_locations WHERE id = keep_id;
+
+UPDATE persons p SET current_location_id = d.keep_id FROM duplicate_locations d WHERE p.current_location_id = d.id;
+UPDATE persons p SET origin_location_id = d.keep_id FROM duplicate_locations d WHERE p.origin_location_id = d.id;
+DELETE FROM locations WHERE id IN (SELECT id FROM duplicate_locations);
+DELETE FROM entities WHERE id IN (SELECT entity_id FROM duplicate_locations);
+
+ALTER TABLE locations ADD CONSTRAINT locations_geoname_id_key UNIQUE (geoname_id);
+
+COMMIT;
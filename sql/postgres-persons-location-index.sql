@@ -0,0 +1,5 @@
+-- Migration for databases created before the persons location ids were indexed.
+-- Adds the indexes persons_within (src/db/lookup.py) uses to find the persons of the locations near a point.
+-- Not in a transaction, so the table stays writable while the indexes are built
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_persons_current_location_id ON persons (current_location_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_persons_origin_location_id ON persons (origin_location_id);
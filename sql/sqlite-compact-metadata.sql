@@ -0,0 +1,16 @@
+-- Migration for SQLite databases loaded before entity metadata was stored compactly, see
+-- postgres-compact-metadata.sql. SQLite has no SHA-256 in SQL, so the raw lines already loaded can't be
+-- moved to artifacts here: this only adds the new columns, entities loaded before keep their whole CSV
+-- row in meta_data and entities loaded afterwards are stored compactly. To convert the old entities as
+-- well, load the input again into a new database.
+--   sqlite3 kino.db < sql/sqlite-compact-metadata.sql
+BEGIN;
+
+ALTER TABLE artifacts ADD COLUMN content_hash BLOB;
+CREATE UNIQUE INDEX IF NOT EXISTS artifacts_content_hash_key ON artifacts (content_hash);
+ALTER TABLE entities ADD COLUMN artifact_id INTEGER REFERENCES artifacts (id);
+
+-- All of it is in locations
+UPDATE entities SET meta_data = NULL WHERE type = 'location';
+
+COMMIT;
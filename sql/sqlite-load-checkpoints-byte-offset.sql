@@ -0,0 +1,4 @@
+-- Migration for load_checkpoints tables created before plain input files were resumed by byte offset,
+-- see postgres-load-checkpoints-byte-offset.sql.
+--   sqlite3 kino.db < sql/sqlite-load-checkpoints-byte-offset.sql
+ALTER TABLE load_checkpoints ADD COLUMN byte_offset BIGINT;
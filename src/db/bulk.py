@@ -0,0 +1,71 @@
+import io
+
+from sqlalchemy import func, select, text
+
+# Characters escaped in PostgreSQL COPY text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def allocate_ids(connection, table, count):
+    """Reserve count primary key values for table and return them as a list.
+
+    On PostgreSQL the values are drawn from the table's id sequence in one statement, so they never
+    collide with ids handed out to other sessions. Other dialects (SQLite) have no sequence; there the
+    block starts after the current maximum id, which is safe as long as the rows are inserted in the
+    same transaction before anything else is added to the table.
+    """
+    if count == 0:
+        return []
+    if connection.dialect.name == 'postgresql':
+        sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table.name}).scalar()
+        result = connection.execute(text('SELECT nextval(:sequence) FROM generate_series(1, :count)'), {'sequence': sequence, 'count': count})
+        return [row[0] for row in result]
+    start = (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+    return list(range(start, start + count))
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def _copy_rows(connection, table, columns, rows):
+    """Write rows with COPY ... FROM STDIN through the raw psycopg/psycopg2 connection"""
+    processors = [table.c[name].type.bind_processor(connection.dialect) for name in columns]
+    buffer = io.StringIO()
+    for row in rows:
+        values = [processor(value) if processor and value is not None else value for processor, value in zip(processors, row)]
+        buffer.write('\t'.join(_copy_value(value) for value in values))
+        buffer.write('\n')
+    statement = f'COPY {table.name} ({", ".join(columns)}) FROM STDIN'
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def supports_copy(connection):
+    return connection.dialect.name == 'postgresql' and connection.dialect.driver in ('psycopg2', 'psycopg')
+
+
+def bulk_insert(connection, table, columns, rows, use_copy=True):
+    """Insert rows (tuples ordered like columns) into table.
+
+    Uses PostgreSQL COPY when the driver supports it and a Core executemany otherwise. Column types
+    are applied the same way as for ORM inserts, so JSON and Enum values end up identical.
+    """
+    if not rows:
+        return
+    if use_copy and supports_copy(connection):
+        _copy_rows(connection, table, columns, rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
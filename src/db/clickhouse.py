@@ -0,0 +1,260 @@
+from collections import OrderedDict
+import argparse
+import base64
+import http.client
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from src.util.clickhouse_format import RECORDS_COLUMNS
+from src.util.identifiers import normalize_phone, normalize_email
+
+# Columns returned by searches; raw is left out, it is not in the phone/email projections
+SEARCH_COLUMNS = [name for name, _ in RECORDS_COLUMNS if name != 'raw']
+
+# Keys sent in one query
+KEYS_PER_QUERY = 1000
+
+
+class ClickHouseError(Exception):
+    pass
+
+
+def format_param(value):
+    """Text form of a query parameter value, as ClickHouse parses {name:Type} placeholders"""
+    if isinstance(value, (list, tuple)):
+        items = ', '.join(format_param(item) if isinstance(item, (list, tuple)) else quote(item) for item in value)
+        return f'[{items}]' if isinstance(value, list) else f'({items})'
+    return str(value)
+
+
+def quote(value):
+    if isinstance(value, str):
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    return str(value)
+
+
+class ClickHouseHTTP:
+    """Client for the ClickHouse HTTP interface that reuses up to pool_size keep-alive connections.
+
+    Safe to share between threads; at most pool_size queries run at the same time.
+    """
+    def __init__(self, url='http://localhost:8123', database='default', user=None, password=None, pool_size=4, timeout=60):
+        parsed = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.database = database
+        self.timeout = timeout
+        self.headers = {}
+        if user:
+            credentials = base64.b64encode(f'{user}:{password or ""}'.encode()).decode()
+            self.headers['Authorization'] = f'Basic {credentials}'
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def stream(self, sql, params=None):
+        """Run sql (ending in FORMAT JSONEachRow) and yield the result rows as dicts while they arrive"""
+        query = {'database': self.database}
+        query.update({f'param_{name}': format_param(value) for name, value in (params or {}).items()})
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            reusable = False
+            try:
+                connection.request('POST', '/?' + urllib.parse.urlencode(query), body=sql.encode(), headers=self.headers)
+                response = connection.getresponse()
+                if response.status != 200:
+                    raise ClickHouseError(response.read().decode(errors='replace').strip())
+                for line in response:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Errors after the first rows are appended to the body as text
+                        raise ClickHouseError(line.decode(errors='replace').strip())
+                # Reading the (empty) rest marks the response as done, so the connection can be reused
+                response.read()
+                reusable = not response.will_close
+            finally:
+                # A partially read response can't be reused
+                if reusable:
+                    self._idle.put(connection)
+                else:
+                    connection.close()
+
+
+class ChdbClient:
+    """Stand-in for ClickHouseHTTP running queries in an embedded chdb session (for tests and local files)"""
+    def __init__(self, path):
+        from chdb import session
+        self.session = session.Session(path)
+        self._lock = threading.Lock()
+
+    def stream(self, sql, params=None):
+        with self._lock:
+            result = self.session.query(sql, 'JSONEachRow', params={name: format_param(value) for name, value in (params or {}).items()})
+        for line in result.bytes().splitlines():
+            yield json.loads(line)
+
+
+class TTLCache:
+    """LRU cache whose entries also expire ttl seconds after they were stored"""
+    def __init__(self, max_size=10_000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class RecordSearch:
+    """Phone, email and name searches over the records table.
+
+    Every method takes many values at once, normalizes them like the search key columns of
+    sql/clickhouse-ddl.sql, answers what it can from the result cache and looks the rest up in queries
+    of KEYS_PER_QUERY keys, which the table's sort key (names) and projections (phones, emails) resolve
+    without a full scan. At most limit rows (newest first) are returned per value.
+    """
+    def __init__(self, client, limit=100, cache_size=10_000, cache_ttl=300):
+        self.client = client
+        self.limit = limit
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    def iter_phones(self, phones):
+        """Yield (phone, rows) for every phone, streaming query results as they arrive"""
+        return self._search('phone', phones, normalize_phone, ['phone_normalized'], 'Array(String)')
+
+    def iter_emails(self, emails):
+        return self._search('email', emails, normalize_email, ['email_normalized'], 'Array(String)')
+
+    def iter_names(self, names):
+        """names are (first_name, last_name) pairs, with first_name None to match the last name only"""
+        full_names = [name for name in names if name[0]]
+        last_names = [name for name in names if not name[0]]
+        yield from self._search('name', full_names, lambda name: (name[1].strip().lower(), name[0].strip().lower()),
+                                ['last_name_lower', 'first_name_lower'], 'Array(Tuple(String, String))')
+        yield from self._search('last_name', last_names, lambda name: name[1].strip().lower(),
+                                ['last_name_lower'], 'Array(String)')
+
+    def by_phone(self, phones):
+        return dict(self.iter_phones(phones))
+
+    def by_email(self, emails):
+        return dict(self.iter_emails(emails))
+
+    def by_name(self, names):
+        return dict(self.iter_names(names))
+
+    def _search(self, kind, values, normalize, key_columns, key_type):
+        # normalized key -> values asked for
+        pending = {}
+        for value in values:
+            key = normalize(value)
+            if not key:
+                yield value, []
+                continue
+            rows = self.cache.get((kind, key, self.limit))
+            if rows is not None:
+                yield value, rows
+            else:
+                pending.setdefault(key, []).append(value)
+
+        key_expression = key_columns[0] if len(key_columns) == 1 else f'({", ".join(key_columns)})'
+        sql = (f'SELECT {", ".join(SEARCH_COLUMNS + key_columns)} FROM records '
+               f'WHERE {key_expression} IN {{keys:{key_type}}} '
+               f'ORDER BY {", ".join(key_columns)}, ingestion_time DESC '
+               f'LIMIT {int(self.limit)} BY {", ".join(key_columns)} '
+               f'FORMAT JSONEachRow')
+        keys = list(pending)
+        for i in range(0, len(keys), KEYS_PER_QUERY):
+            batch = keys[i:i + KEYS_PER_QUERY]
+            # Rows come sorted by key, a key is complete as soon as the next one starts
+            current, rows = None, []
+            for row in self.client.stream(sql, {'keys': batch}):
+                key = tuple(row.pop(column) for column in key_columns)
+                key = key[0] if len(key) == 1 else key
+                if key != current:
+                    if current is not None:
+                        yield from self._complete(kind, current, rows, pending)
+                    current, rows = key, []
+                rows.append(row)
+            if current is not None:
+                yield from self._complete(kind, current, rows, pending)
+            for key in batch:
+                if key in pending:
+                    yield from self._complete(kind, key, [], pending)
+
+    def _complete(self, kind, key, rows, pending):
+        self.cache.put((kind, key, self.limit), rows)
+        for value in pending.pop(key, []):
+            yield value, rows
+
+
+def parse_name(value):
+    """'First Last' -> (first, last); a single word is a last name"""
+    parts = value.strip().rsplit(' ', 1)
+    return (parts[0], parts[1]) if len(parts) == 2 else (None, parts[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the ClickHouse records table by phone, email or name")
+    parser.add_argument("kind", choices=['phone', 'email', 'name'], help="What the values are")
+    parser.add_argument("values", nargs='*', help="Values to search for ('First Last' or 'Last' for names)")
+    parser.add_argument("--file", help="Read more values from a file, one per line")
+    parser.add_argument("--url", default='http://localhost:8123', help="ClickHouse HTTP interface URL")
+    parser.add_argument("--database", default='default', help="ClickHouse database")
+    parser.add_argument("--user", help="ClickHouse user")
+    parser.add_argument("--password", help="ClickHouse password")
+    parser.add_argument("--chdb", help="Query an embedded chdb database at this path instead of a server")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum rows per value")
+    args = parser.parse_args()
+
+    values = list(args.values)
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            values.extend(line.strip() for line in f if line.strip())
+
+    client = ChdbClient(args.chdb) if args.chdb else ClickHouseHTTP(args.url, database=args.database, user=args.user, password=args.password)
+    search = RecordSearch(client, limit=args.limit)
+    if args.kind == 'phone':
+        results = search.iter_phones(values)
+    elif args.kind == 'email':
+        results = search.iter_emails(values)
+    else:
+        names = {parse_name(value): value for value in values}
+        results = ((names[name], rows) for name, rows in search.iter_names(list(names)))
+
+    # One JSON line per match, written as soon as a value's rows are known
+    for value, rows in results:
+        for row in rows:
+            print(json.dumps(dict(row, query=value), ensure_ascii=False))
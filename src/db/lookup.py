@@ -0,0 +1,109 @@
+import math
+import os
+import sys
+
+import numpy as np
+from sqlalchemy import Integer, String, any_, bindparam, func, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from src.db.model import Entity, Person, EntityIdentifier, Location
+from src.util.identifiers import normalize_identifier
+from src.util.spatial_index import SpatialIndex
+
+# Values per query; PostgreSQL gets them as one array parameter, other dialects as IN (...) placeholders
+POSTGRES_BATCH_SIZE = 10_000
+DEFAULT_BATCH_SIZE = 900
+
+
+def lookup_identifiers(session, identifiers, authority_id=None, batch_size=None):
+    """Resolve many (identifier_type, value) pairs to the entities and persons they identify.
+
+    Values are normalized the same way the loaders store them, then looked up per identifier type in
+    batches with `identifier_value = ANY(:values)` on PostgreSQL and `IN (...)` elsewhere, served by the
+    (identifier_type, identifier_value) index. Returns {(identifier_type, value): [(Entity, Person or None), ...]}
+    keyed by the pairs as passed in; pairs without a match are left out.
+    """
+    postgres = session.get_bind().dialect.name == 'postgresql'
+    batch_size = batch_size or (POSTGRES_BATCH_SIZE if postgres else DEFAULT_BATCH_SIZE)
+
+    # normalized value -> input pairs, per identifier type
+    wanted = {}
+    for identifier_type, value in identifiers:
+        normalized = normalize_identifier(identifier_type, value)
+        if normalized is not None:
+            wanted.setdefault(identifier_type, {}).setdefault(normalized, []).append((identifier_type, value))
+
+    statement = (
+        select(EntityIdentifier.identifier_value, Entity, Person)
+        .join(Entity, Entity.id == EntityIdentifier.entity_id)
+        .outerjoin(Person, Person.entity_id == Entity.id)
+        .where(EntityIdentifier.identifier_type == bindparam('identifier_type'))
+    )
+    if postgres:
+        statement = statement.where(EntityIdentifier.identifier_value == any_(bindparam('values', type_=ARRAY(String))))
+    else:
+        statement = statement.where(EntityIdentifier.identifier_value.in_(bindparam('values', expanding=True)))
+    if authority_id is not None:
+        statement = statement.where(EntityIdentifier.authority_id == authority_id)
+
+    found = {}
+    for identifier_type, values in wanted.items():
+        values = list(values.items())
+        for i in range(0, len(values), batch_size):
+            batch = dict(values[i:i + batch_size])
+            result = session.execute(statement, {'identifier_type': identifier_type, 'values': list(batch)})
+            for value, entity, person in result:
+                for key in batch[value]:
+                    found.setdefault(key, []).append((entity, person))
+    return found
+
+
+def location_index(session, path):
+    """SpatialIndex of the Location coordinates (ids are location ids) persisted at path.
+
+    The index is rebuilt when the locations table changed since it was written (judged by the
+    number of locations and the highest id), otherwise the files at path are memory-mapped as is.
+    """
+    location_count, max_location_id = session.execute(select(func.count(Location.id), func.max(Location.id))).one()
+    state = {'location_count': location_count, 'max_location_id': max_location_id}
+    if os.path.isdir(path):
+        index = SpatialIndex(path)
+        if index.manifest['meta'] == state:
+            return index
+    rows = session.execute(select(Location.id, Location.latitude, Location.longitude)
+                           .where(Location.latitude.is_not(None), Location.longitude.is_not(None))).all()
+    SpatialIndex.write(path, np.array([float(row.latitude) for row in rows]), np.array([float(row.longitude) for row in rows]),
+                       np.array([row.id for row in rows], dtype=np.int64), **state)
+    return SpatialIndex(path)
+
+
+def persons_within(session, index, latitude, longitude, radius_km, batch_size=None):
+    """Persons whose current or origin location is within radius_km of a point.
+
+    The locations in range are found in index (see location_index), then their persons are fetched in
+    batches of location ids like lookup_identifiers, served by the persons location id indexes.
+    Returns [(Person, distance_km), ...] nearest first, the distance being that of the nearer of the
+    person's two locations.
+    """
+    postgres = session.get_bind().dialect.name == 'postgresql'
+    batch_size = batch_size or (POSTGRES_BATCH_SIZE if postgres else DEFAULT_BATCH_SIZE)
+    location_ids, distances = index.within(latitude, longitude, radius_km)
+    distance_of = dict(zip(location_ids.tolist(), distances.tolist()))
+
+    if postgres:
+        location_ids_param = bindparam('location_ids', type_=ARRAY(Integer))
+        statement = select(Person).where(or_(Person.current_location_id == any_(location_ids_param), Person.origin_location_id == any_(location_ids_param)))
+    else:
+        location_ids_param = bindparam('location_ids', expanding=True)
+        statement = select(Person).where(or_(Person.current_location_id.in_(location_ids_param), Person.origin_location_id.in_(location_ids_param)))
+
+    found = {}
+    location_ids = list(distance_of)
+    for i in range(0, len(location_ids), batch_size):
+        for person in session.scalars(statement, {'location_ids': location_ids[i:i + batch_size]}):
+            found[person.id] = (person, min(distance_of.get(person.current_location_id, math.inf), distance_of.get(person.origin_location_id, math.inf)))
+    return sorted(found.values(), key=lambda pair: pair[1])
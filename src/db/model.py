@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Enum, ForeignKey, JSON, DateTime, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, Date, Enum, ForeignKey, JSON, DateTime, Numeric, Index, LargeBinary
 from sqlalchemy.dialects.postgresql import ENUM as PG_ENUM
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -17,8 +17,11 @@ class Entity(Base):
     id = Column(Integer, primary_key=True)
     type = Column(Enum('person', 'organization', 'location', 'other', name='entity_type'), nullable=False)
     name = Column(String, nullable=False)
-    meta_data = Column(JSON)
+    # None is stored as SQL NULL (not a JSON null), entities without metadata of their own take no space for it
+    meta_data = Column(JSON(none_as_null=True))
     source_timestamp = Column(DateTime(timezone=True), nullable=True)
+    # Source record the entity was loaded from (e.g. the raw dump line), shared by entities loaded from identical records
+    artifact_id = Column(Integer, ForeignKey('artifacts.id'))
 
 # Create the ENUM type
 gender_enum = PG_ENUM('male', 'female', 'other', name='gender')
@@ -26,13 +29,14 @@ gender_enum = PG_ENUM('male', 'female', 'other', name='gender')
 class Person(Base):
     __tablename__ = 'persons'
     id = Column(Integer, primary_key=True)
-    entity_id = Column(Integer, ForeignKey('entities.id'))
+    entity_id = Column(Integer, ForeignKey('entities.id'), index=True)
     first_name = Column(String)
     last_name = Column(String)
     gender = Column(gender_enum)
     relationship_status = Column(Enum('single', 'married', 'in_relationship', 'engaged', 'divorced', 'separated', 'its_complicated', 'widowed', 'domestic_partnership', 'open_relationship', 'civil_union', name='relationship_status'))
-    current_location_id = Column(Integer, ForeignKey('locations.id'))
-    origin_location_id = Column(Integer, ForeignKey('locations.id'))
+    # Indexed for proximity queries (persons_within in src/db/lookup.py)
+    current_location_id = Column(Integer, ForeignKey('locations.id'), index=True)
+    origin_location_id = Column(Integer, ForeignKey('locations.id'), index=True)
 
 class Location(Base):
     __tablename__ = 'locations'
@@ -43,7 +47,7 @@ class Location(Base):
     country_code = Column(String(2))
     longitude = Column(Numeric(9, 6))
     latitude = Column(Numeric(8, 6))
-    geoname_id = Column(Integer)
+    geoname_id = Column(Integer, unique=True)
     location_type = Column(Enum('city', 'place', 'country', 'continent', 'region', 'admin1', 'admin2', 'admin3', 'admin4', 'admin5', 'admin6', 'admin_other', 'other', name='location_type'))
     population = Column(Integer)
 
@@ -65,11 +69,33 @@ class EntityIdentifier(Base):
     identifier_value = Column(String, nullable=False)
     meta_data = Column(JSON)
 
+    # Identifier lookups (see src/db/lookup.py) filter on both columns
+    __table_args__ = (Index('ix_entity_identifiers_type_value', 'identifier_type', 'identifier_value'),)
+
 class Artifact(Base):
     __tablename__ = 'artifacts'
     id = Column(Integer, primary_key=True)
     source_id = Column(Integer, ForeignKey('sources.id'))
     type = Column(Enum('document', 'social_media_post', 'account_dump', 'web_page', 'other', name='artifact_type'), nullable=False)
     content = Column(String, nullable=False)
+    # SHA-256 digest of content, identical content is stored once
+    content_hash = Column(LargeBinary(32), unique=True)
     meta_data = Column(JSON)
     source_timestamp = Column(DateTime(timezone=True))
+
+class LoadCheckpoint(Base):
+    __tablename__ = 'load_checkpoints'
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True, nullable=False)
+    file_size = Column(BigInteger)
+    rows_loaded = Column(BigInteger, nullable=False, default=0)
+    # Position in a plain input file after the last loaded row, resumed loads seek to it
+    byte_offset = Column(BigInteger)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Entities found to be the same real-world entity by src/db/resolve.py share a cluster_id (the smallest entity id of the cluster)
+class EntityCluster(Base):
+    __tablename__ = 'entity_clusters'
+    entity_id = Column(Integer, ForeignKey('entities.id'), primary_key=True)
+    cluster_id = Column(Integer, nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
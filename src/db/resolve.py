@@ -0,0 +1,337 @@
+from array import array
+import argparse
+import difflib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, select, func, delete, bindparam
+from sqlalchemy.orm import sessionmaker
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from src.db.model import Base, Person, EntityIdentifier, EntityCluster
+from src.db.bulk import bulk_insert
+from src.util.identifiers import fold_name, soundex
+from src.util.metrics import metrics, add_arguments as add_metrics_arguments, instrumented
+
+log = logging.getLogger(__name__)
+
+# Rows fetched per round trip when streaming persons
+FETCH_SIZE = 100_000
+# Block entries buffered per partition before they are appended to its file
+PARTITION_BUFFER = 10_000
+# Larger blocks are skipped: a phone shared by thousands of accounts or a common name in a big city links nothing
+MAX_BLOCK_SIZE = 500
+# Identifiers a person has only one of per authority, different values mean different persons
+EXCLUSIVE_IDENTIFIER_TYPES = {'user_id', 'tax_number', 'passport', 'national_id'}
+# Name similarity needed to match records sharing an identifier (first or last name), and records sharing only name and location (both)
+IDENTIFIER_NAME_SIMILARITY = 0.8
+NAME_SIMILARITY = 0.85
+# Rows per INSERT/SELECT when writing clusters
+WRITE_BATCH_SIZE = 10_000
+
+
+def make_record(entity_id, first_name, last_name, location_ids, identifiers):
+    """Compact, picklable form of a person compared by the resolver"""
+    return (entity_id, fold_name(first_name), fold_name(last_name),
+            frozenset(location_id for location_id in location_ids if location_id is not None), frozenset(identifiers))
+
+
+def read_persons(session, after_id=0, up_to_id=None):
+    """Stream the records of the persons with entity ids in (after_id, up_to_id], in entity id order"""
+    statement = (
+        select(Person.entity_id, Person.first_name, Person.last_name, Person.current_location_id, Person.origin_location_id,
+               EntityIdentifier.identifier_type, EntityIdentifier.authority_id, EntityIdentifier.identifier_value)
+        .outerjoin(EntityIdentifier, EntityIdentifier.entity_id == Person.entity_id)
+        .where(Person.entity_id > after_id)
+        .order_by(Person.entity_id)
+    )
+    if up_to_id is not None:
+        statement = statement.where(Person.entity_id <= up_to_id)
+    result = session.execute(statement.execution_options(yield_per=FETCH_SIZE))
+    # One row per identifier of a person
+    for entity_id, rows in itertools.groupby(result, key=lambda row: row[0]):
+        rows = list(rows)
+        _, first_name, last_name, current_location_id, origin_location_id = rows[0][:5]
+        identifiers = [tuple(row[5:]) for row in rows if row[5] is not None]
+        yield make_record(entity_id, first_name, last_name, [current_location_id, origin_location_id], identifiers)
+
+
+def block_keys(record):
+    """Blocking keys of a record: each identifier, and the phonetic name with each of its locations.
+
+    Only records sharing a key are ever compared. First and last name codes are sorted, so swapped
+    names land in the same block.
+    """
+    _, first_name, last_name, location_ids, identifiers = record
+    keys = [('id',) + identifier for identifier in identifiers]
+    if first_name and last_name:
+        name = tuple(sorted([soundex(first_name), soundex(last_name)]))
+        keys.extend(('name',) + name + (location_id,) for location_id in location_ids)
+    return keys
+
+
+def similar(x, y, threshold):
+    """True if the similarity ratio of two strings is at least threshold, checking the cheap upper bounds first"""
+    if x == y:
+        return True
+    matcher = difflib.SequenceMatcher(None, x, y)
+    return matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+
+def names_agree(a, b, threshold, both):
+    """True if the first or the last names (both=True: the first and the last names) of two records are similar.
+
+    The names of b are also tried swapped. None if the records have no name part in common to compare.
+    """
+    comparable = False
+    for first_name, last_name in [(b[1], b[2]), (b[2], b[1])]:
+        pairs = [(x, y) for x, y in [(a[1], first_name), (a[2], last_name)] if x and y]
+        if not pairs:
+            continue
+        comparable = True
+        if both and len(pairs) < 2:
+            continue
+        agreements = (similar(x, y, threshold) for x, y in pairs)
+        if all(agreements) if both else any(agreements):
+            return True
+    return False if comparable else None
+
+
+def exclusive_conflict(identifiers_a, identifiers_b):
+    """True if both have an exclusive identifier (e.g. a user id) of the same type and authority, but no common value"""
+    values = {}
+    for identifier_type, authority_id, value in identifiers_a:
+        if identifier_type in EXCLUSIVE_IDENTIFIER_TYPES:
+            values.setdefault((identifier_type, authority_id), set()).add(value)
+    others = {}
+    for identifier_type, authority_id, value in identifiers_b:
+        if (identifier_type, authority_id) in values:
+            others.setdefault((identifier_type, authority_id), set()).add(value)
+    return any(not (values[kind] & other_values) for kind, other_values in others.items())
+
+
+def is_match(a, b):
+    """Decide whether two records are the same person.
+
+    Records sharing an identifier match if their first or last names agree (or are unknown), so a
+    household sharing a phone stays apart; records sharing only a phonetic name and a location need
+    both names to agree. Different exclusive identifiers (two Facebook accounts) always keep them apart.
+    """
+    shared_identifier = bool(a[4] & b[4])
+    if not shared_identifier and not a[3] & b[3]:
+        return False
+    if exclusive_conflict(a[4], b[4]):
+        return False
+    if shared_identifier:
+        return names_agree(a, b, IDENTIFIER_NAME_SIMILARITY, both=False) is not False
+    return bool(names_agree(a, b, NAME_SIMILARITY, both=True))
+
+
+class PartitionWriter:
+    """Spread (block key, record) entries over partition files by the hash of the key.
+
+    All entries of a block end up in the same file, so the partitions can be resolved independently
+    with only one partition's blocks in memory at a time.
+    """
+    def __init__(self, directory, partitions):
+        self.paths = [os.path.join(directory, f'blocks-{i:05d}.pkl') for i in range(partitions)]
+        self.buffers = [[] for _ in range(partitions)]
+
+    def add(self, key, record):
+        index = hash(key) % len(self.paths)
+        buffer = self.buffers[index]
+        buffer.append((key, record))
+        if len(buffer) >= PARTITION_BUFFER:
+            self._flush(index)
+
+    def _flush(self, index):
+        with open(self.paths[index], 'ab') as f:
+            pickle.dump(self.buffers[index], f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.buffers[index] = []
+
+    def close(self):
+        """Write the rest of the entries, returns the paths of the non-empty partitions"""
+        for index, buffer in enumerate(self.buffers):
+            if buffer:
+                self._flush(index)
+        return [path for path in self.paths if os.path.exists(path)]
+
+
+def resolve_partition(task):
+    """Compare the records of every block of a partition file (runs in a worker process).
+
+    Only pairs with at least one record newer than after_id are compared. Returns the matching
+    (entity_id, entity_id) pairs and the counts of blocks, oversized blocks and compared pairs.
+    """
+    path, after_id = task
+    blocks = {}
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                entries = pickle.load(f)
+            except EOFError:
+                break
+            for key, record in entries:
+                blocks.setdefault(key, []).append(record)
+
+    matches = []
+    counts = {'resolve_blocks': 0, 'resolve_oversized_blocks': 0, 'resolve_pairs_compared': 0}
+    for records in blocks.values():
+        if len(records) < 2:
+            continue
+        if len(records) > MAX_BLOCK_SIZE:
+            counts['resolve_oversized_blocks'] += 1
+            continue
+        counts['resolve_blocks'] += 1
+        for i, a in enumerate(records):
+            for b in records[i + 1:]:
+                if a[0] <= after_id and b[0] <= after_id:
+                    continue
+                counts['resolve_pairs_compared'] += 1
+                if is_match(a, b):
+                    matches.append((a[0], b[0]))
+    return matches, counts
+
+
+class UnionFind:
+    """Disjoint sets of entity ids, each represented by its smallest id"""
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        self.parent.setdefault(a, a)
+        self.parent.setdefault(b, b)
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def write_clusters(session, new_ids, clusters, after_id):
+    """Insert the cluster of every new entity and move the members of existing clusters that were merged.
+
+    Entities up to after_id are already in entity_clusters; returns the number of clusters merged into others.
+    """
+    connection = session.connection()
+    table = EntityCluster.__table__
+
+    # Existing entities that matched new ones stand in for their whole cluster
+    old_ids = [entity_id for entity_id in clusters.parent if entity_id <= after_id]
+    old_clusters = set()
+    for i in range(0, len(old_ids), WRITE_BATCH_SIZE):
+        result = connection.execute(select(table.c.entity_id, table.c.cluster_id).where(table.c.entity_id.in_(old_ids[i:i + WRITE_BATCH_SIZE])))
+        for entity_id, cluster_id in result:
+            clusters.union(entity_id, cluster_id)
+            old_clusters.add(cluster_id)
+
+    moved = [{'old_cluster_id': cluster_id, 'new_cluster_id': clusters.find(cluster_id)}
+             for cluster_id in old_clusters if clusters.find(cluster_id) != cluster_id]
+    if moved:
+        connection.execute(table.update().where(table.c.cluster_id == bindparam('old_cluster_id')).values(cluster_id=bindparam('new_cluster_id')), moved)
+
+    for i in range(0, len(new_ids), WRITE_BATCH_SIZE):
+        batch = new_ids[i:i + WRITE_BATCH_SIZE]
+        bulk_insert(connection, table, ['entity_id', 'cluster_id'], [(entity_id, clusters.find(entity_id)) for entity_id in batch])
+    return len(moved)
+
+
+def resolve_entities(db_url, workers=None, partitions=None, full=False, work_dir=None):
+    """Link the persons that are the same real-world person, across all loaded datasets.
+
+    Persons are spread over partition files by blocking key (see block_keys), the partitions are
+    compared in a pool of worker processes, and the matches are merged into clusters that are written
+    to entity_clusters in bulk. No pair of persons without a common key is ever compared.
+
+    Runs are incremental: persons already in entity_clusters are only compared with newer ones,
+    for the blocks the newer ones fall into, and clusters joined by a new person are merged. full=True
+    resolves everything from scratch. Run it when no load is writing persons.
+    """
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 16
+
+    with Session() as session:
+        if full:
+            session.execute(delete(EntityCluster))
+        after_id = session.scalar(select(func.max(EntityCluster.entity_id))) or 0
+        up_to_id = session.scalar(select(func.max(Person.entity_id))) or 0
+        if up_to_id <= after_id:
+            log.info('No new persons to resolve')
+            session.commit()
+            return
+
+        new_ids = array('q')
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+            writer = PartitionWriter(tmp_dir, partitions)
+            with metrics.timer('resolve_blocking'):
+                new_keys = set()
+                for record in read_persons(session, after_id, up_to_id):
+                    new_ids.append(record[0])
+                    for key in block_keys(record):
+                        writer.add(key, record)
+                        if after_id:
+                            new_keys.add(hash(key))
+                # Earlier persons are only needed in the blocks of new ones
+                if after_id:
+                    for record in read_persons(session, 0, after_id):
+                        for key in block_keys(record):
+                            if hash(key) in new_keys:
+                                writer.add(key, record)
+                    del new_keys
+                paths = writer.close()
+            log.info(f'Resolving {len(new_ids):,} new persons in {len(paths):,} partitions')
+
+            clusters = UnionFind()
+            tasks = [(path, after_id) for path in paths]
+            with metrics.timer('resolve_compare'):
+                if workers > 1:
+                    with multiprocessing.Pool(workers) as pool:
+                        results = list(pool.imap_unordered(resolve_partition, tasks))
+                else:
+                    results = map(resolve_partition, tasks)
+                for matches, counts in results:
+                    for a, b in matches:
+                        clusters.union(a, b)
+                    for name, value in counts.items():
+                        metrics.count(name, value)
+                    metrics.count('resolve_matches', len(matches))
+
+        with metrics.timer('resolve_write'):
+            merged = write_clusters(session, new_ids, clusters, after_id)
+            session.commit()
+    metrics.count('resolve_persons', len(new_ids))
+    engine.dispose()
+    linked = len({clusters.find(entity_id) for entity_id in clusters.parent})
+    log.info(f'Resolved {len(new_ids):,} persons: {len(clusters.parent):,} linked into {linked:,} clusters, {merged:,} existing clusters merged')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Link persons that are the same real-world person across datasets (entity_clusters)")
+    parser.add_argument("db_url", help="SQLAlchemy database URL")
+    parser.add_argument("--workers", type=int, help="Worker processes comparing blocks (default: number of CPUs)")
+    parser.add_argument("--partitions", type=int, help="Number of block partitions (default: 16 per worker)")
+    parser.add_argument("--full", action="store_true", help="Drop the existing clusters and resolve all persons again")
+    parser.add_argument("--work-dir", help="Directory for the temporary partition files (default: system temp)")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with instrumented(args):
+        resolve_entities(args.db_url, workers=args.workers, partitions=args.partitions, full=args.full, work_dir=args.work_dir)
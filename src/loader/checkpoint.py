@@ -0,0 +1,83 @@
+import logging
+import os
+import sys
+import threading
+
+from sqlalchemy import select, update
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from src.db.model import LoadCheckpoint, EntityIdentifier
+from src.util.input_stream import input_size
+
+log = logging.getLogger(__name__)
+
+# Rows fetched per round trip when loading identifiers
+IDENTIFIER_FETCH_SIZE = 100_000
+
+
+def start_checkpoint(session, file_path, resume=True):
+    """Return (rows_loaded, byte_offset) of file_path committed by earlier runs and make sure a checkpoint row exists.
+
+    Checkpoints are keyed by the absolute path (or glob pattern); if the size of the input changed
+    since the checkpoint was written (or resume is False) the load starts over from the first row.
+    byte_offset is only recorded for plain input files, it is None otherwise.
+    """
+    path = os.path.abspath(file_path)
+    file_size = input_size(file_path)
+    checkpoint = session.query(LoadCheckpoint).filter_by(path=path).first()
+    if checkpoint is None:
+        checkpoint = LoadCheckpoint(path=path, file_size=file_size, rows_loaded=0)
+        session.add(checkpoint)
+    elif not resume or checkpoint.file_size != file_size:
+        if checkpoint.rows_loaded:
+            log.warning(f"Ignoring checkpoint for {path} ({checkpoint.rows_loaded:,} rows), starting from the beginning")
+        checkpoint.file_size = file_size
+        checkpoint.rows_loaded = 0
+        checkpoint.byte_offset = None
+    rows_loaded, byte_offset = checkpoint.rows_loaded, checkpoint.byte_offset
+    session.commit()
+    return rows_loaded, byte_offset
+
+
+def write_checkpoint(session, file_path, rows_loaded, byte_offset=None):
+    """Record that the first rows_loaded rows of file_path (ending at byte_offset of a plain file) are loaded.
+
+    Runs in the session's current transaction, so the checkpoint commits together with the rows it
+    covers. The stored value only ever grows, writers finishing out of order can't move it back.
+    """
+    table = LoadCheckpoint.__table__
+    session.execute(update(table)
+                    .where(table.c.path == os.path.abspath(file_path), table.c.rows_loaded < rows_loaded)
+                    .values(rows_loaded=rows_loaded, byte_offset=byte_offset))
+
+
+def load_identifier_values(session, authority_id, identifier_type):
+    """Set of all identifier values of one authority and type, streamed from entity_identifiers in a single query"""
+    statement = select(EntityIdentifier.identifier_value).where(
+        EntityIdentifier.authority_id == authority_id,
+        EntityIdentifier.identifier_type == identifier_type)
+    result = session.execute(statement.execution_options(yield_per=IDENTIFIER_FETCH_SIZE))
+    return {value for value, in result}
+
+
+class ChunkTracker:
+    """Contiguous prefix of loaded rows when chunks (row ranges) are committed out of order"""
+    def __init__(self, rows_loaded, byte_offset=None):
+        self.rows_loaded = rows_loaded
+        self.byte_offset = byte_offset
+        self._done = {}
+        self._lock = threading.Lock()
+
+    def done(self, start, end, byte_offset=None):
+        """Mark rows [start, end) (ending at byte_offset) as committed; returns the new (rows_loaded, byte_offset)
+        if the prefix grew, else None"""
+        with self._lock:
+            self._done[start] = (end, byte_offset)
+            advanced = False
+            while self.rows_loaded in self._done:
+                self.rows_loaded, self.byte_offset = self._done.pop(self.rows_loaded)
+                advanced = True
+            return (self.rows_loaded, self.byte_offset) if advanced else None
@@ -1,149 +1,565 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, bindparam, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 import pandas as pd
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import logging
+import math
+import threading
 import sys
 import os
-import json
 from tqdm import tqdm
 
 # Add the project root directory to the Python path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from src.db.model import Base, Source, Entity, Person, EntityIdentifier, Authority, Location
+from src.db.model import Base, Source, Entity, Person, EntityIdentifier, Authority, Location, Artifact
+from src.db.bulk import allocate_ids, bulk_insert
 from src.util.kino_geocode import KinoGeocode
+from src.util.geocode_cache import GeocodeCache
+from src.util.identifiers import normalize_identifier
+from src.util.input_stream import open_input, input_size, bytes_consumed, is_plain_file, expand_inputs
+from src.util.metrics import metrics, add_arguments as add_metrics_arguments, instrumented
+from src.loader.pipeline import Pipeline, Stage
+from src.loader.checkpoint import start_checkpoint, write_checkpoint, load_identifier_values, ChunkTracker
+
+log = logging.getLogger(__name__)
+
+# Number of locations per INSERT ... ON CONFLICT statement
+LOCATION_BATCH_SIZE = 1000
+
+# Number of artifacts per INSERT ... ON CONFLICT executemany and per lookup of existing ones
+ARTIFACT_BATCH_SIZE = 1000
+
+# CSV columns holding identifiers
+IDENTIFIER_DTYPES = {'phone': str, 'facebook_id': str, 'email': str}
+
+# CSV column of each identifier type
+IDENTIFIER_COLUMNS = {'phone': 'phone', 'email': 'email', 'user_id': 'facebook_id'}
 
 # Initialize Geocode instance
-gc = KinoGeocode(large_city_population_cutoff=5000)
+gc = KinoGeocode(large_city_population_cutoff=5000, geonames_format='mmap')
 gc.load()
 
-def load_facebook_data(file_path: str, db_url: str):
+def load_facebook_data(file_path: str, db_url: str, geocode_cache_path: str = None, geocode_cache_size: int = 100_000,
+                       bulk: bool = False, batch_size: int = 500, chunk_size: int = 50_000, resume: bool = True,
+                       compact_metadata: bool = True):
+    """Load a preprocessed Facebook CSV, reading it chunk_size rows at a time.
+
+    With bulk=True persons are not added through the ORM but collected into batches of batch_size rows
+    and written with allocate_ids/bulk_insert (COPY on PostgreSQL, executemany elsewhere). Either way
+    a transaction covers at most batch_size rows.
+
+    Loads are resumable: the number of rows loaded from file_path is checkpointed with every chunk and
+    a rerun continues after it (unless resume=False). Persons whose Facebook user id is already in
+    entity_identifiers are skipped, so rerunning a load never duplicates them.
+
+    With compact_metadata (the default) entities.meta_data only keeps the CSV fields that were not
+    normalized into persons, entity_identifiers or locations, and the raw line is stored once in
+    artifacts (see upsert_artifacts). Otherwise the whole row goes into meta_data.
+    """
     engine = create_engine(db_url)
     Base.metadata.create_all(engine)
+    check_schema(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
 
-    # Create or get the Facebook source
+    facebook_source_id = get_facebook_source_id(session)
+    facebook_authority_id = get_facebook_authority_id(session)
+    rows_loaded, byte_offset = start_checkpoint(session, file_path, resume=resume)
+    loaded_user_ids = load_identifier_values(session, facebook_authority_id, 'user_id')
+
+    # Initialize location cache with every known location
+    location_cache = load_location_ids(session)
+
+    # Decoded locations are memoized across chunks
+    geocode = GeocodeCache(gc, max_size=geocode_cache_size, cache_path=geocode_cache_path)
+    register_cache_gauges(geocode)
+
+    person_fields = [field.name for field in Person.__table__.columns]
+    pbar = tqdm(total=input_size(file_path), desc="Processing Facebook data", unit="B", unit_scale=True)
+
+    # Stream the CSV file in chunks so memory stays bounded by chunk_size
+    for chunk, consumed, byte_offset in metrics.timed('read', read_chunks(file_path, chunk_size, rows_loaded, byte_offset)):
+        location_ids = resolve_locations(session, geocode, location_cache, chunk, compact_metadata)
+        with metrics.timer('transform'):
+            rows = drop_loaded(build_person_rows(chunk, location_ids, facebook_authority_id, person_fields, compact_metadata), loaded_user_ids)
+        rows_loaded += len(chunk)
+
+        if bulk:
+            for i in range(0, len(rows), batch_size):
+                with metrics.timer('write_batch'):
+                    write_bulk_batch(session, rows[i:i + batch_size], facebook_source_id)
+                if i + batch_size < len(rows):
+                    with metrics.timer('commit'):
+                        session.commit()
+        else:
+            artifact_ids = upsert_artifacts(session.connection(), facebook_source_id, [row[4] for row in rows])
+            for i, (name, meta_data, person_data, identifiers, raw) in enumerate(rows):
+                # Create or get the entity
+                entity = Entity(type='person', name=name, meta_data=meta_data, artifact_id=artifact_ids.get(raw))
+                session.add(entity)
+                with metrics.timer('flush'):
+                    session.flush()  # This will assign an ID to the entity
+
+                person = Person(**dict(person_data, entity_id=entity.id))
+                session.add(person)
+
+                for id_type, id_value, authority_id in identifiers:
+                    identifier = EntityIdentifier(
+                        entity_id=entity.id,
+                        authority_id=authority_id,
+                        identifier_type=id_type,
+                        identifier_value=id_value
+                    )
+                    session.add(identifier)
+
+                # Commit every batch_size rows to avoid large transactions
+                if (i + 1) % batch_size == 0:
+                    with metrics.timer('commit'):
+                        session.commit()
+
+        # The rest of the chunk commits together with its checkpoint
+        write_checkpoint(session, file_path, rows_loaded, byte_offset)
+        with metrics.timer('commit'):
+            session.commit()
+        metrics.count('persons_written', len(rows))
+        pbar.update(consumed - pbar.n)
+
+    pbar.close()
+    session.close()
+    geocode.log_stats()
+    geocode.close()
+
+def load_facebook_data_pipelined(file_path: str, db_url: str, geocode_cache_path: str = None, geocode_cache_size: int = 100_000,
+                                 batch_size: int = 500, chunk_size: int = 50_000, transform_workers: int = 1, writers: int = 1,
+                                 queue_size: int = 4, report_interval: int = 30, resume: bool = True, compact_metadata: bool = True):
+    """Load a preprocessed Facebook CSV with reading, geocoding and database writes overlapped.
+
+    A reader thread parses CSV chunks, transform_workers threads resolve their locations and build the
+    rows, and writers threads (each with its own pooled connection) write them in bulk, batch_size rows
+    per transaction. At most queue_size chunks wait between two stages. The result is the same as
+    load_facebook_data with bulk=True, apart from the order of the generated ids.
+
+    Writers finish chunks out of order, so the checkpoint is the end of the contiguous run of committed
+    chunks; rows after it that were committed anyway are skipped by their Facebook user id on resume.
+    """
+    engine = create_engine(db_url, pool_size=transform_workers + writers + 1)
+    Base.metadata.create_all(engine)
+    check_schema(engine)
+    Session = sessionmaker(bind=engine)
+
+    with Session() as session:
+        facebook_source_id = get_facebook_source_id(session)
+        facebook_authority_id = get_facebook_authority_id(session)
+        rows_loaded, byte_offset = start_checkpoint(session, file_path, resume=resume)
+        loaded_user_ids = load_identifier_values(session, facebook_authority_id, 'user_id')
+        location_cache = load_location_ids(session)
+
+    geocode = GeocodeCache(gc, max_size=geocode_cache_size, cache_path=geocode_cache_path)
+    register_cache_gauges(geocode)
+    person_fields = [field.name for field in Person.__table__.columns]
+    pbar = tqdm(total=input_size(file_path), desc="Processing Facebook data", unit="B", unit_scale=True)
+    progress_lock = threading.Lock()
+    tracker = ChunkTracker(rows_loaded, byte_offset)
+
+    # The geocode cache, the location map and the loaded user ids are shared by all transform workers
+    geocode_lock = threading.Lock()
+    # Without a sequence, ids are allocated from max(id) and only one transaction may write at a time
+    write_lock = threading.Lock() if engine.dialect.name != 'postgresql' else contextlib.nullcontext()
+
+    def read():
+        start = rows_loaded
+        for chunk, consumed, offset in metrics.timed('read', read_chunks(file_path, chunk_size, rows_loaded, byte_offset)):
+            yield start, start + len(chunk), chunk, consumed, offset
+            start += len(chunk)
+
+    def transform(item, session):
+        start, end, chunk, consumed, offset = item
+        with geocode_lock, write_lock:
+            location_ids = resolve_locations(session, geocode, location_cache, chunk, compact_metadata)
+            # Writers use other connections, new locations must be visible to them
+            with metrics.timer('commit'):
+                session.commit()
+        with metrics.timer('transform'):
+            rows = build_person_rows(chunk, location_ids, facebook_authority_id, person_fields, compact_metadata)
+            with geocode_lock:
+                rows = drop_loaded(rows, loaded_user_ids)
+        return start, end, rows, consumed, offset
+
+    def write(item, session):
+        start, end, rows, consumed, offset = item
+        for i in range(0, len(rows), batch_size):
+            with write_lock:
+                with metrics.timer('write_batch'):
+                    write_bulk_batch(session, rows[i:i + batch_size], facebook_source_id)
+                with metrics.timer('commit'):
+                    session.commit()
+        metrics.count('persons_written', len(rows))
+        checkpoint = tracker.done(start, end, offset)
+        if checkpoint is not None:
+            with write_lock:
+                write_checkpoint(session, file_path, *checkpoint)
+                with metrics.timer('commit'):
+                    session.commit()
+        with progress_lock:
+            if consumed > pbar.n:
+                pbar.update(consumed - pbar.n)
+
+    pipeline = Pipeline(read(), [
+        Stage('transform', transform, workers=transform_workers, setup=Session, teardown=lambda session: session.close()),
+        Stage('write', write, workers=writers, setup=Session, teardown=lambda session: session.close()),
+    ], queue_size=queue_size, report_interval=report_interval, size=lambda item: len(item[2]))
+    try:
+        pipeline.run()
+    finally:
+        pbar.close()
+        geocode.log_stats()
+        geocode.close()
+        engine.dispose()
+
+def read_chunks(file_path, chunk_size, rows_loaded=0, byte_offset=None):
+    """Read the CSV file chunk_size rows at a time, skipping the first rows_loaded data rows.
+
+    Yields (chunk, input bytes consumed so far, byte offset after the chunk). file_path may be compressed
+    or a glob pattern of parts (see src/util/input_stream.py), the offset is only known for a plain
+    file (None otherwise) and a plain file is resumed by seeking to byte_offset. Identifier columns are
+    read as text: parsed as numbers they lose leading zeros and '+', and turn into floats
+    ('41580043456.0') as soon as one value is missing.
+    """
+    if not is_plain_file(file_path):
+        with open_input(file_path, 'rb') as infile:
+            header = read_header(infile)
+            for chunk in pd.read_csv(infile, header=None, names=header, skiprows=rows_loaded, chunksize=chunk_size,
+                                     dtype=IDENTIFIER_DTYPES):
+                metrics.count('rows_read', len(chunk))
+                yield chunk, bytes_consumed(infile), None
+        return
+    with open(expand_inputs(file_path)[0], 'rb') as infile:
+        header = read_header(infile)
+        if rows_loaded and byte_offset:
+            infile.seek(byte_offset)
+        else:
+            for _ in read_records(infile, rows_loaded):
+                pass
+        while True:
+            block = b''.join(read_records(infile, chunk_size))
+            if not block:
+                return
+            chunk = pd.read_csv(io.BytesIO(block), header=None, names=header, dtype=IDENTIFIER_DTYPES)
+            metrics.count('rows_read', len(chunk))
+            yield chunk, infile.tell(), infile.tell()
+
+def read_header(infile):
+    """Column names from the first line of a binary CSV file, read separately so rows can be skipped by count"""
+    return next(csv.reader([infile.readline().decode('utf-8')]))
+
+def read_records(infile, count):
+    """Yield the next count CSV records of a binary file, a record continues on the next line while a quoted field is open"""
+    for _ in range(count):
+        record = infile.readline()
+        if not record:
+            return
+        while record.count(b'"') % 2:
+            line = infile.readline()
+            if not line:
+                break
+            record += line
+        yield record
+
+def drop_loaded(rows, loaded_user_ids):
+    """Drop rows whose Facebook user id is in loaded_user_ids and add the ids of the remaining rows to it"""
+    kept = []
+    for row in rows:
+        user_id = next((id_value for id_type, id_value, _ in row[3] if id_type == 'user_id'), None)
+        if user_id is not None:
+            if user_id in loaded_user_ids:
+                metrics.count('rows_skipped_loaded')
+                continue
+            loaded_user_ids.add(user_id)
+        kept.append(row)
+    return kept
+
+def register_cache_gauges(geocode):
+    """Report the statistics of the geocode cache with the metrics"""
+    metrics.gauge('geocode_cache_hits', lambda: geocode.hits)
+    metrics.gauge('geocode_cache_file_hits', lambda: geocode.disk_hits)
+    metrics.gauge('geocode_cache_misses', lambda: geocode.misses)
+    metrics.gauge('geocode_cache_hit_rate', lambda: round(geocode.hit_rate, 4))
+
+def check_schema(engine):
+    """Fail early if tables created by an older version lack columns of the model, create_all doesn't add them"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        missing = sorted(set(table.columns.keys()) - {column['name'] for column in inspector.get_columns(table.name)})
+        if missing:
+            raise RuntimeError(f"Table {table.name} has no column {', '.join(missing)}: the database was created by an "
+                               f"older version, apply the {engine.dialect.name} migrations in the sql directory")
+
+def get_facebook_source_id(session):
+    """Create or get the Facebook source, returns its id"""
     facebook_source = session.query(Source).filter_by(name='Facebook').first()
     if not facebook_source:
         facebook_source = Source(type='social_media', name='Facebook')
         session.add(facebook_source)
         session.commit()
+    return facebook_source.id
 
-    # Create or get the Facebook authority
+def get_facebook_authority_id(session):
+    """Create or get the Facebook source and authority, returns the authority id"""
+    get_facebook_source_id(session)
     facebook_authority = session.query(Authority).filter_by(name='Facebook').first()
     if not facebook_authority:
         facebook_authority = Authority(name='Facebook', description='Facebook usernames')
         session.add(facebook_authority)
         session.commit()
+    return facebook_authority.id
 
-    # Initialize location cache
-    location_cache = {}
+def build_person_rows(chunk, location_ids, facebook_authority_id, person_fields, compact_metadata=True):
+    """Turn a CSV chunk into (name, meta_data, person_data, identifiers, raw) tuples, one per row.
 
-    # Read CSV file
-    df = pd.read_csv(file_path)
+    location_ids maps location strings to locations.id (see resolve_locations); no database access here.
+    meta_data is a dict (None if empty) of the row's fields, without missing values. With compact_metadata
+    it leaves out the fields stored in person_data and identifiers (unless they could not be normalized,
+    e.g. a location that wasn't geocoded) and raw, which is returned separately to be stored as an
+    artifact. Otherwise it holds the whole row and raw is None.
+    """
+    # Work on plain column arrays instead of a Series per row
+    records = chunk.to_dict('records')
+    current_location_present = chunk['current_location'].notna().to_numpy()
+    origin_location_present = chunk['origin_location'].notna().to_numpy()
+    phone_present = chunk['phone'].notna().to_numpy()
+    facebook_id_present = chunk['facebook_id'].notna().to_numpy()
+    email_present = chunk['email'].notna().to_numpy() if 'email' in chunk.columns else None
+    person_columns = [(name, chunk[name].notna().to_numpy()) for name in person_fields if name in chunk.columns]
 
-    # Process each row
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Processing Facebook data"):
-        # Geocode current_location and origin_location
-        current_location_id = get_or_create_location(session, gc, location_cache, row['current_location']) if pd.notna(row['current_location']) else None
-        origin_location_id = get_or_create_location(session, gc, location_cache, row['origin_location']) if pd.notna(row['origin_location']) else None
+    rows = []
+    for i, record in enumerate(records):
+        person_data = {
+            'current_location_id': location_ids.get(record['current_location']) if current_location_present[i] else None,
+            'origin_location_id': location_ids.get(record['origin_location']) if origin_location_present[i] else None
+        }
+        for name, present in person_columns:
+            if present[i]:
+                person_data[name] = record[name]
 
-        # Create metadata dictionary
-        meta_data = row.to_dict()
+        identifiers = []
+        if phone_present[i]:
+            identifiers.append(('phone', normalize_identifier('phone', record['phone']), None))
+        if email_present is not None and email_present[i]:
+            identifiers.append(('email', normalize_identifier('email', record['email']), None))
+        if facebook_id_present[i]:
+            identifiers.append(('user_id', normalize_identifier('user_id', record['facebook_id']), facebook_authority_id))
+        identifiers = [identifier for identifier in identifiers if identifier[1] is not None]
 
-        # Create or get the entity
-        entity = Entity(type='person', name=f"{row['first_name']} {row['last_name']}", meta_data=json.dumps(meta_data))
-        session.add(entity)
-        session.flush()  # This will assign an ID to the entity
+        if compact_metadata:
+            # CSV columns whose value is kept in persons, entity_identifiers or artifacts
+            normalized = {'raw'} | set(person_data) | {IDENTIFIER_COLUMNS[id_type] for id_type, _, _ in identifiers}
+            if person_data['current_location_id'] is not None:
+                normalized.add('current_location')
+            if person_data['origin_location_id'] is not None:
+                normalized.add('origin_location')
+            meta_data = {key: value for key, value in record.items() if key not in normalized and not is_missing(value)} or None
+            raw = None if is_missing(record.get('raw')) else str(record['raw'])
+        else:
+            meta_data = {key: None if is_missing(value) else value for key, value in record.items()}
+            raw = None
 
-        # Create the person
-        person_data = {
-            'entity_id': entity.id,
-            'current_location_id': current_location_id,
-            'origin_location_id': origin_location_id
-        }
-        for field in Person.__table__.columns:
-            if field.name in row and pd.notna(row[field.name]):
-                person_data[field.name] = row[field.name]
+        name = f"{record['first_name']} {record['last_name']}"
+        rows.append((name, meta_data, person_data, identifiers, raw))
+    return rows
 
-        person = Person(**person_data)
-        session.add(person)
+def is_missing(value):
+    """Whether a CSV value read by pandas is missing (NaN), which can't be stored as JSON"""
+    return value is None or (isinstance(value, float) and math.isnan(value))
 
-        # Create entity identifiers
-        identifiers = [
-            ('phone', row['phone'], None),
-            ('user_id', row['facebook_id'], facebook_authority.id)
-        ]
+def write_bulk_batch(session, batch, source_id=None):
+    """Write (name, meta_data, person_data, identifiers, raw) tuples as entities, persons, entity identifiers and artifacts"""
+    connection = session.connection()
+    artifact_ids = upsert_artifacts(connection, source_id, [row[4] for row in batch])
+    entity_ids = allocate_ids(connection, Entity.__table__, len(batch))
 
+    entity_rows = []
+    person_rows = []
+    identifier_rows = []
+    person_columns = [column.name for column in Person.__table__.columns if column.name != 'id']
+    for entity_id, (name, meta_data, person_data, identifiers, raw) in zip(entity_ids, batch):
+        entity_rows.append((entity_id, 'person', name, meta_data, artifact_ids.get(raw)))
+        person_data = dict(person_data, entity_id=entity_id)
+        person_rows.append(tuple(person_data.get(column) for column in person_columns))
         for id_type, id_value, authority_id in identifiers:
-            if pd.notna(id_value):
-                identifier = EntityIdentifier(
-                    entity_id=entity.id,
-                    authority_id=authority_id,
-                    identifier_type=id_type,
-                    identifier_value=str(id_value)
-                )
-                session.add(identifier)
-
-        # Commit every 500 rows to avoid large transactions
-        if _ % 500 == 0:
-            session.commit()
+            identifier_rows.append((entity_id, authority_id, id_type, id_value))
 
-    session.commit()
-    session.close()
+    bulk_insert(connection, Entity.__table__, ['id', 'type', 'name', 'meta_data', 'artifact_id'], entity_rows)
+    bulk_insert(connection, Person.__table__, person_columns, person_rows)
+    bulk_insert(connection, EntityIdentifier.__table__, ['entity_id', 'authority_id', 'identifier_type', 'identifier_value'], identifier_rows)
 
-def get_or_create_location(session, geocode, location_cache, location_name):
-    # Try to geocode the location
-    geocoded_results = geocode.decode(location_name)
-
-    if geocoded_results:
-        # If we have results, select the best one
-        priority_order = ['city', 'place', 'admin3', 'admin2', 'admin1', 'country']
-        selected_result = next((result for priority in priority_order for result in geocoded_results if result['location_type'] == priority), geocoded_results[0])
-
-        geoname_id = selected_result['geoname_id']
-        
-        # Check if the location is already in the cache
-        if geoname_id in location_cache:
-            return location_cache[geoname_id]
-        
-        # Check if the location with this geoname_id already exists in the database
-        existing_location = session.query(Location).filter_by(geoname_id=geoname_id).first()
-        if existing_location:
-            location_cache[geoname_id] = existing_location.id
-            return existing_location.id
-
-        # Create a new entity for the location
-        location_entity = Entity(type='location', name=selected_result['name'], meta_data=json.dumps(selected_result))
-        session.add(location_entity)
-        session.flush()  # This will assign an ID to the entity
-
-        # Create a new location
-        location = Location(
-            entity_id=location_entity.id,
-            name=selected_result['name'].title(),
-            official_name=selected_result['official_name'],
-            country_code=selected_result['country_code'],
-            longitude=selected_result['longitude'],
-            latitude=selected_result['latitude'],
-            geoname_id=geoname_id,
-            location_type=selected_result['location_type'],
-            population=selected_result['population']
-        )
-        session.add(location)
-        session.flush()  # This will assign an ID to the location
-        location_cache[geoname_id] = location.id
-        return location.id
+def upsert_artifacts(connection, source_id, contents):
+    """Store the distinct contents (e.g. raw dump lines; None is ignored) as artifacts, returns {content: artifacts.id}.
+
+    Artifacts are keyed by the SHA-256 of their content, backed by the unique index on
+    artifacts.content_hash, and inserted with INSERT ... ON CONFLICT DO NOTHING like locations, so
+    content stored before (by this load, a rerun or a parallel loader) is referenced, not stored again.
+    """
+    hashes = {}
+    for content in contents:
+        if content is not None and content not in hashes:
+            hashes[content] = hashlib.sha256(content.encode('utf-8')).digest()
+    if not hashes:
+        return {}
+
+    artifact_table = Artifact.__table__
+    dialect_insert = {'postgresql': pg_insert, 'sqlite': sqlite_insert}.get(connection.dialect.name)
+    rows = [{'source_id': source_id, 'type': 'account_dump', 'content': content, 'content_hash': content_hash}
+            for content, content_hash in hashes.items()]
+    if dialect_insert is not None:
+        statement = dialect_insert(artifact_table).on_conflict_do_nothing(index_elements=['content_hash'])
     else:
-        print(f"Could not geocode location: {location_name}")
-        return None
+        # No upsert support, rely on the unique index
+        statement = artifact_table.insert()
+    # One cached statement for all rows, sent as multi-row INSERTs by the executemany (insertmanyvalues) support
+    statement = statement.returning(artifact_table.c.content_hash, artifact_table.c.id)
+    ids = {}
+    for i in range(0, len(rows), ARTIFACT_BATCH_SIZE):
+        ids.update(connection.execute(statement, rows[i:i + ARTIFACT_BATCH_SIZE]).all())
+    metrics.count('artifacts_created', len(ids))
+
+    # Content stored before
+    existing = [content_hash for content_hash in hashes.values() if content_hash not in ids]
+    metrics.count('artifacts_reused', len(existing))
+    for i in range(0, len(existing), ARTIFACT_BATCH_SIZE):
+        result = connection.execute(select(artifact_table.c.content_hash, artifact_table.c.id)
+                                    .where(artifact_table.c.content_hash.in_(existing[i:i + ARTIFACT_BATCH_SIZE])))
+        ids.update(result.all())
+    return {content: ids[content_hash] for content, content_hash in hashes.items()}
+
+def select_geocode_result(geocoded_results):
+    # If we have results, select the best one
+    priority_order = ['city', 'place', 'admin3', 'admin2', 'admin1', 'country']
+    return next((result for priority in priority_order for result in geocoded_results if result['location_type'] == priority), geocoded_results[0])
+
+def load_location_ids(session):
+    """Map of geoname_id -> locations.id for all known locations, in a single query"""
+    return {geoname_id: location_id for geoname_id, location_id in session.query(Location.geoname_id, Location.id)}
+
+def upsert_locations(session, location_cache, selected_results, compact_metadata=True):
+    """Create the locations (and their entities) for geocode results whose geoname_id is not in location_cache.
+
+    Locations are inserted in batches with INSERT ... ON CONFLICT (geoname_id) DO NOTHING, backed by
+    the unique index on locations.geoname_id, so parallel loaders never create duplicates. Entities
+    are only created for the locations this call actually inserted. All fields of a geocode result are
+    columns of locations, so with compact_metadata the entities get no meta_data.
+    """
+    connection = session.connection()
+    missing = {}
+    for result in selected_results:
+        geoname_id = int(result['geoname_id'])
+        if geoname_id not in location_cache:
+            missing.setdefault(geoname_id, result)
+    metrics.count('location_cache_hits', len(selected_results) - len(missing))
+    metrics.count('location_cache_misses', len(missing))
+    if not missing:
+        return
+
+    location_table = Location.__table__
+    dialect_insert = {'postgresql': pg_insert, 'sqlite': sqlite_insert}.get(connection.dialect.name)
+    rows = [{
+        'name': result['name'].title(),
+        'official_name': result['official_name'],
+        'country_code': result['country_code'],
+        'longitude': result['longitude'],
+        'latitude': result['latitude'],
+        'geoname_id': geoname_id,
+        'location_type': result['location_type'],
+        'population': result['population'],
+    } for geoname_id, result in missing.items()]
+
+    inserted = []
+    for i in range(0, len(rows), LOCATION_BATCH_SIZE):
+        batch = rows[i:i + LOCATION_BATCH_SIZE]
+        if dialect_insert is not None:
+            statement = dialect_insert(location_table).values(batch).on_conflict_do_nothing(index_elements=['geoname_id'])
+        else:
+            # No upsert support, rely on the unique index and the map loaded at startup
+            statement = location_table.insert().values(batch)
+        inserted.extend(connection.execute(statement.returning(location_table.c.id, location_table.c.geoname_id)).all())
+
+    metrics.count('locations_created', len(inserted))
+
+    # Create a new entity for each inserted location
+    entity_ids = allocate_ids(connection, Entity.__table__, len(inserted))
+    bulk_insert(connection, Entity.__table__, ['id', 'type', 'name', 'meta_data'], [
+        (entity_id, 'location', missing[geoname_id]['name'], None if compact_metadata else missing[geoname_id])
+        for entity_id, (_, geoname_id) in zip(entity_ids, inserted)
+    ])
+    if inserted:
+        connection.execute(
+            location_table.update().where(location_table.c.id == bindparam('location_id')).values(entity_id=bindparam('location_entity_id')),
+            [{'location_id': location_id, 'location_entity_id': entity_id} for entity_id, (location_id, _) in zip(entity_ids, inserted)]
+        )
+
+    # Locations inserted concurrently by another loader
+    for location_id, geoname_id in inserted:
+        location_cache[geoname_id] = location_id
+    conflicting = [geoname_id for geoname_id in missing if geoname_id not in location_cache]
+    if conflicting:
+        result = connection.execute(select(location_table.c.geoname_id, location_table.c.id).where(location_table.c.geoname_id.in_(conflicting)))
+        location_cache.update({geoname_id: location_id for geoname_id, location_id in result})
+
+def resolve_locations(session, geocode, location_cache, chunk, compact_metadata=True):
+    """Map every distinct location string of chunk to its locations.id, creating missing locations in one batch"""
+    # Decode every distinct location string of the chunk once, up front
+    location_names = pd.concat([chunk['current_location'], chunk['origin_location']]).dropna().unique()
+    with metrics.timer('geocode'):
+        geocode.preload(location_names)
+
+        selected_results = {}
+        for location_name in location_names:
+            geocoded_results = geocode.decode(location_name)
+            if geocoded_results:
+                selected_results[location_name] = select_geocode_result(geocoded_results)
+            else:
+                metrics.count('locations_not_geocoded')
+                log.debug(f"Could not geocode location: {location_name}")
+    with metrics.timer('upsert_locations'):
+        upsert_locations(session, location_cache, list(selected_results.values()), compact_metadata)
+    return {location_name: location_cache[int(result['geoname_id'])] for location_name, result in selected_results.items()}
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python src/loader/facebook.py <file_path> <db_url>")
-        sys.exit(1)
-    
-    file_path = sys.argv[1]
-    db_url = sys.argv[2]
-    load_facebook_data(file_path, db_url)
+    parser = argparse.ArgumentParser(description="Load preprocessed Facebook data into the database")
+    parser.add_argument("file_path", help="Path to the preprocessed CSV file (plain, .gz, .zst, .xz or .bz2), or a quoted glob pattern of parts")
+    parser.add_argument("db_url", help="SQLAlchemy database URL")
+    parser.add_argument("--geocode-cache", help="Path to a sqlite file caching decoded locations across runs")
+    parser.add_argument("--geocode-cache-size", type=int, default=100_000, help="Maximum number of decoded locations kept in memory")
+    parser.add_argument("--bulk", action="store_true", help="Write persons in batches with Core executemany / PostgreSQL COPY instead of the ORM")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per batch (and per commit)")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows read from the CSV file at a time")
+    parser.add_argument("--pipeline", action="store_true", help="Overlap reading, geocoding and bulk writes in concurrent stages (implies --bulk)")
+    parser.add_argument("--transform-workers", type=int, default=1, help="Geocode/transform threads in pipeline mode")
+    parser.add_argument("--writers", type=int, default=1, help="Writer threads (database connections) in pipeline mode")
+    parser.add_argument("--queue-size", type=int, default=4, help="Chunks buffered between pipeline stages")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an earlier run and read the file from the beginning")
+    parser.add_argument("--full-metadata", action="store_true",
+                        help="Keep the whole CSV row (including the raw line) in entities.meta_data instead of only the fields not normalized elsewhere")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with instrumented(args):
+        if args.pipeline:
+            load_facebook_data_pipelined(args.file_path, args.db_url, geocode_cache_path=args.geocode_cache, geocode_cache_size=args.geocode_cache_size,
+                                         batch_size=args.batch_size, chunk_size=args.chunk_size, transform_workers=args.transform_workers,
+                                         writers=args.writers, queue_size=args.queue_size, resume=not args.restart,
+                                         compact_metadata=not args.full_metadata)
+        else:
+            load_facebook_data(args.file_path, args.db_url, geocode_cache_path=args.geocode_cache, geocode_cache_size=args.geocode_cache_size,
+                               bulk=args.bulk, batch_size=args.batch_size, chunk_size=args.chunk_size, resume=not args.restart,
+                               compact_metadata=not args.full_metadata)
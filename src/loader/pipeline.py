@@ -0,0 +1,158 @@
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Marks the end of the input on a queue
+_DONE = object()
+
+
+class Stage:
+    """One step of a Pipeline, run by `workers` threads.
+
+    func(item, state) returns the item handed to the next stage (None drops it). If setup is given it
+    is called once per worker thread and its result is passed as state (e.g. a database session);
+    teardown(state) is called when the worker finishes.
+    """
+    def __init__(self, name, func, workers=1, setup=None, teardown=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.setup = setup
+        self.teardown = teardown
+        self.items = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, rows, seconds):
+        with self._lock:
+            self.items += 1
+            self.rows += rows
+            self.busy_seconds += seconds
+
+
+class Pipeline:
+    """Run a source iterator through stages connected by bounded queues.
+
+    Every stage runs in its own threads, so I/O-bound stages (database writes) overlap with the
+    others; the bounded queues provide backpressure, so at most queue_size items wait between two
+    stages and memory stays flat. Throughput and queue depth per stage are logged every
+    report_interval seconds and once at the end. size(item) gives the number of rows in an item.
+    """
+    def __init__(self, source, stages, queue_size=4, report_interval=30, size=len):
+        self.source = source
+        self.stages = stages
+        self.size = size
+        self.report_interval = report_interval
+        self.source_stage = Stage('read', None)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._error = None
+        self._failed = threading.Event()
+        self._finished = threading.Event()
+
+    def _put(self, q, item):
+        # Block while the queue is full, unless another thread failed
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._failed.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._failed.set()
+
+    def _read(self):
+        try:
+            iterator = iter(self.source)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.source_stage.record(self.size(item), time.perf_counter() - start)
+                if not self._put(self.queues[0], item):
+                    return
+            for _ in range(self.stages[0].workers):
+                self._put(self.queues[0], _DONE)
+        except Exception as e:
+            self._fail(e)
+
+    def _work(self, index, stage, remaining):
+        state = None
+        try:
+            if stage.setup:
+                state = stage.setup()
+            inbox = self.queues[index]
+            outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                rows = self.size(item)
+                result = stage.func(item, state)
+                stage.record(rows, time.perf_counter() - start)
+                if outbox is not None and result is not None and not self._put(outbox, result):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if stage.teardown and state is not None:
+                try:
+                    stage.teardown(state)
+                except Exception as e:
+                    self._fail(e)
+        # The last worker of a stage tells the next stage that no more items will come
+        with remaining[1]:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self._put(self.queues[index + 1], _DONE)
+
+    def _report_loop(self, started):
+        while not self._finished.wait(self.report_interval):
+            self.report(started)
+
+    def report(self, started):
+        elapsed = time.perf_counter() - started
+        parts = [f'{self.source_stage.name}: {self.source_stage.rows:,} rows ({self.source_stage.rows / elapsed:,.0f}/s)']
+        for stage, q in zip(self.stages, self.queues):
+            utilization = stage.busy_seconds / (elapsed * stage.workers) if elapsed else 0.0
+            parts.append(f'[queue {q.qsize()}/{q.maxsize}] {stage.name} x{stage.workers}: {stage.rows:,} rows ({stage.rows / elapsed:,.0f}/s, {utilization:.0%} busy)')
+        log.info(' -> '.join(parts))
+
+    def run(self):
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._read, name='pipeline-read', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers, threading.Lock()]
+            threads += [threading.Thread(target=self._work, args=(index, stage, remaining), name=f'pipeline-{stage.name}-{i}', daemon=True)
+                        for i in range(stage.workers)]
+        reporter = threading.Thread(target=self._report_loop, args=(started,), name='pipeline-report', daemon=True)
+        for thread in threads:
+            thread.start()
+        reporter.start()
+        for thread in threads:
+            thread.join()
+        self._finished.set()
+        reporter.join()
+        self.report(started)
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,247 @@
+import csv
+import gzip
+import io
+import shutil
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Columns of the `records` table (see sql/clickhouse-ddl.sql), in the order the preprocessor produces them
+RECORDS_COLUMNS = [
+    ('uuid', 'UUID'),
+    ('origin', 'String'),
+    ('dataset', 'String'),
+    ('ingestion_time', 'DateTime64(3)'),
+    ('origin_time', 'DateTime64(3)'),
+    ('type', 'String'),
+    ('raw', 'String'),
+    ('name', 'String'),
+    ('first_name', 'String'),
+    ('last_name', 'String'),
+    ('phone', 'String'),
+    ('email', 'String'),
+    ('origin_id', 'String'),
+    ('current_location', 'String'),
+    ('birth_location', 'String'),
+    ('date_of_birth', 'Date32'),
+    ('relationship_status', 'String'),
+    ('workplace', 'String'),
+    ('country_code', 'String'),
+]
+
+FORMATS = ['csv', 'rowbinary', 'native', 'parquet']
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+DEFAULT_COMPRESSION = 'zstd' if zstandard else 'gzip'
+
+# Column defaults used for empty dates, as in the DDL: toDateTime64('1900-01-01 00:00:00', 3) and toDate32('1900-01-01')
+SENTINEL_DATETIME64 = np.datetime64('1900-01-01T00:00:00.000', 'ms')
+SENTINEL_DATE32 = np.datetime64('1900-01-01', 'D')
+
+
+def _varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _encode_strings(values):
+    """Length-prefixed UTF-8 values, one bytes object per row"""
+    encoded = [v.encode('utf-8') for v in values]
+    return [(bytes((len(b),)) if len(b) < 0x80 else _varint(len(b))) + b for b in encoded]
+
+
+def _uuid_array(values):
+    """UUIDs as (n, 16) big-endian bytes"""
+    data = bytes.fromhex(''.join(values).replace('-', ''))
+    return np.frombuffer(data, dtype=np.uint8).reshape(len(values), 16)
+
+
+def _datetime_array(values, unit, sentinel):
+    """Parse ISO date(time) strings, replacing empty values by the column default"""
+    parsed = np.array(values, dtype=f'datetime64[{unit}]')
+    parsed[np.isnat(parsed)] = sentinel
+    return parsed
+
+
+def _encode_fixed(array, clickhouse_type):
+    """Fixed-width little-endian encoding of a column as an (n, width) uint8 array"""
+    n = len(array)
+    if clickhouse_type == 'UUID':
+        # ClickHouse stores a UUID as two little-endian UInt64 (high half first)
+        return array.reshape(n, 2, 8)[:, :, ::-1].reshape(n, 16)
+    if clickhouse_type == 'DateTime64(3)':
+        return array.astype('<i8').view(np.uint8).reshape(n, 8)
+    if clickhouse_type == 'Date32':
+        return array.astype('<i4').view(np.uint8).reshape(n, 4)
+    raise ValueError(f'Unsupported fixed-width type {clickhouse_type}')
+
+
+def _typed_columns(columns):
+    """Convert the preprocessor's string columns to typed values per RECORDS_COLUMNS"""
+    typed = []
+    for (_, clickhouse_type), values in zip(RECORDS_COLUMNS, columns):
+        if clickhouse_type == 'UUID':
+            typed.append(_uuid_array(values))
+        elif clickhouse_type == 'DateTime64(3)':
+            typed.append(_datetime_array(values, 'ms', SENTINEL_DATETIME64))
+        elif clickhouse_type == 'Date32':
+            typed.append(_datetime_array(values, 'D', SENTINEL_DATE32))
+        else:
+            typed.append(values)
+    return typed
+
+
+def encode_native_block(columns):
+    """Encode one block in ClickHouse Native format (column by column)"""
+    count = len(columns[0])
+    out = [_varint(len(RECORDS_COLUMNS)), _varint(count)]
+    for (name, clickhouse_type), values in zip(RECORDS_COLUMNS, _typed_columns(columns)):
+        out.extend(_encode_strings([name, clickhouse_type]))
+        if clickhouse_type == 'String':
+            out.extend(_encode_strings(values))
+        else:
+            out.append(_encode_fixed(values, clickhouse_type).tobytes())
+    return b''.join(out)
+
+
+def encode_row_binary(columns):
+    """Encode rows in ClickHouse RowBinary format (row by row)"""
+    encoded = []
+    for (_, clickhouse_type), values in zip(RECORDS_COLUMNS, _typed_columns(columns)):
+        if clickhouse_type == 'String':
+            encoded.append(_encode_strings(values))
+        else:
+            encoded.append([row.tobytes() for row in _encode_fixed(values, clickhouse_type)])
+    return b''.join(b''.join(row) for row in zip(*encoded))
+
+
+def encode_csv(columns, header=False):
+    buffer = io.StringIO(newline='')
+    csv_writer = csv.writer(buffer, quoting=csv.QUOTE_MINIMAL)
+    if header:
+        csv_writer.writerow([name for name, _ in RECORDS_COLUMNS])
+    csv_writer.writerows(zip(*columns))
+    return buffer.getvalue().encode('utf-8')
+
+
+def arrow_table(columns):
+    typed = _typed_columns(columns)
+    arrays = []
+    for (_, clickhouse_type), values in zip(RECORDS_COLUMNS, typed):
+        if clickhouse_type == 'UUID':
+            # From the raw bytes: a bytes ('S16') view would drop trailing NUL bytes of UUIDs ending in 0x00
+            storage = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(values), [None, pa.py_buffer(np.ascontiguousarray(values).tobytes())])
+            arrays.append(pa.ExtensionArray.from_storage(pa.uuid(), storage) if hasattr(pa, 'uuid') else storage)
+        elif clickhouse_type == 'DateTime64(3)':
+            arrays.append(pa.array(values, type=pa.timestamp('ms')))
+        elif clickhouse_type == 'Date32':
+            arrays.append(pa.array(values, type=pa.date32()))
+        else:
+            arrays.append(pa.array(values, type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=[name for name, _ in RECORDS_COLUMNS])
+
+
+class RecordsWriter:
+    """Write preprocessed column batches to a file in one of FORMATS.
+
+    Every batch becomes one compressed block (a Native block, a Parquet row group, or a chunk of
+    the gzip/zstd stream), so the output can be piped straight into
+    `clickhouse-client --query "INSERT INTO records FORMAT <Format>"`. Parquet files aren't wrapped
+    in a compressed stream, compression is the codec of their column chunks instead.
+    Naive timestamps are written as UTC.
+    """
+    def __init__(self, path, output_format='csv', compression='none', header=True):
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown output format {output_format}, expected one of {", ".join(FORMATS)}')
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression}, expected one of {", ".join(COMPRESSIONS)}')
+        if compression == 'zstd' and output_format != 'parquet' and zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        if output_format == 'parquet' and pa is None:
+            raise ImportError('Parquet output requires the pyarrow package')
+        self.path = path
+        self.output_format = output_format
+        self.compression = compression
+        self._header = header and output_format == 'csv'
+        self._file = open(path, 'wb')
+        self._stream = None
+        self._parquet_writer = None
+
+    def _get_stream(self):
+        if self._stream is None:
+            if self.compression == 'gzip':
+                self._stream = gzip.GzipFile(fileobj=self._file, mode='wb')
+            elif self.compression == 'zstd':
+                self._stream = zstandard.ZstdCompressor().stream_writer(self._file, closefd=False)
+            else:
+                self._stream = self._file
+        return self._stream
+
+    def _finish_stream(self):
+        # Close the current compressed member/frame; the underlying file stays open
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        self._stream = None
+
+    def _write_parquet(self, table):
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self._file, table.schema, compression=self.compression)
+        self._parquet_writer.write_table(table)
+
+    def write(self, columns):
+        if self.output_format == 'parquet':
+            if len(columns[0]):
+                self._write_parquet(arrow_table(columns))
+            return
+        if self.output_format == 'csv':
+            data = encode_csv(columns, header=self._header)
+            self._header = False
+        elif not len(columns[0]):
+            return
+        elif self.output_format == 'native':
+            data = encode_native_block(columns)
+        else:
+            data = encode_row_binary(columns)
+        self._get_stream().write(data)
+
+    def append_file(self, path):
+        """Append a file written by another RecordsWriter with the same format and compression and header=False"""
+        if self.output_format == 'parquet':
+            parquet_file = pq.ParquetFile(path)
+            for i in range(parquet_file.num_row_groups):
+                self._write_parquet(parquet_file.read_row_group(i))
+            return
+        if self._header:
+            self.write([[] for _ in RECORDS_COLUMNS])
+        # Compressed members/frames can simply be concatenated
+        self._finish_stream()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self._file, 1024 * 1024)
+
+    def close(self):
+        if self._header:
+            self.write([[] for _ in RECORDS_COLUMNS])
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        self._finish_stream()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
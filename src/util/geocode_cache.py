@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+# Number of locations looked up per SQL statement when pre-resolving
+SQLITE_BATCH_SIZE = 500
+
+
+class GeocodeCache:
+    """Memoizing front for KinoGeocode.decode, keyed by the location string.
+
+    Keeps at most max_size decode results in memory (least recently used are evicted first) and,
+    if cache_path is given, persists every result in a sqlite file that can be shared across loader
+    runs and datasets. Entries are namespaced by the geocode argument hash, so a cache file built
+    with different geocode settings is never reused by mistake.
+
+    The cache file may be used from other threads than the one creating the cache (e.g. the transform
+    workers of the pipelined loader); its queries are serialized by a lock.
+    """
+    def __init__(self, geocode, max_size=100_000, cache_path=None):
+        self.geocode = geocode
+        self.max_size = max_size
+        self.namespace = geocode.argument_hash
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if cache_path:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS decode_cache (namespace TEXT NOT NULL, location TEXT NOT NULL, result TEXT NOT NULL, PRIMARY KEY (namespace, location))')
+            self._db.commit()
+
+    def _remember(self, location_name, results):
+        self._cache[location_name] = results
+        self._cache.move_to_end(location_name)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, location_names):
+        """Fetch persisted results for location_names from the cache file"""
+        found = {}
+        if self._db is None:
+            return found
+        location_names = list(location_names)
+        with self._db_lock:
+            for i in range(0, len(location_names), SQLITE_BATCH_SIZE):
+                batch = location_names[i:i + SQLITE_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                cursor = self._db.execute(f'SELECT location, result FROM decode_cache WHERE namespace = ? AND location IN ({placeholders})', [self.namespace] + batch)
+                for location_name, result in cursor:
+                    found[location_name] = json.loads(result)
+        return found
+
+    def _store(self, results):
+        if self._db is None or not results:
+            return
+        with self._db_lock:
+            self._db.executemany('INSERT OR REPLACE INTO decode_cache (namespace, location, result) VALUES (?, ?, ?)',
+                                 [(self.namespace, location_name, json.dumps(result)) for location_name, result in results.items()])
+            self._db.commit()
+
+    def decode(self, location_name):
+        if location_name in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(location_name)
+            return self._cache[location_name]
+        persisted = self._load([location_name])
+        if location_name in persisted:
+            self.disk_hits += 1
+            results = persisted[location_name]
+        else:
+            self.misses += 1
+            results = self.geocode.decode(location_name)
+            self._store({location_name: results})
+        self._remember(location_name, results)
+        return results
+
+    def preload(self, location_names):
+        """Resolve all distinct location_names in one batch before row processing starts"""
+        pending = {name for name in location_names if isinstance(name, str)} - self._cache.keys()
+        persisted = self._load(pending)
+        missing = list(pending - persisted.keys())
+        if hasattr(self.geocode, 'decode_batch'):
+            decoded = dict(zip(missing, self.geocode.decode_batch(missing)))
+        else:
+            decoded = {name: self.geocode.decode(name) for name in missing}
+        self._store(decoded)
+        self.disk_hits += len(persisted)
+        self.misses += len(decoded)
+        for location_name, results in {**persisted, **decoded}.items():
+            self._remember(location_name, results)
+        log.info(f'Pre-resolved {len(pending):,} locations ({len(persisted):,} from cache file, {len(decoded):,} decoded)')
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups answered from memory or the cache file"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def log_stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        log.info(f'Geocode cache: {lookups:,} lookups, {self.hits:,} memory hits, {self.disk_hits:,} cache file hits, {self.misses:,} misses ({self.hit_rate:.1%} hit rate)')
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        if hasattr(self.geocode, 'close'):
+            self.geocode.close()
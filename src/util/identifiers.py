@@ -0,0 +1,71 @@
+import re
+import unicodedata
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(value):
+    """E.164 form ('+' and digits) of a phone number that includes its country code.
+
+    Accepts the formats found in dumps: '41580043456', '+41 58 004 34 56', '0041 58 004 34 56'.
+    Numbers in national format start with the trunk prefix 0 ('079 123 45 67'), which no country code
+    does. Their country is unknown, so they keep only their digits ('0791234567'), without the '+'.
+    """
+    digits = NON_DIGITS.sub('', str(value))
+    if digits.startswith('00'):
+        # International call prefix
+        digits = digits.lstrip('0')
+    elif digits.startswith('0'):
+        return digits
+    return '+' + digits if digits else None
+
+
+def normalize_email(value):
+    value = str(value).strip().lower()
+    return value or None
+
+
+def normalize_default(value):
+    value = str(value).strip()
+    return value or None
+
+
+NORMALIZERS = {
+    'phone': normalize_phone,
+    'email': normalize_email,
+}
+
+
+def normalize_identifier(identifier_type, value):
+    """Canonical form of an identifier value as stored in entity_identifiers, None if it is empty"""
+    return NORMALIZERS.get(identifier_type, normalize_default)(value)
+
+
+# Soundex digit of each consonant, vowels (and h, w, y) have none
+SOUNDEX_CODES = {letter: str(digit) for digit, letters in enumerate(['', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'], 0) for letter in letters}
+
+
+def fold_name(value):
+    """Lowercase name without accents or punctuation ('Jörg-Peter ' -> 'jorg peter'), None if it is empty"""
+    if not isinstance(value, str):
+        return None
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    letters = ''.join(c if c.isalnum() else ' ' for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(letters.split()) or None
+
+
+def soundex(value):
+    """Soundex code of a folded name ('muller' -> 'M460'); names in other scripts are returned as they are"""
+    letters = [c for c in value if 'a' <= c <= 'z']
+    if not letters:
+        return value
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+        # h and w don't separate equal codes, vowels do
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
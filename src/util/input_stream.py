@@ -0,0 +1,188 @@
+import bz2
+import glob
+import io
+import lzma
+import os
+import queue
+import re
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed bytes read from disk at a time
+READ_SIZE = 4 * 1024 * 1024
+# Decompressed blocks buffered between the decompression thread and the reader
+QUEUE_BLOCKS = 8
+# Buffer of the BufferedReader wrapped around the stream
+BUFFER_SIZE = 1024 * 1024
+
+COMPRESSED_EXTENSIONS = ['.gz', '.zst', '.xz', '.bz2']
+
+# Pieces of a split file (dump.txt.001, dump.txt.gz.002, ...), joined before decompressing
+PART_SUFFIX = re.compile(r'\.\d+$')
+
+
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def expand_inputs(pattern):
+    """Input files for a path or a glob pattern, numbered parts in numeric order"""
+    if not glob.has_magic(pattern):
+        return [pattern]
+    paths = sorted(glob.glob(pattern), key=_natural_key)
+    if not paths:
+        raise FileNotFoundError(f"No input files match {pattern}")
+    return paths
+
+
+def input_size(pattern):
+    """Size on disk (compressed) of all input files of pattern"""
+    return sum(os.path.getsize(path) for path in expand_inputs(pattern))
+
+
+def is_plain_file(pattern):
+    """True if pattern is a single uncompressed file, which can be read at arbitrary offsets"""
+    paths = expand_inputs(pattern)
+    return len(paths) == 1 and _extension(paths[0]) not in COMPRESSED_EXTENSIONS and not PART_SUFFIX.search(paths[0])
+
+
+def _extension(path):
+    return os.path.splitext(PART_SUFFIX.sub('', path))[1].lower()
+
+
+def _decompressor(path):
+    """New decompressor for the format of path (by extension), None for plain files"""
+    extension = _extension(path)
+    if extension == '.gz':
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if extension == '.xz':
+        return lzma.LZMADecompressor()
+    if extension == '.bz2':
+        return bz2.BZ2Decompressor()
+    if extension == '.zst':
+        if zstandard is None:
+            raise ImportError(f"Reading {path} requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def _groups(paths):
+    """Split paths into logical files: consecutive numbered parts of the same name form one file"""
+    groups = []
+    for path in paths:
+        if groups and PART_SUFFIX.search(path) and PART_SUFFIX.sub('', path) == PART_SUFFIX.sub('', groups[-1][-1]):
+            groups[-1].append(path)
+        else:
+            groups.append([path])
+    return groups
+
+
+class DecompressingReader(io.RawIOBase):
+    """Raw stream over the concatenated, decompressed contents of the input files.
+
+    A background thread reads READ_SIZE compressed bytes at a time and decompresses them (zlib, lzma,
+    bz2 and zstandard release the GIL while doing so), so decompression overlaps with parsing in the
+    reading thread. At most QUEUE_BLOCKS decompressed blocks are buffered. compressed_bytes_read is the
+    amount of input consumed up to the data returned so far, for progress reporting.
+    """
+    def __init__(self, paths, read_size=READ_SIZE, queue_blocks=QUEUE_BLOCKS):
+        super().__init__()
+        self.paths = paths
+        self.read_size = read_size
+        self.compressed_bytes_read = 0
+        self._queue = queue.Queue(maxsize=queue_blocks)
+        self._block = memoryview(b'')
+        self._error = None
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, name='decompress', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def _decompress(self):
+        position = 0
+        try:
+            for group in _groups(self.paths):
+                decompressor = _decompressor(group[0])
+                # Whether the current compressed stream has been started and not yet ended
+                in_stream = False
+                for path in group:
+                    with open(path, 'rb', buffering=0) as f:
+                        while not self._stop.is_set():
+                            data = f.read(self.read_size)
+                            if not data:
+                                break
+                            position += len(data)
+                            if decompressor is None:
+                                self._put((data, position))
+                                continue
+                            # Concatenated streams (e.g. multi-member gzip): start over after each one
+                            while data:
+                                output = decompressor.decompress(data)
+                                in_stream = True
+                                if output:
+                                    self._put((output, position))
+                                if not getattr(decompressor, 'eof', False):
+                                    break
+                                data = decompressor.unused_data
+                                decompressor = _decompressor(group[0])
+                                in_stream = False
+                # Like gzip.open, don't pass a truncated file off as complete (older zstandard versions can't tell)
+                if in_stream and not self._stop.is_set() and not getattr(decompressor, 'eof', True):
+                    raise EOFError(f'{group[-1]}: compressed stream ended before the end marker')
+        except Exception as e:
+            self._error = e
+        self._put((None, position))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._eof:
+                return 0
+            data, self.compressed_bytes_read = self._queue.get()
+            if data is None:
+                self._eof = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._block = memoryview(data)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self):
+        self._stop.set()
+        super().close()
+
+
+def open_input(pattern, mode='rt', encoding='utf-8'):
+    """Open a plain or compressed (.gz, .zst, .xz, .bz2) input file, or all files of a glob pattern as one stream.
+
+    Numbered parts (dump.txt.001, dump.txt.002 or dump.gz.001, ...) are joined before decompressing.
+    mode is 'rt' (text, universal newlines) or 'rb'. Use bytes_consumed(stream) for progress.
+    """
+    stream = io.BufferedReader(DecompressingReader(expand_inputs(pattern)), buffer_size=BUFFER_SIZE)
+    if mode == 'rb':
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding)
+
+
+def bytes_consumed(stream):
+    """Compressed bytes of input consumed by a stream returned by open_input"""
+    raw = stream.buffer.raw if isinstance(stream, io.TextIOWrapper) else stream.raw
+    return raw.compressed_bytes_read
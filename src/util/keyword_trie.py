@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Key of the keyword of a trie node, as in flashtext's trie dicts
+KEYWORD = '_keyword_'
+
+
+class KeywordTrie:
+    """Read-only, memory-mapped form of the trie of a flashtext KeywordProcessor with integer keywords.
+
+    The nodes are stored as numpy arrays: the children of node n are child_chars (code points) and
+    child_nodes in child_offsets[n]:child_offsets[n + 1], and keywords[n] is its keyword (-1 if none).
+    Like GeonamesArrays the files are memory-mapped, so opening the trie is instant and its pages are
+    shared by all processes using it. A node is turned into a dict the first time a search reaches it.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.non_word_boundaries = set(manifest['non_word_boundaries'])
+        self.case_sensitive = manifest['case_sensitive']
+        self.child_offsets, self.child_chars, self.child_nodes, self.keywords = (
+            np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ['child_offsets', 'child_chars', 'child_nodes', 'keywords'])
+        self._nodes = {}
+        self._root = self._node(0)
+
+    @staticmethod
+    def write(path, keyword_processor):
+        """Write the trie of keyword_processor, whose clean names are integers (or their strings), to path"""
+        child_offsets = [0]
+        child_chars = []
+        child_nodes = []
+        keywords = []
+        # Breadth first, so node ids are positions in this list
+        nodes = [keyword_processor.keyword_trie_dict]
+        for node in nodes:
+            keywords.append(int(node.get(keyword_processor._keyword, -1)))
+            for char, child in sorted((char, child) for char, child in node.items() if char != keyword_processor._keyword):
+                child_chars.append(ord(char))
+                child_nodes.append(len(nodes))
+                nodes.append(child)
+            child_offsets.append(len(child_chars))
+
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'child_offsets.npy'), np.array(child_offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'child_chars.npy'), np.array(child_chars, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'child_nodes.npy'), np.array(child_nodes, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'keywords.npy'), np.array(keywords, dtype=np.int32))
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump({'non_word_boundaries': sorted(keyword_processor.non_word_boundaries),
+                       'case_sensitive': keyword_processor.case_sensitive}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    def _node(self, node_id):
+        """Dict of the children (char -> node id) and keyword of a node, read from the arrays on first use"""
+        try:
+            return self._nodes[node_id]
+        except KeyError:
+            pass
+        begin, end = int(self.child_offsets[node_id]), int(self.child_offsets[node_id + 1])
+        node = dict(zip(map(chr, self.child_chars[begin:end].tolist()), self.child_nodes[begin:end].tolist()))
+        keyword = int(self.keywords[node_id])
+        if keyword >= 0:
+            node[KEYWORD] = keyword
+        self._nodes[node_id] = node
+        return node
+
+    def extract_keywords(self, sentence):
+        """Keywords found in sentence, the same as KeywordProcessor.extract_keywords (as integers)"""
+        keywords_extracted = []
+        if not sentence:
+            return keywords_extracted
+        if not self.case_sensitive:
+            sentence = sentence.lower()
+        non_word_boundaries = self.non_word_boundaries
+        root = self._root
+        current_dict = root
+        sequence_end_pos = 0
+        idx = 0
+        sentence_len = len(sentence)
+        # flashtext's loop, with child node ids looked up through _node
+        while idx < sentence_len:
+            char = sentence[idx]
+            if char not in non_word_boundaries:
+                if KEYWORD in current_dict or char in current_dict:
+                    longest_sequence_found = None
+                    is_longer_seq_found = False
+                    if KEYWORD in current_dict:
+                        longest_sequence_found = current_dict[KEYWORD]
+                        sequence_end_pos = idx
+                    if char in current_dict:
+                        current_dict_continued = self._node(current_dict[char])
+                        idy = idx + 1
+                        while idy < sentence_len:
+                            inner_char = sentence[idy]
+                            if inner_char not in non_word_boundaries and KEYWORD in current_dict_continued:
+                                longest_sequence_found = current_dict_continued[KEYWORD]
+                                sequence_end_pos = idy
+                                is_longer_seq_found = True
+                            if inner_char in current_dict_continued:
+                                current_dict_continued = self._node(current_dict_continued[inner_char])
+                            else:
+                                break
+                            idy += 1
+                        else:
+                            if KEYWORD in current_dict_continued:
+                                longest_sequence_found = current_dict_continued[KEYWORD]
+                                sequence_end_pos = idy
+                                is_longer_seq_found = True
+                        if is_longer_seq_found:
+                            idx = sequence_end_pos
+                    current_dict = root
+                    if longest_sequence_found is not None:
+                        keywords_extracted.append(longest_sequence_found)
+                else:
+                    current_dict = root
+            elif char in current_dict:
+                current_dict = self._node(current_dict[char])
+            else:
+                current_dict = root
+                # Skip to the end of the word
+                idy = idx + 1
+                while idy < sentence_len:
+                    char = sentence[idy]
+                    if char not in non_word_boundaries:
+                        break
+                    idy += 1
+                idx = idy
+            if idx + 1 >= sentence_len and KEYWORD in current_dict:
+                keywords_extracted.append(current_dict[KEYWORD])
+            idx += 1
+        return keywords_extracted
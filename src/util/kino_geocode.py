@@ -2,88 +2,311 @@ from geocode.geocode import Geocode
 from geocode.flags import flags
 
 from typing import override
+import json
 import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import urllib.request
+import zipfile
 
 import pandas as pd
 import pickle
 import numpy as np
 
+from src.util.keyword_trie import KeywordTrie
+from src.util.spatial_index import SpatialIndex
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)-5.5s] [%(name)-12.12s]: %(message)s')
 log = logging.getLogger(__name__)
 
+# Rows of allCountries processed at a time. pandas' CSV parser boxes strings in blocks of 32768 rows for
+# the 19 column dump and shares equal strings within a block; keeping chunks a multiple of that block
+# keeps the string sharing, and hence the pickled bytes, identical to reading the whole file at once
+GEONAMES_CHUNK_SIZE = 32 * 32768
+
+# Location types reverse_geocode_batch can return
+REVERSE_GEOCODE_LOCATION_TYPES = ['city', 'place']
+
+# Geocode instance of a decode_batch worker process, loaded by _init_batch_worker
+_batch_geocode = None
+
+def _init_batch_worker(args, kwargs):
+    global _batch_geocode
+    _batch_geocode = KinoGeocode(*args, **kwargs)
+    _batch_geocode.load()
+
+def _match_indices_chunk(input_texts):
+    return [_batch_geocode.match_indices(text) for text in input_texts]
+
+
+class GeonamesArrays:
+    """Read-only, memory-mapped columnar view of the geonames data.
+
+    Behaves like the pickled list of rows (len() and indexing return a row list in
+    geo_data_field_names order), but the columns are memory-mapped numpy arrays, so loading is
+    near-instant and the pages are shared between processes. String fields are stored as ids into a
+    single deduplicated string table; missing values (id -1) are returned as NaN like in the pickle.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.field_names = manifest['field_names']
+        self.field_kinds = manifest['field_kinds']
+        self.columns = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in self.field_names]
+        self.string_offsets = np.load(os.path.join(path, 'string_offsets.npy'), mmap_mode='r')
+        self.string_data = np.load(os.path.join(path, 'string_data.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def string(self, string_id):
+        if string_id < 0:
+            return np.nan
+        return self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]].tobytes().decode('utf-8', 'surrogatepass')
+
+    def __getitem__(self, idx):
+        row = []
+        for kind, column in zip(self.field_kinds, self.columns):
+            value = column[idx]
+            if kind == 'str':
+                row.append(self.string(int(value)))
+            elif kind == 'int':
+                row.append(int(value))
+            else:
+                row.append(float(value))
+        return row
+
+    @staticmethod
+    def write(path, field_names, geo_data):
+        """Write rows (as in the geonames pickle) to path in columnar form"""
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        strings = {}
+        field_kinds = []
+        for i, name in enumerate(field_names):
+            values = [row[i] for row in geo_data]
+            if any(isinstance(v, str) for v in values):
+                kind = 'str'
+                column = np.array([strings.setdefault(v, len(strings)) if isinstance(v, str) else -1 for v in values], dtype=np.int32)
+            elif all(isinstance(v, (int, np.integer)) for v in values):
+                kind = 'int'
+                column = np.array(values, dtype=np.int64)
+            else:
+                kind = 'float'
+                column = np.array(values, dtype=np.float64)
+            field_kinds.append(kind)
+            np.save(os.path.join(tmp_path, f'{name}.npy'), column)
+        # surrogatepass: some geonames strings hold lone surrogates, kept as is like in the pickle
+        encoded = [s.encode('utf-8', 'surrogatepass') for s in strings]
+        np.save(os.path.join(tmp_path, 'string_offsets.npy'), np.concatenate([[0], np.cumsum([len(b) for b in encoded], dtype=np.int64)]).astype(np.int64))
+        np.save(os.path.join(tmp_path, 'string_data.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump({'field_names': field_names, 'field_kinds': field_kinds}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
 
 class KinoGeocode(Geocode):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, geonames_format='pickle', **kwargs):
+        """geonames_format='mmap' loads the geonames data and the keyword trie memory-mapped (GeonamesArrays,
+        KeywordTrie) instead of unpickling them"""
         super().__init__(*args, **kwargs)
+        self.geonames_format = geonames_format
+        self._spatial_index = None
+        # decode_batch workers construct and load their own instance from these
+        self._arguments = (args, dict(kwargs, geonames_format=geonames_format))
+        self._pool = None
+        self._pool_size = 0
+        self._pool_lock = threading.Lock()
+
+    @property
+    def geonames_arrays_path(self):
+        return self.get_cache_path(f'geonames_{self.argument_hash}.arrays')
+
+    @property
+    def keyword_trie_path(self):
+        return self.get_cache_path(f'geonames_keyword_trie_{self.argument_hash}')
 
     @override
-    def create_geonames_pickle(self):
-        """Create list of place/country data from geonames data and sort according to priorities"""
-        def is_ascii(s):
-            try:
-                s.encode(encoding='utf-8').decode('ascii')
-            except UnicodeDecodeError:
-                return False
-            else:
-                return True
-        log.info('Reading geo data...')
-        df = self.get_geonames_data()
+    def load(self, recompute=False):
+        if self.geonames_format != 'mmap':
+            return super().load(recompute=recompute)
+        if recompute or not (os.path.isdir(self.geonames_arrays_path) and os.path.isdir(self.keyword_trie_path)):
+            if recompute or not os.path.isfile(self.geonames_pickle_path):
+                self.create_geonames_pickle()
+            if recompute or not os.path.isfile(self.keyword_processor_pickle_path):
+                self.create_keyword_processor_pickle()
+            if recompute or not os.path.isdir(self.geonames_arrays_path):
+                self.create_geonames_arrays()
+            self.create_keyword_trie()
+        self.kp = KeywordTrie(self.keyword_trie_path)
+        self.geo_data = GeonamesArrays(self.geonames_arrays_path)
 
-        # Global filtering
-        log.info('Reading feature class data...')
-        df_features = self.get_feature_names_data()
-        df = df.merge(df_features, on='feature_code', how='left')
-        df.loc[df.geoname_id == '3355338', 'country_code'] = 'NA' # strangely, Namibia is missing the country_code
-        # Apply the following filters:
-        # - only keep places with feature class A (admin) and P (place), and CONT (continent)
-        df = df[
-                (df.feature_code_class.isin(['A', 'P'])) |
-                (df.feature_code.isin(['CONT', 'RGN']))
-                ]
-        # - remove everything below min_population_cutoff
-        df = df[
-                (df['population'] > self.min_population_cutoff) |
-                (df.feature_code.isin(['CONT', 'RGN']))
-                ]
-        # - get rid of items without a country code, usually administrative zones without country codes (e.g. "The Commonwealth")
-        df = df[
-                (~df.country_code.isnull()) |
-                (df.feature_code.isin(['CONT', 'RGN']))
-                ]
-        # - remove certain administrative regions (such as zones, historical divisions, territories)
-        df = df[~df.feature_code.isin(['ZN', 'PCLH', 'TERR'])]
-
-        # Expansion of altnames
-        df['official_name'] = df['name']
-        # - expand alternate names
-        df.loc[:, 'alternatenames'] = df.alternatenames.str.split(',')
-        df['is_altname'] = False
-        _df = df.explode('alternatenames')
-        _df['name'] = _df['alternatenames']
-        _df['is_altname'] = True
-        df = pd.concat([df, _df])
-        df = df.drop(columns=['alternatenames'])
-        log.info(f'... read a total of {len(df):,} location names')
-
-        # Filtering applied to names and altnames
-        log.info('Apply filters...')
-        # - remove all names that are floats/ints
-        df['is_str'] = df.name.apply(lambda s: isinstance(s, str))
+    def match_indices(self, input_text):
+        """Positions in geo_data of the names found in input_text, in priority order"""
+        return sorted(set(int(m) for m in self.kp.extract_keywords(input_text)))
+
+    @override
+    def decode(self, input_text):
+        return [dict(zip(self.geo_data_field_names, self.geo_data[m])) for m in self.match_indices(input_text)]
+
+    def decode_batch(self, input_texts, num_workers=None, min_parallel_size=20_000):
+        """Decode many strings at once, returning one result list per input (same results as decode).
+
+        Every distinct string is matched once. Batches with at least min_parallel_size distinct strings
+        are matched by a pool of num_workers worker processes, which only send back match positions.
+        The pool is started on first use and kept until close(); its workers load this geocoder
+        themselves, which takes no time with geonames_format='mmap'. Non-string inputs (e.g. NaN)
+        decode to an empty list.
+        """
+        distinct = list(dict.fromkeys(text for text in input_texts if isinstance(text, str)))
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if num_workers > 1 and len(distinct) >= min_parallel_size:
+            chunk_size = -(-len(distinct) // (num_workers * 4))
+            chunks = [distinct[i:i + chunk_size] for i in range(0, len(distinct), chunk_size)]
+            pool = self._batch_pool(num_workers)
+            matches = [m for chunk_matches in pool.map(_match_indices_chunk, chunks) for m in chunk_matches]
+        else:
+            matches = [self.match_indices(text) for text in distinct]
+        rows = {}
+        decoded = {}
+        for text, indices in zip(distinct, matches):
+            for m in indices:
+                if m not in rows:
+                    rows[m] = self.geo_data[m]
+            decoded[text] = [dict(zip(self.geo_data_field_names, rows[m])) for m in indices]
+        return [decoded.get(text, []) if isinstance(text, str) else [] for text in input_texts]
+
+    def _batch_pool(self, num_workers):
+        with self._pool_lock:
+            if self._pool is not None and self._pool_size != num_workers:
+                self._stop_pool()
+            if self._pool is None:
+                # Not forked: callers such as the pipelined loader run threads, whose locks a forked
+                # child could inherit in a held state
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = multiprocessing.get_context(method).Pool(num_workers, initializer=_init_batch_worker, initargs=self._arguments)
+                self._pool_size = num_workers
+            return self._pool
+
+    def _stop_pool(self):
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def close(self):
+        """Stop the decode_batch worker processes, if any"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._stop_pool()
+
+    @property
+    def geonames_spatial_index_path(self):
+        return self.get_cache_path(f'geonames_spatial_{self.argument_hash}')
+
+    def spatial_index(self):
+        """SpatialIndex of the cities and places in geo_data (ids are geo_data positions), built on first use"""
+        if self._spatial_index is None:
+            path = self.geonames_spatial_index_path
+            if not os.path.isdir(path) or SpatialIndex(path).manifest['meta'].get('geo_data_size') != len(self.geo_data):
+                self.create_spatial_index()
+            self._spatial_index = SpatialIndex(path)
+        return self._spatial_index
+
+    def create_spatial_index(self):
+        """Index the coordinates of the geonames cities and places, one point per geoname_id (altnames share it)"""
+        log.info(f'Writing geonames spatial index to {self.geonames_spatial_index_path}...')
+        field = self.geo_data_field_names.index
+        if isinstance(self.geo_data, GeonamesArrays):
+            columns = self.geo_data.columns
+            location_type_ids = np.asarray(columns[field('location_type')])
+            wanted_ids = [string_id for string_id in np.unique(location_type_ids).tolist() if self.geo_data.string(string_id) in REVERSE_GEOCODE_LOCATION_TYPES]
+            # Equal strings share an id, so the ids of the geoname_id strings identify geonames too
+            geoname_ids = np.asarray(columns[field('geoname_id')])
+            latitudes, longitudes = np.asarray(columns[field('latitude')]), np.asarray(columns[field('longitude')])
+            is_wanted = np.isin(location_type_ids, wanted_ids)
+        else:
+            geoname_ids = np.array([row[field('geoname_id')] for row in self.geo_data], dtype=object).astype(str)
+            latitudes = np.array([row[field('latitude')] for row in self.geo_data], dtype=np.float64)
+            longitudes = np.array([row[field('longitude')] for row in self.geo_data], dtype=np.float64)
+            is_wanted = np.array([row[field('location_type')] in REVERSE_GEOCODE_LOCATION_TYPES for row in self.geo_data], dtype=bool)
+        positions = np.flatnonzero(is_wanted)
+        # geo_data is in priority order, keep the first row of every geoname
+        _, first = np.unique(geoname_ids[positions], return_index=True)
+        positions = np.sort(positions[first])
+        SpatialIndex.write(self.geonames_spatial_index_path, latitudes[positions], longitudes[positions], positions, geo_data_size=len(self.geo_data))
+
+    def reverse_geocode_batch(self, latitudes, longitudes, max_distance_km=None):
+        """Nearest geonames city or place of every coordinate pair.
+
+        Returns one result per pair: the geo_data row as a dict (like the results of decode) with the
+        distance in km added as distance_km, or None for pairs without coordinates or with no place
+        within max_distance_km.
+        """
+        positions, distances = self.spatial_index().nearest(latitudes, longitudes)
+        rows = {}
+        results = []
+        for position, distance in zip(positions.tolist(), distances.tolist()):
+            if position < 0 or (max_distance_km is not None and distance > max_distance_km):
+                results.append(None)
+                continue
+            if position not in rows:
+                rows[position] = self.geo_data[position]
+            results.append(dict(zip(self.geo_data_field_names, rows[position]), distance_km=distance))
+        return results
+
+    def create_geonames_arrays(self):
+        """Convert the pickled geonames list into memory-mappable columnar arrays"""
+        log.info(f'Writing geonames arrays to {self.geonames_arrays_path}...')
+        GeonamesArrays.write(self.geonames_arrays_path, self.geo_data_field_names, self.get_geonames_pickle())
+
+    def create_keyword_trie(self):
+        """Convert the pickled keyword processor into a memory-mappable KeywordTrie"""
+        log.info(f'Writing keyword trie to {self.keyword_trie_path}...')
+        KeywordTrie.write(self.keyword_trie_path, self.get_keyword_processor_pickle())
+
+    @property
+    def geonames_candidates_path(self):
+        return self.get_cache_path(f'geonames_candidates_{self.argument_hash}.pkl')
+
+    def iter_geonames_data(self, path=None, chunk_size=GEONAMES_CHUNK_SIZE):
+        """Read a geonames dump (allCountries.txt by default, downloading it if needed) in chunks of chunk_size rows"""
+        geonames_data_path = path or self.get_cache_path('allCountries.txt')
+        if path is None and not os.path.isfile(geonames_data_path):
+            # download file
+            url = 'https://download.geonames.org/export/dump/allCountries.zip'
+            log.info(f'Downloading data from {url}')
+            geonames_data_path_zip = self.get_cache_path('allCountries.zip')
+            urllib.request.urlretrieve(url, geonames_data_path_zip)
+            log.info('Extracting data...')
+            with zipfile.ZipFile(geonames_data_path_zip, 'r') as f:
+                f.extractall(self.data_dir)
+            os.remove(geonames_data_path_zip)
+        log.info(f'Reading data from {geonames_data_path}...')
+        dtypes = {'name': str, 'latitude': float, 'longitude': float, 'country_code': str, 'population': int, 'feature_code': str, 'alternatenames': str, 'geoname_id': str}
+        geonames_columns = ['geoname_id', 'name', 'asciiname', 'alternatenames', 'latitude', 'longitude', 'feature_class', 'feature_code', 'country_code', 'cc2', 'admin1', 'admin2', 'admin3', 'admin4', 'population', 'elevation', 'dem', 'timezone', 'modification_date']
+        yield from pd.read_csv(geonames_data_path, names=geonames_columns, sep='\t', dtype=dtypes, usecols=dtypes.keys(), chunksize=chunk_size)
+        if path is None:
+            # remove data file
+            os.remove(geonames_data_path)
+
+    def filter_names(self, df):
+        """Filters applied to names and altnames. All of them only look at the row itself, so they can run chunk by chunk"""
+        # - remove all names that are floats/ints (names are read as str, so only missing altnames are affected)
+        df = df.assign(is_str=df.name.notna())
         df = df[df['is_str']]
         # - only allow 2 character names if 1) name is non-ascii (e.g. Chinese characters) 2) is an alternative name for a country (e.g. UK)
         #   3) is a US state or Canadian province
-        df['is_country'] = df.feature_code.str.startswith('PCL')
-        df['is_ascii'] = df.name.apply(is_ascii)
-        # add "US" manually since it's missing in geonames
-        row_usa = df[df.is_country & (df.name == 'USA')].iloc[0]
-        row_usa['name'] = 'US'
-        df = pd.concat([df, pd.DataFrame.from_records([row_usa])])
+        name_length = df.name.str.len()
+        df = df.assign(is_country=df.feature_code.str.startswith('PCL'), is_ascii=~df.name.str.contains(r'[^\x00-\x7f]', regex=True))
         df = df[
                 (~df.is_ascii) |
-                (df.name.str.len() > 2) |
-                ((df.name.str.len() == 2) & (df.country_code == 'US')) |
-                ((df.name.str.len() == 2) & (df.country_code == 'CA')) |
-                ((df.name.str.len() == 2) & (df.is_country))
+                (name_length > 2) |
+                ((name_length == 2) & (df.country_code.isin(['US', 'CA']) | df.is_country))
                 ]
         # - altnames need to have at least 4 characters (removes e.g. 3-letter codes)
         df = df[~(
@@ -95,27 +318,155 @@ class KinoGeocode(Geocode):
                     )]
         # - remove altnames of insignificant admin levels and of places that are very small
         # set admin level
-        df['admin_level'] = None
-        df.loc[df.feature_code.isin(['PCLI', 'PCLD', 'PCLF', 'PCLS', 'PCLIX', 'PCLX', 'PCL']), 'admin_level'] = 0
-        for admin_level in range(1, 6):
-            df.loc[df.feature_code.isin([f'ADM{admin_level}', f'ADM{admin_level}H']), 'admin_level'] = admin_level
+        admin_level = pd.Series(None, index=df.index, dtype=object)
+        admin_level[df.feature_code.isin(['PCLI', 'PCLD', 'PCLF', 'PCLS', 'PCLIX', 'PCLX', 'PCL'])] = 0
+        for level in range(1, 6):
+            admin_level[df.feature_code.isin([f'ADM{level}', f'ADM{level}H'])] = level
+        df = df.assign(admin_level=admin_level)
         df = df[
                 ~(
                     ((df.is_altname) & (df.admin_level.isin([3,4,5]))) |
                     ((df.is_altname) & (df.feature_code_class == 'P') & (df.population < 100000))
                     )
                 ]
+        return df
+
+    def geonames_candidates(self, df, df_features, position_offset=0):
+        """Apply all per-row filters to a chunk of raw geonames data.
+
+        Returns the surviving names and altnames with their file position (_position) and the position of
+        the altname within its row (_alt_position, -1 for the primary name), which define the order the
+        full-frame implementation would see them in.
+        """
+        df = df.assign(_position=np.arange(position_offset, position_offset + len(df)))
+        df = df.merge(df_features, on='feature_code', how='left')
+        df.loc[df.geoname_id == '3355338', 'country_code'] = 'NA' # strangely, Namibia is missing the country_code
+        # Apply the following filters:
+        # - only keep places with feature class A (admin) and P (place), and CONT (continent)
+        # - remove everything below min_population_cutoff
+        # - get rid of items without a country code, usually administrative zones without country codes (e.g. "The Commonwealth")
+        # - remove certain administrative regions (such as zones, historical divisions, territories)
+        is_cont_or_rgn = df.feature_code.isin(['CONT', 'RGN'])
+        df = df[
+                ((df.feature_code_class.isin(['A', 'P'])) | is_cont_or_rgn) &
+                ((df['population'] > self.min_population_cutoff) | is_cont_or_rgn) &
+                ((~df.country_code.isnull()) | is_cont_or_rgn) &
+                (~df.feature_code.isin(['ZN', 'PCLH', 'TERR']))
+                ]
+
+        # Expansion of altnames, kept apart from the primary names instead of concatenated
+        df = df.assign(official_name=df['name'], is_altname=False)
+        altnames = df.assign(alternatenames=df.alternatenames.str.split(',')).explode('alternatenames')
+        altnames = altnames.assign(name=altnames['alternatenames'], is_altname=True,
+                                   _alt_position=altnames.groupby(level=0).cumcount())
+        df = df.drop(columns=['alternatenames']).assign(_alt_position=-1)
+        altnames = altnames.drop(columns=['alternatenames'])
+        return pd.concat([self.filter_names(df), self.filter_names(altnames)])
+
+    @property
+    def geonames_positions_path(self):
+        return self.get_cache_path(f'geonames_positions_{self.argument_hash}.npz')
+
+    def read_geonames_candidates(self, chunk_size=GEONAMES_CHUNK_SIZE):
+        """Run the per-row filters over allCountries; also returns the file position of every geoname_id"""
+        log.info('Reading feature class data...')
+        df_features = self.get_feature_names_data()
+        candidates = []
+        geoname_ids = []
+        position = 0
+        for chunk in self.iter_geonames_data(chunk_size=chunk_size):
+            candidates.append(self.geonames_candidates(chunk, df_features, position))
+            geoname_ids.append(chunk.geoname_id.astype(np.int32).to_numpy())
+            position += len(chunk)
+            log.info(f'... processed {position:,} geonames rows')
+        geoname_ids = np.concatenate(geoname_ids) if geoname_ids else np.array([], dtype=np.int32)
+        order = np.argsort(geoname_ids, kind='stable')
+        return pd.concat(candidates), df_features, geoname_ids[order], order.astype(np.int32)
+
+    @override
+    def create_geonames_pickle(self, chunk_size=GEONAMES_CHUNK_SIZE):
+        """Create list of place/country data from geonames data and sort according to priorities.
 
+        allCountries is processed chunk_size rows at a time. The rows surviving the per-row filters are
+        kept in geonames_candidates_path so update_geonames_pickle can later apply a modifications file
+        without reprocessing the whole dump.
+        """
+        log.info('Reading geo data...')
+        candidates, df_features, geoname_ids, positions = self.read_geonames_candidates(chunk_size=chunk_size)
+        # keep everything update_geonames_pickle needs: filtered rows, feature names and file positions
+        candidates.to_pickle(self.geonames_candidates_path)
+        df_features.to_pickle(self.get_cache_path('feature_names.pkl'))
+        np.savez(self.geonames_positions_path, geoname_ids=geoname_ids, positions=positions)
+        self.write_geonames_pickle(candidates)
+
+    def update_geonames_pickle(self, modifications_path, deletes_path=None):
+        """Apply a geonames modifications file (and optionally a deletes file) to the last full build.
+
+        Only the modified rows go through the per-row filters again. Modified geonames keep their
+        position, new ones are appended in geoname_id order, as they appear in a fresh allCountries dump,
+        so the result holds the same rows in the same order as a full rebuild (the pickled bytes can differ
+        in how equal strings are shared). The keyword processor (and memory-mapped arrays and keyword
+        trie, if present) are rebuilt from the new pickle.
+        """
+        candidates = pd.read_pickle(self.geonames_candidates_path)
+        df_features = pd.read_pickle(self.get_cache_path('feature_names.pkl'))
+        modifications = pd.concat(self.iter_geonames_data(path=modifications_path))
+        removed_ids = set(modifications.geoname_id)
+        if deletes_path:
+            deletes = pd.read_csv(deletes_path, sep='\t', names=['geoname_id', 'name', 'comment'], dtype=str)
+            removed_ids |= set(deletes.geoname_id)
+            modifications = modifications[~modifications.geoname_id.isin(deletes.geoname_id)]
+        log.info(f'Applying {len(modifications):,} modified and {len(removed_ids) - len(modifications):,} deleted geonames...')
+
+        # modified rows take over the file position of the row they replace, new rows go to the end
+        stored = np.load(self.geonames_positions_path)
+        geoname_ids, positions = stored['geoname_ids'], stored['positions']
+        modifications = modifications.assign(_numeric_id=modifications.geoname_id.astype(np.int32)).sort_values('_numeric_id', kind='stable')
+        modified_ids = modifications.pop('_numeric_id').to_numpy()
+        idx = np.minimum(np.searchsorted(geoname_ids, modified_ids), max(len(geoname_ids) - 1, 0))
+        is_known = (geoname_ids[idx] == modified_ids) if len(geoname_ids) else np.zeros(len(modified_ids), dtype=bool)
+        next_position = positions.max() + 1 if len(positions) else 0
+        new_positions = np.where(is_known, positions[idx] if len(positions) else 0, 0)
+        new_positions[~is_known] = np.arange(next_position, next_position + (~is_known).sum())
+        geoname_ids = np.concatenate([geoname_ids, modified_ids[~is_known]])
+        positions = np.concatenate([positions, new_positions[~is_known]])
+        order = np.argsort(geoname_ids, kind='stable')
+        np.savez(self.geonames_positions_path, geoname_ids=geoname_ids[order], positions=positions[order].astype(np.int32))
+        updated = self.geonames_candidates(modifications, df_features)
+        updated['_position'] = new_positions[updated['_position'].to_numpy()]
+
+        candidates = candidates[~candidates.geoname_id.isin(removed_ids)]
+        candidates = pd.concat([candidates, updated]).sort_values(['is_altname', '_position', '_alt_position'], kind='stable')
+        candidates.to_pickle(self.geonames_candidates_path)
+        self.write_geonames_pickle(candidates)
+        self.create_keyword_processor_pickle()
+        if os.path.isdir(self.geonames_arrays_path):
+            self.create_geonames_arrays()
+        if os.path.isdir(self.keyword_trie_path):
+            self.create_keyword_trie()
+        # geo_data positions changed, the spatial index is rebuilt on next use
+        shutil.rmtree(self.geonames_spatial_index_path, ignore_errors=True)
+        self._spatial_index = None
+
+    def write_geonames_pickle(self, candidates):
+        """Global part of the geonames build: special rows, priorities, sorting and location types"""
+        # primary names first, then altnames, each in file order
+        df = candidates.sort_values(['is_altname', '_position', '_alt_position'], kind='stable').drop(columns=['_position', '_alt_position'])
+        log.info(f'... kept a total of {len(df):,} location names')
+
+        # add "US" manually since it's missing in geonames
+        row_usa = df[df.is_country & (df.name == 'USA')].iloc[0].copy()
+        row_usa['name'] = 'US'
         # Add flags
-        df_countries = df[(df.geoname_id.isin([str(v) for v in flags.values()])) & (~df.is_altname)].copy()
+        df_countries = df[(df.geoname_id.isin([str(v) for v in flags.values()])) & (~df.is_altname)]
+        df_countries = df_countries.drop_duplicates('geoname_id').set_index('geoname_id', drop=False)
+        flag_rows = []
         for flag, geoname_id in flags.items():
-            try:
-                row = df_countries[(df_countries.geoname_id == str(geoname_id))].iloc[0].copy()
-            except IndexError:
-                pass
-            else:
+            if str(geoname_id) in df_countries.index:
+                row = df_countries.loc[str(geoname_id)].copy()
                 row['name'] = flag
-                df = pd.concat([df, pd.DataFrame.from_records([row])])
+                flag_rows.append(row)
+        df = pd.concat([df, pd.DataFrame.from_records([row_usa])[df.columns], pd.DataFrame.from_records(flag_rows)])
 
         # Sort by priorities and drop duplicate names
         # Priorities
@@ -127,28 +478,33 @@ class KinoGeocode(Geocode):
         # 6) continents
         # 7) regions
         # (within each group we will sort according to population size)
-        # Assigning priorities
-        df['priority'] = np.nan
-        df.loc[(df.feature_code == 'RGN'), 'priority'] = 7
-        df.loc[(df.feature_code == 'CONT'), 'priority'] = 6
-        df.loc[(df.feature_code_class == 'A') & (df.admin_level > 1), 'priority'] = 5
-        df.loc[df.feature_code_class == 'P', 'priority'] = 4
-        df.loc[(df.feature_code_class == 'A') & (df.admin_level == 0), 'priority'] = 3
-        df.loc[(df.feature_code_class == 'A') & (df.admin_level == 1), 'priority'] = 2
-        df.loc[(df.population > self.large_city_population_cutoff) & (df.feature_code_class == 'P') & (~df.is_altname), 'priority'] = 1
+        # Assigning priorities (later conditions take precedence, hence the reversed order)
+        is_admin = df.feature_code_class == 'A'
+        is_place = df.feature_code_class == 'P'
+        df['priority'] = np.select([
+            (df.population > self.large_city_population_cutoff) & is_place & (~df.is_altname),
+            is_admin & (df.admin_level == 1),
+            is_admin & (df.admin_level == 0),
+            is_place,
+            is_admin & (df.admin_level > 1),
+            df.feature_code == 'CONT',
+            df.feature_code == 'RGN',
+        ], [1, 2, 3, 4, 5, 6, 7], default=np.nan)
         # Sorting
         log.info('Sorting by priority...')
         df.sort_values(by=['priority', 'population'], ascending=[True, False], inplace=True)
-        # set location_types
-        df['location_type'] = np.nan
-        for admin_level in range(1, 6):
-            df.loc[df.admin_level == admin_level, 'location_type'] = f'admin{admin_level}'
-        df.loc[df.feature_code == 'ADMD', 'location_type'] = 'admin_other'
-        df.loc[df.admin_level == 0, 'location_type'] = 'country'
-        df.loc[(df.population <= self.large_city_population_cutoff) & (df.feature_code_class == 'P'), 'location_type'] = 'place'
-        df.loc[(df.population > self.large_city_population_cutoff) & (df.feature_code_class == 'P'), 'location_type'] = 'city'
-        df.loc[df.feature_code == 'CONT', 'location_type'] = 'continent'
-        df.loc[df.feature_code == 'RGN', 'location_type'] = 'region'
+        # set location_types (again, later conditions take precedence). Labels are taken from one object
+        # array so every row shares the same str object, exactly like scalar .loc assignments
+        location_types = np.array([np.nan, 'region', 'continent', 'city', 'place', 'country', 'admin_other'] + [f'admin{admin_level}' for admin_level in range(5, 0, -1)], dtype=object)
+        location_type_codes = np.select([
+            df.feature_code == 'RGN',
+            df.feature_code == 'CONT',
+            (df.population > self.large_city_population_cutoff) & (df.feature_code_class == 'P'),
+            (df.population <= self.large_city_population_cutoff) & (df.feature_code_class == 'P'),
+            df.admin_level == 0,
+            df.feature_code == 'ADMD',
+        ] + [df.admin_level == admin_level for admin_level in range(5, 0, -1)], range(1, len(location_types)), default=0)
+        df['location_type'] = location_types[location_type_codes]
         if len(df[df.location_type.isna()]) > 0:
             log.warning(f'{len(df[df.location_type.isna()]):,} locations could not be matched to a location_type. These will be ignored.')
         # filter by user-defined location types
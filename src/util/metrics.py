@@ -0,0 +1,284 @@
+from contextlib import contextmanager
+import bisect
+import collections
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = 'kino'
+
+# Stack samples per second taken by the sampling profiler
+SAMPLING_RATE = 100
+
+
+class Histogram:
+    """Counts of observed latencies per LATENCY_BUCKETS bucket, plus their count, sum and maximum"""
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the maximum for the unbounded bucket)"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + [self.max], self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return 0.0
+
+    def state(self):
+        return {'buckets': list(self.buckets), 'count': self.count, 'sum': self.sum, 'max': self.max}
+
+    def merge(self, state):
+        self.buckets = [a + b for a, b in zip(self.buckets, state['buckets'])]
+        self.count += state['count']
+        self.sum += state['sum']
+        self.max = max(self.max, state['max'])
+
+
+class Metrics:
+    """Thread-safe registry of counters, latency histograms and gauges.
+
+    Counters and histograms are keyed by name (histograms by stage, e.g. 'geocode' or 'commit').
+    Gauges are callables evaluated when a snapshot is taken, for values owned by other objects
+    such as cache statistics. Worker processes record into their own Metrics and send state() back
+    to be merge()d.
+    """
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Record the time spent in the with block in the histogram of stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage, iterable):
+        """Yield the items of iterable, recording the time taken to produce each one (e.g. reading a chunk)"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def state(self):
+        with self._lock:
+            return {'counters': dict(self.counters), 'histograms': {stage: h.state() for stage, h in self.histograms.items()}}
+
+    def merge(self, state):
+        with self._lock:
+            self.counters.update(state['counters'])
+            for stage, histogram_state in state['histograms'].items():
+                self.histograms.setdefault(stage, Histogram()).merge(histogram_state)
+
+    def snapshot(self):
+        """Current values as a JSON-serializable dict"""
+        with self._lock:
+            stages = {stage: {
+                'count': h.count,
+                'total_seconds': round(h.sum, 3),
+                'mean_ms': round(h.sum / h.count * 1000, 3) if h.count else 0.0,
+                'p50_ms': round(h.quantile(0.5) * 1000, 3),
+                'p95_ms': round(h.quantile(0.95) * 1000, 3),
+                'max_ms': round(h.max * 1000, 3),
+            } for stage, h in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        gauges = {name: func() for name, func in sorted(self.gauges.items())}
+        return {'uptime_seconds': round(time.time() - self.started, 1), 'counters': counters, 'stages': stages, 'gauges': gauges}
+
+    def prometheus(self):
+        """Current values in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f'# TYPE {PROMETHEUS_PREFIX}_{name}_total counter', f'{PROMETHEUS_PREFIX}_{name}_total {value}']
+            histogram_name = f'{PROMETHEUS_PREFIX}_stage_seconds'
+            if self.histograms:
+                lines.append(f'# TYPE {histogram_name} histogram')
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], h.buckets):
+                    cumulative += count
+                    lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{histogram_name}_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{histogram_name}_count{{stage="{stage}"}} {h.count}')
+        for name, func in sorted(self.gauges.items()):
+            lines += [f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge', f'{PROMETHEUS_PREFIX}_{name} {func()}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write prometheus() to path atomically, for the node_exporter textfile collector"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temp_path, path)
+
+    def emit(self, prometheus_path=None):
+        """Log a snapshot as one JSON line and update the Prometheus file if given"""
+        log.info(f'metrics {json.dumps(self.snapshot(), ensure_ascii=False)}')
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+
+# Registry shared by the loader and preprocessor code of this process
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """Emit the metrics every interval seconds from a background thread while in the with block, and once at the end"""
+    def __init__(self, registry=metrics, interval=60, prometheus_path=None):
+        self.registry = registry
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.registry.emit(self.prometheus_path)
+
+    def __enter__(self):
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name='metrics-report', daemon=True)
+            self._thread.start()
+        return self.registry
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.emit(self.prometheus_path)
+
+
+class StackSampler:
+    """Sample the stacks of all threads SAMPLING_RATE times per second.
+
+    Unlike cProfile this sees every thread (pipeline stages, decompression) at a small constant
+    overhead. The result is written in the folded format read by flamegraph.pl and speedscope.
+    """
+    def __init__(self, rate=SAMPLING_RATE):
+        self.interval = 1 / rate
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = [f'{entry.name} ({os.path.basename(entry.filename)})' for entry in traceback.extract_stack(frame)]
+                self.samples[';'.join([names.get(thread_id, str(thread_id))] + stack)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+@contextmanager
+def profiling(path, mode='cprofile', top=25):
+    """Profile the with block and write the result to path; does nothing if path is None.
+
+    mode 'cprofile' profiles the calling thread with cProfile (open the .prof file with pstats or
+    snakeviz) and logs the top functions by cumulative time. mode 'sampling' samples all threads
+    with StackSampler. Worker processes are not profiled in either mode.
+    """
+    if not path:
+        yield
+        return
+    if mode == 'sampling':
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(path)
+            log.info(f'Wrote {sum(sampler.samples.values()):,} stack samples to {path}')
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(top)
+        log.info(f'Wrote profile to {path}\n{summary.getvalue()}')
+
+
+def add_arguments(parser):
+    """Add the metrics and profiling options used by instrumented() to an argparse parser"""
+    group = parser.add_argument_group('metrics')
+    group.add_argument("--metrics-interval", type=float, default=60, help="Seconds between metrics log lines (0: only at the end)")
+    group.add_argument("--metrics-file", help="Also write the metrics to this file in the Prometheus text format (node_exporter textfile collector)")
+    group.add_argument("--profile", help="Write a profile of the run to this file")
+    group.add_argument("--profile-mode", choices=['cprofile', 'sampling'], default='cprofile',
+                       help="cprofile: cProfile stats of the main thread; sampling: folded stacks of all threads")
+
+
+@contextmanager
+def instrumented(args):
+    """Report metrics and profile the with block as configured by the add_arguments() options"""
+    with MetricsReporter(metrics, args.metrics_interval, args.metrics_file), profiling(args.profile, args.profile_mode):
+        yield metrics
@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Side of the grid cells in degrees
+DEFAULT_CELL_DEGREES = 0.5
+
+# Candidate distances computed at once by nearest(), bounds its memory use
+MAX_MATRIX_SIZE = 4_000_000
+
+
+def haversine_km(latitudes1, longitudes1, latitudes2, longitudes2):
+    """Great-circle distances in km between points given in degrees (numpy arrays, broadcast against each other)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (latitudes1, longitudes1, latitudes2, longitudes2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """Read-only, memory-mapped grid index of points (latitude, longitude, id).
+
+    Points are sorted by grid cell (cell_degrees by cell_degrees) and stored as numpy arrays with the
+    sorted keys of the non-empty cells and their offsets, so a cell's points are found with a binary
+    search. Like GeonamesArrays the files are memory-mapped: opening the index is instant and its
+    pages are shared by all processes using it.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.cell_degrees = self.manifest['cell_degrees']
+        self.lat_cells = round(180 / self.cell_degrees)
+        self.lon_cells = round(360 / self.cell_degrees)
+        self.latitudes, self.longitudes, self.ids, self.cell_keys, self.cell_offsets = (
+            np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ['latitudes', 'longitudes', 'ids', 'cell_keys', 'cell_offsets'])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def write(path, latitudes, longitudes, ids, cell_degrees=DEFAULT_CELL_DEGREES, **meta):
+        """Build the index of the points with the given ids and write it to path; points without coordinates are left out.
+
+        meta is kept in the manifest (e.g. to tell whether the index is stale). cell_degrees must divide 180,
+        so the last column ends at +180 and queries can wrap around the antimeridian.
+        """
+        if not all(math.isclose(degrees / cell_degrees, round(degrees / cell_degrees)) for degrees in (180, 360)):
+            raise ValueError(f'cell_degrees must divide 180 and 360 evenly, got {cell_degrees}')
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        ids = np.asarray(ids, dtype=np.int64)
+        present = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        latitudes, longitudes, ids = latitudes[present], longitudes[present], ids[present]
+
+        lon_cells = round(360 / cell_degrees)
+        keys = _lat_cell(latitudes, cell_degrees) * lon_cells + _lon_cell(longitudes, cell_degrees)
+        order = np.argsort(keys, kind='stable')
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, values in [('latitudes', latitudes[order]), ('longitudes', longitudes[order]), ('ids', ids[order]),
+                             ('cell_keys', cell_keys), ('cell_offsets', np.append(starts, len(order)).astype(np.int64))]:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), values)
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump({'cell_degrees': cell_degrees, 'count': int(len(ids)), 'meta': meta}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    def _segments(self, rows, first_columns, last_columns):
+        """Position ranges [start, end) of the points in columns first_columns..last_columns of grid rows.
+
+        Takes arrays; the column ranges may run past either edge of the grid and wrap around (but span
+        less than the full circle). Returns the starts, the ends and the index of the input each range
+        belongs to, ordered by that index.
+        """
+        main_first = np.maximum(first_columns, 0)
+        main_last = np.minimum(last_columns, self.lon_cells - 1)
+        # The part that wrapped around the antimeridian, empty (last < first) if none
+        wrap_first = np.where(first_columns < 0, first_columns + self.lon_cells, 0)
+        wrap_last = np.where(first_columns < 0, self.lon_cells - 1, np.where(last_columns >= self.lon_cells, last_columns - self.lon_cells, -1))
+        rows = np.concatenate([rows, rows])
+        firsts = np.concatenate([main_first, wrap_first])
+        lasts = np.concatenate([main_last, wrap_last])
+        owners = np.tile(np.arange(len(first_columns)), 2)
+        nonempty = lasts >= firsts
+        rows, firsts, lasts, owners = rows[nonempty], firsts[nonempty], lasts[nonempty], owners[nonempty]
+        # Cells of a row are consecutive keys, so a column range is one contiguous slice of points
+        starts = self.cell_offsets[np.searchsorted(self.cell_keys, rows * self.lon_cells + firsts)]
+        ends = self.cell_offsets[np.searchsorted(self.cell_keys, rows * self.lon_cells + lasts + 1)]
+        occupied = ends > starts
+        order = np.argsort(owners[occupied], kind='stable')
+        return starts[occupied][order], ends[occupied][order], owners[occupied][order]
+
+    def within(self, latitude, longitude, radius_km):
+        """Ids and distances (km) of the points within radius_km of a point, nearest first"""
+        lat_span = radius_km / KM_PER_DEGREE
+        south, north = latitude - lat_span, latitude + lat_span
+        first_column, last_column = 0, self.lon_cells - 1
+        if south > -90 and north < 90:
+            # Widest longitude span of the spherical cap, at its most poleward latitude
+            ratio = math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi / 2)) / math.cos(math.radians(max(abs(south), abs(north))))
+            if ratio < 1:
+                lon_span = math.degrees(math.asin(ratio))
+                first, last = int(_lon_index(longitude - lon_span, self.cell_degrees)), int(_lon_index(longitude + lon_span, self.cell_degrees))
+                if last - first + 1 < self.lon_cells:
+                    first_column, last_column = first, last
+        rows = np.arange(_lat_cell(max(south, -90), self.cell_degrees), _lat_cell(min(north, 90), self.cell_degrees) + 1)
+        starts, ends, _ = self._segments(rows, np.full(len(rows), first_column), np.full(len(rows), last_column))
+        positions, _ = _expand(starts, ends)
+        distances = haversine_km(latitude, longitude, self.latitudes[positions], self.longitudes[positions])
+        inside = distances <= radius_km
+        positions, distances = positions[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return np.asarray(self.ids[positions[order]]), distances[order]
+
+    def nearest(self, latitudes, longitudes):
+        """Id and distance (km) of the nearest point for every query point (-1 and NaN for queries without coordinates).
+
+        Every query is compared with the points of its own cell, all queries at once in one vectorized
+        haversine computation (in slices of MAX_MATRIX_SIZE candidates). The queries whose nearest
+        point could lie outside are compared again with the cells around theirs, in rings doubling in
+        size until they cover the whole grid.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        # In [-180, 180), like the columns
+        longitudes = (np.asarray(longitudes, dtype=np.float64) + 180) % 360 - 180
+        best = np.full(len(latitudes), -1, dtype=np.int64)
+        best_distances = np.full(len(latitudes), np.inf)
+        pending = np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes))) if len(self.ids) else np.empty(0, dtype=np.int64)
+        rows = _lat_cell(latitudes[pending], self.cell_degrees)
+        columns = _lon_cell(longitudes[pending], self.cell_degrees)
+        rings = 0
+        while len(pending):
+            # One column range per query and row of its neighborhood
+            query_rows = rows[:, None] + np.arange(-rings, rings + 1)[None, :]
+            owners = np.repeat(np.arange(len(pending)), 2 * rings + 1)
+            query_rows = query_rows.ravel()
+            valid = (query_rows >= 0) & (query_rows < self.lat_cells)
+            if 2 * rings + 1 >= self.lon_cells:
+                first_columns, last_columns = np.zeros(len(owners), dtype=np.int64), np.full(len(owners), self.lon_cells - 1)
+            else:
+                first_columns, last_columns = np.repeat(columns - rings, 2 * rings + 1), np.repeat(columns + rings, 2 * rings + 1)
+            starts, ends, segment_owners = self._segments(query_rows[valid], first_columns[valid], last_columns[valid])
+            segment_queries = owners[valid][segment_owners]
+
+            # Slices of whole queries with at most MAX_MATRIX_SIZE candidates (or a single query)
+            candidates = np.cumsum(ends - starts)
+            slice_ends = np.searchsorted(candidates, np.arange(MAX_MATRIX_SIZE, candidates[-1] + MAX_MATRIX_SIZE, MAX_MATRIX_SIZE) if len(candidates) else [], side='right')
+            begin = 0
+            for end in slice_ends:
+                if begin >= len(segment_queries):
+                    break
+                # Don't split the segments of a query
+                end = max(end, begin + 1)
+                while end < len(segment_queries) and segment_queries[end] == segment_queries[end - 1]:
+                    end += 1
+                positions, segment = _expand(starts[begin:end], ends[begin:end])
+                queries = pending[segment_queries[begin:end][segment]]
+                distances = haversine_km(latitudes[queries], longitudes[queries], self.latitudes[positions], self.longitudes[positions])
+                # The candidates of a query are contiguous: take the first one at its minimum distance
+                group_starts = np.flatnonzero(np.concatenate([[True], queries[1:] != queries[:-1]]))
+                minima = np.minimum.reduceat(distances, group_starts)
+                at_minimum = np.flatnonzero(distances == np.repeat(minima, np.diff(np.append(group_starts, len(queries)))))
+                first = at_minimum[np.concatenate([[True], queries[at_minimum][1:] != queries[at_minimum][:-1]])]
+                best[queries[first]] = positions[first]
+                best_distances[queries[first]] = distances[first]
+                begin = end
+
+            whole_grid = (2 * rings + 1 >= self.lon_cells) & (rows - rings <= 0) & (rows + rings >= self.lat_cells - 1)
+            covered = self._covered_km(latitudes[pending], longitudes[pending], rows, columns, rings)
+            keep = ~whole_grid & (best_distances[pending] > covered)
+            pending, rows, columns = pending[keep], rows[keep], columns[keep]
+            rings = max(2 * rings, 1)
+        found = best >= 0
+        ids = np.full(len(latitudes), -1, dtype=np.int64)
+        ids[found] = self.ids[best[found]]
+        return ids, np.where(found, best_distances, np.nan)
+
+    def _covered_km(self, latitudes, longitudes, rows, columns, rings):
+        """Distance from each query point within which all points are in its neighborhood (rings cells around its own)"""
+        south = np.where(rows - rings > 0, (latitudes - ((rows - rings) * self.cell_degrees - 90)) * KM_PER_DEGREE, np.inf)
+        north = np.where(rows + rings < self.lat_cells - 1, ((rows + rings + 1) * self.cell_degrees - 90 - latitudes) * KM_PER_DEGREE, np.inf)
+        if 2 * rings + 1 >= self.lon_cells:
+            return np.minimum(south, north)
+        # Distance to the nearest of the two meridians bounding the neighborhood (the closest point of a
+        # meridian more than 90 degrees away is the pole)
+        lon_span = np.minimum(longitudes - ((columns - rings) * self.cell_degrees - 180), (columns + rings + 1) * self.cell_degrees - 180 - longitudes)
+        east_west = EARTH_RADIUS_KM * np.arcsin(np.sin(np.radians(np.minimum(lon_span, 90))) * np.cos(np.radians(latitudes)))
+        return np.minimum(np.minimum(south, north), east_west)
+
+
+def _expand(starts, ends):
+    """All positions of the ranges [start, end), and for each the index of its range"""
+    lengths = ends - starts
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return positions, segment
+
+
+def _lat_cell(latitudes, cell_degrees):
+    return np.minimum(np.floor((np.asarray(latitudes) + 90) / cell_degrees), round(180 / cell_degrees) - 1).astype(np.int64)
+
+
+def _lon_cell(longitudes, cell_degrees):
+    return _lon_index(np.asarray(longitudes), cell_degrees) % round(360 / cell_degrees)
+
+
+def _lon_index(longitudes, cell_degrees):
+    """Column of a longitude before wrapping around, so spans crossing the antimeridian stay contiguous"""
+    return np.floor((longitudes + 180) / cell_degrees).astype(np.int64)
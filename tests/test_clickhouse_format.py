@@ -0,0 +1,49 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.clickhouse_format import RecordsWriter, RECORDS_COLUMNS, arrow_table, pa, pq
+
+pytestmark = pytest.mark.skipif(pa is None, reason='pyarrow is not installed')
+
+# UUIDs ending (and starting) in NUL bytes
+UUIDS = ['0189a0c2-7d3e-7000-8000-000000000000', '00000000-0000-7000-8000-0000000000ff', '0189a0c2-7d3e-7abc-9def-0123456789ab']
+
+
+def records_columns(uuids):
+    values = {'uuid': uuids, 'ingestion_time': ['2024-01-02 03:04:05.678'] * len(uuids), 'origin_time': [''] * len(uuids),
+              'date_of_birth': ['1980-05-06', '', '']}
+    return [values.get(name, [f'{name} {i}' for i in range(len(uuids))]) for name, _ in RECORDS_COLUMNS]
+
+
+def test_arrow_table_keeps_trailing_nul_bytes():
+    table = arrow_table(records_columns(UUIDS))
+    column = table.column('uuid').combine_chunks()
+    storage = column.storage if isinstance(column, pa.ExtensionArray) else column
+    assert [value.as_py() for value in storage] == [uuid.UUID(value).bytes for value in UUIDS]
+
+
+def test_parquet_round_trip(tmp_path):
+    path = str(tmp_path / 'records.parquet')
+    with RecordsWriter(path, output_format='parquet') as writer:
+        writer.write(records_columns(UUIDS))
+    column = pq.read_table(path).column('uuid').combine_chunks()
+    storage = column.storage if isinstance(column, pa.ExtensionArray) else column
+    assert [value.as_py() for value in storage] == [uuid.UUID(value).bytes for value in UUIDS]
+
+
+@pytest.mark.parametrize('compression, codec', [('none', 'UNCOMPRESSED'), ('gzip', 'GZIP'), ('zstd', 'ZSTD')])
+def test_parquet_compression(tmp_path, compression, codec):
+    path = tmp_path / 'records.parquet'
+    with RecordsWriter(str(path), output_format='parquet', compression=compression) as writer:
+        writer.write(records_columns(UUIDS))
+    # Compressed inside the file, not wrapped in a gzip/zstd stream
+    assert path.read_bytes()[:4] == b'PAR1'
+    metadata = pq.ParquetFile(str(path)).metadata
+    assert {metadata.row_group(0).column(i).compression for i in range(metadata.num_columns)} == {codec}
@@ -0,0 +1,64 @@
+import csv
+import os
+import sqlite3
+import sys
+
+import pytest
+import sqlalchemy as sa
+from flashtext import KeywordProcessor
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.kino_geocode import KinoGeocode
+
+# A few geonames rows, in geo_data_field_names order
+GEO_DATA = [
+    ['Zürich', 'Zürich', 'CH', 8.55, 47.36, '2657896', 'city', 341730],
+    ['Geneva', 'Geneva', 'CH', 6.14, 46.20, '2660646', 'city', 183981],
+    ['Switzerland', 'Switzerland', 'CH', 8.0, 47.0, '2658434', 'country', 8000000],
+]
+
+LOCATIONS = ['Zürich, Switzerland', 'Geneva', 'Switzerland', 'Nowhere']
+
+COLUMNS = ['phone', 'facebook_id', 'first_name', 'last_name', 'gender', 'current_location', 'origin_location',
+           'relationship_status', 'workplace', 'email', 'raw']
+
+
+def load_geo_data(self, recompute=False):
+    self.kp = KeywordProcessor()
+    for i, row in enumerate(GEO_DATA):
+        self.kp.add_keyword(row[0], str(i))
+    self.geo_data = GEO_DATA
+
+
+@pytest.fixture
+def facebook(monkeypatch):
+    # Importing the loader loads its geocoder
+    monkeypatch.setattr(KinoGeocode, 'load', load_geo_data)
+    from src.loader import facebook
+    return facebook
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for i in range(rows):
+            writer.writerow(['', 100000 + i, f'First{i}', f'Last{i}', 'male', LOCATIONS[i % len(LOCATIONS)],
+                             LOCATIONS[(i + 1) % len(LOCATIONS)], '', '', f'u{i}@example.org', f'raw {i}'])
+
+
+def test_pipelined_load_with_cache_file(facebook, tmp_path):
+    csv_path = str(tmp_path / 'facebook.csv')
+    cache_path = str(tmp_path / 'geocode.sqlite')
+    write_csv(csv_path, 300)
+    # The cache file is created on this thread and used by the transform workers
+    for name in ['first', 'second']:
+        db_url = f'sqlite:///{tmp_path / name}.db'
+        facebook.load_facebook_data_pipelined(csv_path, db_url, geocode_cache_path=cache_path, chunk_size=50, transform_workers=2)
+        with sa.create_engine(db_url).connect() as connection:
+            assert connection.execute(sa.text('SELECT count(*) FROM persons')).scalar() == 300
+    with sqlite3.connect(cache_path) as db:
+        assert db.execute('SELECT count(*) FROM decode_cache').fetchone()[0] == len(LOCATIONS)
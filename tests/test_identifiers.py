@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.identifiers import normalize_phone
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('41580043456', '+41580043456'),
+    ('+41 58 004 34 56', '+41580043456'),
+    ('0041 58 004 34 56', '+41580043456'),
+    # National format: the country is unknown, so no '+'
+    ('079 123 45 67', '0791234567'),
+    ('+079 123 45 67', '0791234567'),
+    ('', None),
+])
+def test_normalize_phone(value, expected):
+    assert normalize_phone(value) == expected
+
+
+@pytest.mark.parametrize('value', ['41580043456', '0041 58 004 34 56', '079 123 45 67', '+0041 79', '000791'])
+def test_normalize_phone_is_idempotent(value):
+    assert normalize_phone(normalize_phone(value)) == normalize_phone(value)
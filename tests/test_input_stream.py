@@ -0,0 +1,47 @@
+import bz2
+import gzip
+import lzma
+import os
+import sys
+
+import pytest
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.input_stream import open_input, zstandard
+
+COMPRESSORS = {'gz': gzip.compress, 'xz': lzma.compress, 'bz2': bz2.compress}
+if zstandard is not None:
+    COMPRESSORS['zst'] = zstandard.ZstdCompressor().compress
+
+DATA = b''.join(f'{i},row {i}\n'.encode() for i in range(100_000))
+
+
+@pytest.mark.parametrize('extension', COMPRESSORS)
+def test_concatenated_streams(tmp_path, extension):
+    path = tmp_path / f'input.csv.{extension}'
+    compress = COMPRESSORS[extension]
+    path.write_bytes(compress(DATA) + compress(b'last\n'))
+    with open_input(str(path), 'rb') as stream:
+        assert stream.read() == DATA + b'last\n'
+
+
+@pytest.mark.parametrize('extension', COMPRESSORS)
+def test_truncated_input(tmp_path, extension):
+    path = tmp_path / f'input.csv.{extension}'
+    compressed = COMPRESSORS[extension](DATA)
+    path.write_bytes(compressed[:len(compressed) // 2])
+    with open_input(str(path), 'rb') as stream:
+        with pytest.raises(EOFError, match='ended before the end marker'):
+            stream.read()
+
+
+def test_truncated_last_part(tmp_path):
+    compressed = gzip.compress(DATA)
+    (tmp_path / 'input.csv.gz.001').write_bytes(compressed[:len(compressed) // 2])
+    (tmp_path / 'input.csv.gz.002').write_bytes(compressed[len(compressed) // 2:-10])
+    with open_input(str(tmp_path / 'input.csv.gz.*'), 'rb') as stream:
+        with pytest.raises(EOFError):
+            stream.read()
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Add the project root directory to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from src.util.spatial_index import SpatialIndex, haversine_km
+
+# Queries near the antimeridian and the poles, where the grid wraps around
+QUERIES = [(47.0, 179.95), (-33.0, -179.9), (0.0, 180.0), (89.9, 10.0), (-89.5, -170.0), (46.2, 6.1)]
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(0)
+    count = 5000
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    longitudes = rng.uniform(-180, 180, count)
+    return latitudes, longitudes, np.arange(count)
+
+
+@pytest.mark.parametrize('cell_degrees', [0.3, 0.5, 1.0, 7.5])
+def test_matches_brute_force(tmp_path, points, cell_degrees):
+    latitudes, longitudes, ids = points
+    path = str(tmp_path / 'index')
+    SpatialIndex.write(path, latitudes, longitudes, ids, cell_degrees=cell_degrees)
+    index = SpatialIndex(path)
+    for latitude, longitude in QUERIES:
+        distances = haversine_km(latitude, longitude, latitudes, longitudes)
+        found, found_distances = index.within(latitude, longitude, 1500)
+        assert sorted(found.tolist()) == sorted(ids[distances <= 1500].tolist())
+        nearest, nearest_distance = index.nearest([latitude], [longitude])
+        assert nearest_distance[0] == pytest.approx(distances.min())
+
+
+@pytest.mark.parametrize('cell_degrees', [7.0, 0.7, 360 / 7])
+def test_rejects_cells_not_dividing_the_grid(tmp_path, points, cell_degrees):
+    latitudes, longitudes, ids = points
+    with pytest.raises(ValueError, match='cell_degrees'):
+        SpatialIndex.write(str(tmp_path / 'index'), latitudes, longitudes, ids, cell_degrees=cell_degrees)